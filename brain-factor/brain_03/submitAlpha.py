@@ -1,5 +1,12 @@
 from utils.brainLogin import get_session
-from utils.brainSimulationSubmitAlpha import submit_alpha
+from utils.brainSimulationSubmitAlpha import submit_alpha, submit_alphas
 
-session = get_session()
-submit_alpha("o6mqEXn", session)
\ No newline at end of file
+session = get_session(pool_size=12)
+
+# 单个提交，等待检查结果
+print(submit_alpha("o6mqEXn", session))
+
+# 按sharpe从高到低批量提交库中尚未提交的alpha，结果写回数据库
+summary = submit_alphas(session=session, max_concurrency=10, limit=100,
+                        query={'is_metrics.sharpe': {'$gte': 1.5}}, max_correlation=0.7)
+print({key: value for key, value in summary.items() if key != 'results'})
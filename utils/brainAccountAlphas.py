@@ -0,0 +1,136 @@
+"""
+WorldQuant Brain 账户alpha同步工具
+按 dateModified 增量同步账户下的alpha列表到 account_alphas 集合，便于按指标排序查询
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+from typing import Dict, List, Optional
+
+from .brainGetDataFields import iter_offset_pages
+from .brainLogin import API_URL
+
+USER_ALPHAS_URL = f"{API_URL}/users/self/alphas"
+
+# 每页数量（/users/self/alphas 允许的最大 limit）
+PAGE_SIZE = 100
+
+# 同时请求的页数
+DEFAULT_PAGE_WORKERS = 4
+
+# 同步状态在 meta 集合中的 _id
+SYNC_STATE_ID = 'account_alphas_sync'
+
+# 下次同步从水位线往前重叠的时间，覆盖写入稍晚于其修改时间的记录
+# （修改时间与水位线相同的记录由 >= 条件覆盖）
+SYNC_OVERLAP = timedelta(minutes=1)
+
+# 复制到文档顶层、用于排序查询的IS指标
+RANK_METRICS = ('sharpe', 'fitness', 'turnover', 'returns', 'drawdown', 'margin')
+
+def parse_brain_time(value: Optional[str]) -> Optional[datetime]:
+    """把接口返回的ISO时间（带时区）转换为UTC的naive datetime（与MongoDB一致）"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def to_document(alpha: Dict, synced_at: datetime) -> Dict:
+    """
+    把接口返回的alpha转换为 account_alphas 文档
+
+    保留原始字段，另把IS指标、OS sharpe、表达式和时间复制到顶层
+    """
+    is_data = alpha.get('is') or {}
+    os_data = alpha.get('os') or {}
+    doc = dict(alpha)
+    doc['_id'] = alpha['id']
+    for metric in RANK_METRICS:
+        doc[metric] = is_data.get(metric)
+    doc['os_sharpe'] = os_data.get('sharpe')
+    doc['expression'] = (alpha.get('regular') or {}).get('code')
+    doc['date_created'] = parse_brain_time(alpha.get('dateCreated'))
+    doc['date_modified'] = parse_brain_time(alpha.get('dateModified'))
+    doc['synced_at'] = synced_at
+    return doc
+
+def sync_account_alphas(session=None, full: bool = False,
+                        max_workers: int = DEFAULT_PAGE_WORKERS,
+                        overlap: timedelta = SYNC_OVERLAP) -> Dict:
+    """
+    增量同步账户的alpha列表
+
+    只请求 dateModified 不早于上次水位线（减去 overlap）的记录，按修改时间
+    升序分页并发获取，每页收到后立即批量写入。同步期间被修改的alpha会移到列表末尾，
+    可能让其他记录错位而漏掉；取到的不同alpha数量少于总数时不推进水位线，
+    下次同步重新覆盖这段时间
+
+    Args:
+        session: Brain会话对象，默认新建一个
+        full: 是否忽略水位线全量同步
+        max_workers: 同时请求的页数
+        overlap: 从水位线往前重叠的时间
+
+    Returns:
+        dict: 本次获取和写入的数量、新的水位线、耗时
+    """
+    from .brainSimulationRecord import db
+
+    if session is None:
+        from .brainLogin import get_session
+        session = get_session(pool_size=max_workers + 2)
+
+    state = {} if full else db.get_sync_state(SYNC_STATE_ID)
+    watermark = state.get('watermark')
+    params = {'order': 'dateModified', 'hidden': 'false'}
+    if watermark:
+        since = watermark - overlap
+        # 会被编码为 dateModified%3E=...，即 dateModified >= since
+        params['dateModified>'] = since.replace(tzinfo=timezone.utc).isoformat()
+
+    start = perf_counter()
+    synced_at = datetime.utcnow()
+    count, seen, written = 0, set(), 0
+    newest = watermark
+    for offset, page in iter_offset_pages(session, USER_ALPHAS_URL, params, PAGE_SIZE,
+                                          max_workers, 'Account alphas fetch'):
+        if offset == 0:
+            count = page['count']
+        docs = [to_document(alpha, synced_at) for alpha in page['results']]
+        written += db.upsert_account_alphas(docs)
+        for doc in docs:
+            seen.add(doc['_id'])
+            if doc['date_modified'] and (newest is None or doc['date_modified'] > newest):
+                newest = doc['date_modified']
+
+    complete = len(seen) >= count
+    if complete:
+        db.set_sync_state(SYNC_STATE_ID, {'watermark': newest, 'synced_at': synced_at,
+                                          'last_count': len(seen)})
+    else:
+        logging.warning(f"Account alphas changed during sync ({len(seen)}/{count} fetched), "
+                        f"watermark kept at {watermark}")
+    elapsed = perf_counter() - start
+    logging.info(f"Synced {written} account alphas since {watermark} in {elapsed:.1f}s")
+    return {'fetched': len(seen), 'expected': count, 'written': written,
+            'watermark': newest if complete else watermark,
+            'elapsed_seconds': round(elapsed, 3)}
+
+def rank_account_alphas(metric: str = 'sharpe', limit: int = 50,
+                        query: Optional[Dict] = None, ascending: bool = False) -> List[Dict]:
+    """
+    按指标排序读取已同步的账户alpha
+
+    Args:
+        metric: 排序指标（sharpe、fitness、turnover、returns、drawdown、margin、os_sharpe）
+        limit: 最多数量
+        query: 附加的查询条件，如 {'status': 'UNSUBMITTED'}
+        ascending: 是否从小到大排序（如turnover）
+
+    Returns:
+        list: account_alphas 文档
+    """
+    from .brainSimulationRecord import db
+    return db.rank_account_alphas(metric, limit, query, ascending)
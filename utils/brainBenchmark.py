@@ -0,0 +1,349 @@
+"""
+WorldQuant Brain 性能基准测试
+在本地模拟服务器上运行登录、数据字段、模拟和提交流程，
+报告吞吐量、各接口延迟分位数、重试次数和MongoDB写入开销，并与基线比较
+
+用法:
+    python -m utils.brainBenchmark --alphas 500 --output bench.json
+    python -m utils.brainBenchmark --alphas 500 --baseline bench.json
+"""
+import argparse
+import json
+import logging
+import os
+from collections import Counter, defaultdict
+from datetime import timedelta
+from threading import Lock
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import numpy as np
+
+from .brainMetrics import endpoint_of
+from .brainMockServer import DEFAULT_MOCK_PORT, MockBrainServer, mock_field_ids
+
+# 必须在导入使用API地址和数据库的模块之前设置：
+# 默认指向本地模拟服务器和单独的基准测试数据库，不会影响真实记录
+os.environ.setdefault('BRAIN_API_URL', f'http://127.0.0.1:{DEFAULT_MOCK_PORT}')
+os.environ.setdefault('BRAIN_MONGO_DB', 'brain_benchmark')
+
+from .brainAccountAlphas import SYNC_STATE_ID, sync_account_alphas  # noqa: E402
+from .brainLogin import API_URL, BrainSession  # noqa: E402
+from .brainRateLimiter import request_limiter  # noqa: E402
+from .brainSimulationRecord import DEFAULT_DB_NAME, get_db  # noqa: E402
+
+# 与基线比较的指标及其方向（1 越大越好，-1 越小越好）
+COMPARED_METRICS = {
+    'simulations.alphas_per_minute': 1,
+    'simulations.elapsed_seconds': -1,
+    'datafields.fields_per_second': 1,
+    'session.login_ms': -1,
+    'submit.ms_per_alpha': -1,
+    'account_sync.full.elapsed_seconds': -1,
+    'account_sync.incremental.fetched': -1,
+    'retries.total': -1,
+    'db_writes.ms_per_op': -1,
+    'db_writes.flushes': -1,
+    'requests.POST /simulations.p50_ms': -1,
+    'requests.POST /simulations.p99_ms': -1,
+    'requests.GET /simulations/{id}.p99_ms': -1,
+}
+
+def _endpoint(method: str, url: str) -> str:
+    """把URL归并为接口名，如 GET /simulations/{id}"""
+    return f"{method.upper()} {endpoint_of(url)}"
+
+
+class RequestRecorder:
+    def __init__(self):
+        """按接口记录请求耗时和状态码"""
+        self.latencies = defaultdict(list)
+        self.statuses = Counter()
+        self._lock = Lock()
+
+    def wrap(self, session):
+        """让会话的每个请求都经过记录（401重新登录后重发的请求计入同一次耗时）"""
+        request = session.request
+
+        def timed_request(method, url, *args, **kwargs):
+            start = perf_counter()
+            response = request(method, url, *args, **kwargs)
+            self.record(_endpoint(method, url), response.status_code, perf_counter() - start)
+            return response
+
+        session.request = timed_request
+        return session
+
+    def record(self, endpoint: str, status: int, seconds: float):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            self.statuses[status] += 1
+
+    def summary(self) -> Dict:
+        """每个接口的请求数和延迟分位数(毫秒)"""
+        result = {}
+        with self._lock:
+            for endpoint, values in sorted(self.latencies.items()):
+                values = np.asarray(values) * 1000
+                result[endpoint] = {
+                    'count': len(values),
+                    'mean_ms': round(float(values.mean()), 2),
+                    'p50_ms': round(float(np.percentile(values, 50)), 2),
+                    'p99_ms': round(float(np.percentile(values, 99)), 2),
+                    'max_ms': round(float(values.max()), 2),
+                }
+        return result
+
+
+def _check_environment():
+    """确认请求会发往模拟服务器、记录会写入基准测试数据库"""
+    if urlparse(API_URL).hostname not in ('127.0.0.1', 'localhost'):
+        raise RuntimeError(f"BRAIN_API_URL points to {API_URL}; set it to the mock server "
+                           f"before importing utils modules")
+    if DEFAULT_DB_NAME == 'brain_simulation':
+        raise RuntimeError("Refusing to benchmark against the brain_simulation database; "
+                           "set BRAIN_MONGO_DB before importing utils modules")
+
+def _reset_database():
+    """清空基准测试数据库中的记录"""
+    db = get_db()
+    db.flush()
+    db.alphas.delete_many({})
+    db.workers.delete_many({})
+    db.account_alphas.delete_many({})
+    db.meta.delete_one({'_id': SYNC_STATE_ID})
+    db.reconcile_statistics()
+
+def benchmark_session(logins: int = 5) -> Dict:
+    """登录耗时"""
+    times = []
+    for _ in range(logins):
+        start = perf_counter()
+        BrainSession('benchmark', 'benchmark')
+        times.append(perf_counter() - start)
+    return {'logins': logins, 'login_ms': round(float(np.median(times)) * 1000, 2)}
+
+def benchmark_datafields(session, search_scope: Dict) -> Dict:
+    """不使用本地目录下载一个范围的全部数据字段"""
+    from .brainGetDataFields import get_datafields
+    start = perf_counter()
+    df = get_datafields(session, search_scope, use_cache=False)
+    elapsed = perf_counter() - start
+    return {'fields': len(df), 'elapsed_seconds': round(elapsed, 3),
+            'fields_per_second': round(len(df) / max(elapsed, 1e-9), 1)}
+
+def benchmark_simulations(session, alphas: int, multi_size: int = 1,
+                          max_concurrency: int = 50, validate: bool = True,
+                          field_count: int = 1000) -> Tuple[Dict, Dict]:
+    """
+    提交并跟踪一批alpha直到全部完成，返回 (模拟结果, 数据库写入开销)
+
+    表达式只使用模拟服务器的 MATRIX 字段，开启检查时也全部通过，模拟数量与 alphas 一致
+    """
+    from .brainSimulation import run_alpha_simulation
+    from .brainSimulationConfig import get_simulation_data
+    fields = mock_field_ids(field_count)
+    expressions = (f"rank(ts_mean({fields[index % len(fields)]}, {5 + index // len(fields)}))"
+                   for index in range(alphas))
+    alpha_list = [get_simulation_data(expression) for expression in expressions]
+
+    db = get_db()
+    writes_before = dict(db.writer.stats)
+    start = perf_counter()
+    result = run_alpha_simulation(alpha_list, max_concurrency=max_concurrency,
+                                  multi_size=multi_size, validate=validate, session=session)
+    elapsed = perf_counter() - start
+
+    writes = {key: db.writer.stats[key] - writes_before.get(key, 0)
+              for key in ('flushes', 'ops', 'errors', 'flush_seconds')}
+    stats = db.get_statistics(result['batch_id'])
+    return {
+        'alphas': alphas,
+        'simulated': result['simulated'],
+        'success': stats['success'],
+        'failed': stats['failed'],
+        'elapsed_seconds': round(elapsed, 3),
+        'alphas_per_minute': round(result['simulated'] / max(elapsed, 1e-9) * 60, 1),
+        'batch_id': result['batch_id'],
+    }, {
+        'flushes': writes['flushes'],
+        'ops': writes['ops'],
+        'errors': writes['errors'],
+        'flush_seconds': round(writes['flush_seconds'], 4),
+        'max_flush_ms': round(db.writer.stats['max_flush_seconds'] * 1000, 2),
+        'ms_per_op': round(writes['flush_seconds'] * 1000 / max(writes['ops'], 1), 4),
+    }
+
+def benchmark_submit(session, batch_id: str, limit: int = 20) -> Dict:
+    """批量提交成功模拟的alpha并等待检查结果"""
+    from .brainSimulationSubmitAlpha import submit_alphas
+    start = perf_counter()
+    summary = submit_alphas(session=session, batch_id=batch_id, limit=limit)
+    elapsed = perf_counter() - start
+    count = len(summary['results'])
+    return {'submitted': count, 'passed': summary['submitted'],
+            'rejected': summary['rejected'], 'failed': summary['failed'],
+            'elapsed_seconds': round(elapsed, 3),
+            'ms_per_alpha': round(elapsed * 1000 / max(count, 1), 2)}
+
+def benchmark_account_sync(session) -> Dict:
+    """全量同步账户alpha，再做一次增量同步（只应取回与水位线同一秒修改的alpha）"""
+    full = sync_account_alphas(session, full=True)
+    incremental = sync_account_alphas(session, overlap=timedelta(0))
+    return {'full': full, 'incremental': incremental}
+
+def run_benchmark(alphas: int = 500, multi_size: int = 1, max_concurrency: int = 50,
+                  submits: int = 20, validate: bool = True,
+                  server_options: Optional[Dict] = None) -> Dict:
+    """
+    启动模拟服务器并运行全部基准测试
+
+    Args:
+        alphas: 模拟的alpha数量
+        multi_size: 每个multi-simulation请求包含的alpha数量
+        max_concurrency: 并发窗口上限
+        submits: 提交的alpha数量
+        validate: 是否在提交前检查表达式
+        server_options: MockBrainServer 的参数（延迟、429/401注入、并发上限等）
+
+    Returns:
+        dict: 基准测试报告
+    """
+    _check_environment()
+    server_options = dict(server_options or {})
+    server_options.setdefault('port', urlparse(API_URL).port or DEFAULT_MOCK_PORT)
+    recorder = RequestRecorder()
+    limiter_before = dict(request_limiter.counts)
+
+    with MockBrainServer(**server_options) as server:
+        _reset_database()
+        report = {'config': {'alphas': alphas, 'multi_size': multi_size,
+                             'max_concurrency': max_concurrency, 'validate': validate,
+                             'server': server_options}}
+        report['session'] = benchmark_session()
+        session = recorder.wrap(BrainSession('benchmark', 'benchmark',
+                                             pool_size=max_concurrency + 8))
+        report['datafields'] = benchmark_datafields(session, {
+            'instrumentType': 'EQUITY', 'region': 'USA', 'delay': 1, 'universe': 'TOP3000'
+        })
+        report['simulations'], report['db_writes'] = benchmark_simulations(
+            session, alphas, multi_size, max_concurrency, validate, server.datafield_count)
+        report['submit'] = benchmark_submit(session, report['simulations']['batch_id'], submits)
+        report['account_sync'] = benchmark_account_sync(session)
+        server_counts = server.stats()['requests']
+
+    rejected = Counter()
+    for key, count in server_counts.items():
+        status = key.rsplit(' ', 1)[1]
+        if status in ('401', '429'):
+            rejected[status] += count
+    report['retries'] = {
+        'reauthentications': session.auth_count - 1,
+        'unauthorized': rejected['401'],
+        'throttled': rejected['429'],
+        'total': rejected['401'] + rejected['429'],
+        'request_limiter': {key: request_limiter.counts[key] - limiter_before.get(key, 0)
+                            for key in request_limiter.counts},
+    }
+    report['requests'] = recorder.summary()
+    report['server'] = server_counts
+    return report
+
+def _flatten(report: Dict, prefix: str = '') -> Dict[str, float]:
+    values = {}
+    for key, value in report.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(_flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[name] = value
+    return values
+
+def compare_reports(report: Dict, baseline: Dict) -> List[Dict]:
+    """
+    与基线报告比较主要指标
+
+    Returns:
+        list: 每个指标的 {'metric', 'baseline', 'current', 'change', 'better'}，
+              change 为相对变化，better 表示是否优于基线
+    """
+    current, previous = _flatten(report), _flatten(baseline)
+    rows = []
+    for metric, direction in COMPARED_METRICS.items():
+        if metric not in current or metric not in previous:
+            continue
+        old, new = previous[metric], current[metric]
+        change = (new - old) / old if old else 0.0
+        rows.append({'metric': metric, 'baseline': old, 'current': new,
+                     'change': round(change, 4), 'better': change * direction > 0})
+    return rows
+
+def print_report(report: Dict, baseline: Optional[Dict] = None):
+    """打印报告摘要（给出基线时同时打印比较结果）"""
+    sims = report['simulations']
+    print(f"\n模拟: {sims['simulated']} 个, {sims['elapsed_seconds']}s, "
+          f"{sims['alphas_per_minute']} alphas/分钟 (成功 {sims['success']}, 失败 {sims['failed']})")
+    print(f"数据字段: {report['datafields']['fields']} 个, "
+          f"{report['datafields']['fields_per_second']} 个/秒")
+    print(f"登录: {report['session']['login_ms']}ms, 提交: {report['submit']['ms_per_alpha']}ms/个")
+    sync = report['account_sync']
+    print(f"账户alpha同步: 全量 {sync['full']['fetched']} 个 {sync['full']['elapsed_seconds']}s, "
+          f"增量 {sync['incremental']['fetched']} 个 {sync['incremental']['elapsed_seconds']}s")
+    print(f"重试: {report['retries']}")
+    print(f"数据库写入: {report['db_writes']}")
+    print("\n接口延迟:")
+    for endpoint, stats in report['requests'].items():
+        print(f"  {endpoint:<32} n={stats['count']:<6} p50={stats['p50_ms']}ms "
+              f"p99={stats['p99_ms']}ms")
+    if baseline:
+        print("\n与基线比较:")
+        for row in compare_reports(report, baseline):
+            mark = '+' if row['better'] else '-' if row['change'] else ' '
+            print(f"  {mark} {row['metric']:<40} {row['baseline']} -> {row['current']} "
+                  f"({row['change'] * 100:+.1f}%)")
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Benchmark the simulation pipeline '
+                                                 'against a local mock Brain server')
+    parser.add_argument('--alphas', type=int, default=500)
+    parser.add_argument('--multi-size', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--submits', type=int, default=20)
+    parser.add_argument('--no-validate', action='store_true')
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--simulation-time', type=float, default=1.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--unauthorized-rate', type=float, default=0.0)
+    parser.add_argument('--server-error-rate', type=float, default=0.0)
+    parser.add_argument('--submit-time', type=float, default=0.0)
+    parser.add_argument('--max-concurrent', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the report to this JSON file')
+    parser.add_argument('--baseline', help='compare against a previous JSON report')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    report = run_benchmark(
+        alphas=args.alphas, multi_size=args.multi_size, max_concurrency=args.concurrency,
+        submits=args.submits, validate=not args.no_validate,
+        server_options={'latency': args.latency, 'jitter': args.jitter,
+                        'simulation_time': args.simulation_time,
+                        'throttle_rate': args.throttle_rate,
+                        'unauthorized_rate': args.unauthorized_rate,
+                        'server_error_rate': args.server_error_rate,
+                        'submit_time': args.submit_time,
+                        'max_concurrent': args.max_concurrent, 'seed': args.seed}
+    )
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+布隆过滤器
+用于在进程内快速判断大量候选是否可能已经存在
+"""
+import math
+from hashlib import blake2b
+from typing import Iterable
+
+class BloomFilter:
+    def __init__(self, capacity: int = 1000000, error_rate: float = 0.001):
+        """
+        初始化布隆过滤器
+
+        不在过滤器中的key一定不存在；在过滤器中的key以 error_rate 的概率误判，
+        需要再到数据库中确认
+
+        Args:
+            capacity: 预计元素数量
+            error_rate: 元素数量不超过capacity时的误判率
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        """双重哈希得到 num_hashes 个位置"""
+        digest = blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key: str):
+        """加入一个key"""
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def update(self, keys: Iterable[str]):
+        """批量加入key"""
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key: str) -> bool:
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def __len__(self):
+        return self.count
@@ -0,0 +1,311 @@
+"""
+WorldQuant Brain 本地数据字段目录
+按搜索范围和数据集把数据字段缓存到SQLite，过期后才重新下载
+"""
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from os.path import dirname, expanduser, join
+from threading import Lock
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from .brainGetDataFields import iter_datafield_pages
+
+DEFAULT_CATALOG_PATH = os.environ.get(
+    'BRAIN_CATALOG_PATH',
+    join(expanduser('~'), '.cache', 'brain', 'datafields.sqlite')
+)
+
+# 默认有效期(秒)
+DEFAULT_TTL = 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scopes (
+    scope_key TEXT PRIMARY KEY,
+    instrument_type TEXT,
+    region TEXT,
+    delay INTEGER,
+    universe TEXT,
+    dataset_id TEXT,
+    fetched_at REAL,
+    count INTEGER
+);
+CREATE TABLE IF NOT EXISTS fields (
+    scope_key TEXT,
+    id TEXT,
+    type TEXT,
+    dataset_id TEXT,
+    description TEXT,
+    data TEXT,
+    PRIMARY KEY (scope_key, id)
+);
+CREATE INDEX IF NOT EXISTS idx_fields_type ON fields (scope_key, type);
+CREATE INDEX IF NOT EXISTS idx_fields_dataset ON fields (scope_key, dataset_id);
+"""
+
+def get_scope_key(search_scope: Dict, dataset_id: str = '') -> str:
+    """
+    生成目录的缓存键
+
+    Args:
+        search_scope: get_search_scope 返回的搜索范围
+        dataset_id: 数据集ID，空字符串表示该范围下的全部数据集
+
+    Returns:
+        str: 缓存键
+    """
+    return '|'.join([
+        search_scope['instrumentType'],
+        search_scope['region'],
+        str(search_scope['delay']),
+        search_scope['universe'],
+        dataset_id or ''
+    ])
+
+
+class DataFieldsCatalog:
+    def __init__(self, path: str = DEFAULT_CATALOG_PATH, ttl: float = DEFAULT_TTL):
+        """
+        初始化数据字段目录
+
+        Args:
+            path: SQLite文件路径
+            ttl: 缓存有效期(秒)
+        """
+        self.path = path
+        self.ttl = ttl
+        self._refresh_lock = Lock()
+        os.makedirs(dirname(path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """打开连接，正常退出时提交、出错时回滚，最后关闭连接"""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def fetched_at(self, scope_key: str) -> Optional[float]:
+        """缓存范围的下载时间，没有缓存时返回None"""
+        with self._connect() as conn:
+            row = conn.execute('SELECT fetched_at FROM scopes WHERE scope_key = ?',
+                               (scope_key,)).fetchone()
+        return row[0] if row else None
+
+    def is_fresh(self, scope_key: str) -> bool:
+        """缓存范围是否在有效期内"""
+        fetched_at = self.fetched_at(scope_key)
+        return fetched_at is not None and time.time() - fetched_at < self.ttl
+
+    def refresh(self, session, search_scope: Dict, dataset_id: str = '') -> int:
+        """
+        重新下载一个范围的数据字段并替换缓存
+
+        Args:
+            session: Brain会话对象
+            search_scope: 搜索范围配置
+            dataset_id: 数据集ID
+
+        Returns:
+            int: 数据字段数量
+        """
+        scope_key = get_scope_key(search_scope, dataset_id)
+        start = time.time()
+
+        # 先在事务外下载全部页面，下载失败时旧缓存保持不变，也不会长时间占用写锁
+        rows = []
+        for page in iter_datafield_pages(session, search_scope, dataset_id):
+            rows.extend(
+                (scope_key, field['id'], field.get('type'),
+                 (field.get('dataset') or {}).get('id'),
+                 field.get('description'), json.dumps(field))
+                for field in page
+            )
+        count = len(rows)
+
+        # 在一个短事务里替换缓存
+        with self._connect() as conn:
+            conn.execute('DELETE FROM fields WHERE scope_key = ?', (scope_key,))
+            conn.executemany('INSERT OR REPLACE INTO fields VALUES (?, ?, ?, ?, ?, ?)', rows)
+            conn.execute('INSERT OR REPLACE INTO scopes VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (
+                scope_key, search_scope['instrumentType'], search_scope['region'],
+                int(search_scope['delay']), search_scope['universe'], dataset_id or '',
+                time.time(), count
+            ))
+
+        logging.info(f"Catalog refreshed {scope_key}: {count} fields "
+                     f"in {time.time() - start:.1f}s")
+        return count
+
+    def _resolve_scope(self, search_scope: Dict, dataset_id: str) -> Optional[str]:
+        """找到可用的缓存范围：优先数据集范围，其次覆盖全部数据集的范围"""
+        scope_key = get_scope_key(search_scope, dataset_id)
+        if self.is_fresh(scope_key):
+            return scope_key
+        if dataset_id:
+            full_key = get_scope_key(search_scope)
+            if self.is_fresh(full_key):
+                return full_key
+        return None
+
+    def lookup(self, search_scope: Dict, dataset_id: str = '', search: str = '',
+               field_type: Optional[str] = None) -> Optional[pd.DataFrame]:
+        """
+        在本地目录中查询
+
+        Args:
+            search_scope: 搜索范围配置
+            dataset_id: 数据集ID
+            search: 关键词（匹配字段ID和描述，不区分大小写）
+            field_type: 字段类型过滤(如'MATRIX')
+
+        Returns:
+            pd.DataFrame: 数据字段DataFrame；没有有效缓存时返回None
+        """
+        scope_key = self._resolve_scope(search_scope, dataset_id)
+        if scope_key is None:
+            return None
+
+        sql = 'SELECT data FROM fields WHERE scope_key = ?'
+        args = [scope_key]
+        if dataset_id:
+            sql += ' AND dataset_id = ?'
+            args.append(dataset_id)
+        if field_type:
+            sql += ' AND type = ?'
+            args.append(field_type)
+        if search:
+            sql += ' AND (id LIKE ? OR description LIKE ?)'
+            args.extend([f'%{search}%'] * 2)
+
+        with self._connect() as conn:
+            rows = conn.execute(sql, args).fetchall()
+        return pd.DataFrame([json.loads(row[0]) for row in rows])
+
+    def get(self, session, search_scope: Dict, dataset_id: str = '', search: str = '',
+            field_type: Optional[str] = None, force_refresh: bool = False) -> pd.DataFrame:
+        """
+        查询数据字段，缓存缺失或过期时先重新下载该范围
+
+        Args:
+            session: Brain会话对象
+            search_scope: 搜索范围配置
+            dataset_id: 数据集ID
+            search: 关键词
+            field_type: 字段类型过滤(如'MATRIX')
+            force_refresh: 是否忽略缓存强制下载
+
+        Returns:
+            pd.DataFrame: 数据字段DataFrame
+        """
+        if not force_refresh:
+            df = self.lookup(search_scope, dataset_id, search, field_type)
+            if df is not None:
+                return df
+
+        with self._refresh_lock:
+            # 等锁期间可能已被其他线程刷新
+            if force_refresh or self._resolve_scope(search_scope, dataset_id) is None:
+                self.refresh(session, search_scope, dataset_id)
+        return self.lookup(search_scope, dataset_id, search, field_type)
+
+    def field_types(self, search_scope: Dict) -> Tuple[Dict[str, str], bool]:
+        """
+        本地目录中某个搜索范围下的字段类型（不下载）
+
+        Args:
+            search_scope: 搜索范围配置
+
+        Returns:
+            tuple: (字段ID到类型的映射, 是否覆盖该范围的全部数据集)
+        """
+        cutoff = time.time() - self.ttl
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT f.id, f.type FROM fields f JOIN scopes s ON f.scope_key = s.scope_key '
+                'WHERE s.instrument_type = ? AND s.region = ? AND s.delay = ? '
+                'AND s.universe = ? AND s.fetched_at >= ?',
+                (search_scope['instrumentType'], search_scope['region'],
+                 int(search_scope['delay']), search_scope['universe'], cutoff)
+            ).fetchall()
+        return dict(rows), self.is_fresh(get_scope_key(search_scope))
+
+    def field_datasets(self, search_scope: Dict) -> Dict[str, str]:
+        """
+        本地目录中某个搜索范围下字段所属的数据集（不下载，包括已过期的缓存）
+
+        Args:
+            search_scope: 搜索范围配置
+
+        Returns:
+            dict: 字段ID到数据集ID的映射
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT f.id, f.dataset_id FROM fields f JOIN scopes s ON f.scope_key = s.scope_key '
+                'WHERE s.instrument_type = ? AND s.region = ? AND s.delay = ? '
+                'AND s.universe = ? AND f.dataset_id IS NOT NULL',
+                (search_scope['instrumentType'], search_scope['region'],
+                 int(search_scope['delay']), search_scope['universe'])
+            ).fetchall()
+        return dict(rows)
+
+    def stale_scopes(self) -> List[Dict]:
+        """列出已过期的缓存范围"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT instrument_type, region, delay, universe, dataset_id FROM scopes '
+                'WHERE fetched_at < ?', (time.time() - self.ttl,)
+            ).fetchall()
+        return [{'instrumentType': r[0], 'region': r[1], 'delay': r[2],
+                 'universe': r[3], 'dataset_id': r[4]} for r in rows]
+
+    def refresh_stale(self, session) -> int:
+        """
+        只重新下载过期的范围
+
+        Returns:
+            int: 刷新的范围数量
+        """
+        scopes = self.stale_scopes()
+        for scope in scopes:
+            dataset_id = scope.pop('dataset_id')
+            self.refresh(session, scope, dataset_id)
+        return len(scopes)
+
+    def invalidate(self, search_scope: Optional[Dict] = None, dataset_id: str = ''):
+        """
+        使缓存失效
+
+        Args:
+            search_scope: 搜索范围配置，为None时清空整个目录
+            dataset_id: 数据集ID
+        """
+        with self._connect() as conn:
+            if search_scope is None:
+                conn.execute('DELETE FROM fields')
+                conn.execute('DELETE FROM scopes')
+            else:
+                scope_key = get_scope_key(search_scope, dataset_id)
+                conn.execute('DELETE FROM fields WHERE scope_key = ?', (scope_key,))
+                conn.execute('DELETE FROM scopes WHERE scope_key = ?', (scope_key,))
+
+_catalog = None
+_catalog_lock = Lock()
+
+def get_catalog() -> DataFieldsCatalog:
+    """获取默认路径下的全局数据字段目录"""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = DataFieldsCatalog()
+        return _catalog
@@ -0,0 +1,237 @@
+"""
+WorldQuant Brain FASTEXPR 表达式解析工具
+把Alpha表达式解析为语法树，用于提交前的本地检查
+"""
+import re
+from typing import Any, List, NamedTuple, Optional, Tuple
+
+class ExpressionSyntaxError(ValueError):
+    """表达式语法错误"""
+    def __init__(self, message: str, position: int):
+        super().__init__(f"{message} at position {position}")
+        self.position = position
+
+
+# 语法树节点
+class Number(NamedTuple):
+    value: float
+
+class String(NamedTuple):
+    value: str
+
+class Name(NamedTuple):
+    id: str
+
+class Call(NamedTuple):
+    func: str
+    args: Tuple[Any, ...]
+    kwargs: Tuple[Tuple[str, Any], ...]
+
+class UnaryOp(NamedTuple):
+    op: str
+    operand: Any
+
+class BinOp(NamedTuple):
+    op: str
+    left: Any
+    right: Any
+
+class Ternary(NamedTuple):
+    cond: Any
+    then: Any
+    other: Any
+
+class Assign(NamedTuple):
+    name: str
+    value: Any
+
+class Program(NamedTuple):
+    statements: Tuple[Any, ...]
+
+
+TOKEN_RE = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<string>"[^"]*"|'[^']*')
+  | (?P<name>[A-Za-z_][A-Za-z0-9_.]*)
+  | (?P<op>&&|\|\||==|!=|<=|>=|[-+*/^<>!?:(),=;])
+""", re.VERBOSE)
+
+COMPARISON_OPS = ('<', '>', '<=', '>=', '==', '!=')
+
+def tokenize(expression: str) -> List[Tuple[str, str, int]]:
+    """
+    把表达式切分为词法单元
+
+    Args:
+        expression: Alpha表达式
+
+    Returns:
+        list: (类型, 文本, 位置) 列表，以 ('end', '', 长度) 结束
+    """
+    tokens = []
+    pos = 0
+    while pos < len(expression):
+        match = TOKEN_RE.match(expression, pos)
+        if not match:
+            raise ExpressionSyntaxError(f"Unexpected character {expression[pos]!r}", pos)
+        kind = match.lastgroup
+        if kind != 'space':
+            tokens.append((kind, match.group(), pos))
+        pos = match.end()
+    tokens.append(('end', '', len(expression)))
+    return tokens
+
+
+class _Parser:
+    """递归下降解析器"""
+    def __init__(self, expression: str):
+        self.tokens = tokenize(expression)
+        self.index = 0
+
+    def peek(self, offset: int = 0) -> Tuple[str, str, int]:
+        return self.tokens[min(self.index + offset, len(self.tokens) - 1)]
+
+    def next(self) -> Tuple[str, str, int]:
+        token = self.tokens[self.index]
+        self.index += 1
+        return token
+
+    def accept(self, *ops: str) -> Optional[str]:
+        kind, text, _ = self.peek()
+        if kind == 'op' and text in ops:
+            self.index += 1
+            return text
+        return None
+
+    def expect(self, op: str):
+        if not self.accept(op):
+            kind, text, pos = self.peek()
+            raise ExpressionSyntaxError(f"Expected {op!r} but found {text or kind!r}", pos)
+
+    def program(self) -> Program:
+        statements = [self.statement()]
+        while self.accept(';'):
+            if self.peek()[0] == 'end':
+                break
+            statements.append(self.statement())
+        kind, text, pos = self.peek()
+        if kind != 'end':
+            raise ExpressionSyntaxError(f"Unexpected {text!r}", pos)
+        return Program(tuple(statements))
+
+    def statement(self):
+        kind, text, _ = self.peek()
+        next_kind, next_text, _ = self.peek(1)
+        if kind == 'name' and next_kind == 'op' and next_text == '=':
+            self.index += 2
+            return Assign(text, self.expression())
+        return self.expression()
+
+    def expression(self):
+        cond = self.logical_or()
+        if self.accept('?'):
+            then = self.expression()
+            self.expect(':')
+            return Ternary(cond, then, self.expression())
+        return cond
+
+    def logical_or(self):
+        node = self.logical_and()
+        while self.accept('||'):
+            node = BinOp('||', node, self.logical_and())
+        return node
+
+    def logical_and(self):
+        node = self.comparison()
+        while self.accept('&&'):
+            node = BinOp('&&', node, self.comparison())
+        return node
+
+    def comparison(self):
+        node = self.additive()
+        op = self.accept(*COMPARISON_OPS)
+        while op:
+            node = BinOp(op, node, self.additive())
+            op = self.accept(*COMPARISON_OPS)
+        return node
+
+    def additive(self):
+        node = self.multiplicative()
+        op = self.accept('+', '-')
+        while op:
+            node = BinOp(op, node, self.multiplicative())
+            op = self.accept('+', '-')
+        return node
+
+    def multiplicative(self):
+        node = self.unary()
+        op = self.accept('*', '/')
+        while op:
+            node = BinOp(op, node, self.unary())
+            op = self.accept('*', '/')
+        return node
+
+    def unary(self):
+        op = self.accept('-', '+', '!')
+        if op:
+            return UnaryOp(op, self.unary())
+        return self.power()
+
+    def power(self):
+        node = self.primary()
+        if self.accept('^'):
+            return BinOp('^', node, self.unary())
+        return node
+
+    def primary(self):
+        kind, text, pos = self.next()
+        if kind == 'number':
+            return Number(float(text))
+        if kind == 'string':
+            return String(text[1:-1])
+        if kind == 'name':
+            if self.accept('('):
+                return self.call(text)
+            return Name(text)
+        if kind == 'op' and text == '(':
+            node = self.expression()
+            self.expect(')')
+            return node
+        raise ExpressionSyntaxError(f"Unexpected {text or 'end of expression'!r}", pos)
+
+    def call(self, func: str) -> Call:
+        args, kwargs = [], []
+        if self.accept(')'):
+            return Call(func, (), ())
+        while True:
+            kind, text, pos = self.peek()
+            next_kind, next_text, _ = self.peek(1)
+            if kind == 'name' and next_kind == 'op' and next_text == '=':
+                self.index += 2
+                kwargs.append((text, self.expression()))
+            elif kwargs:
+                raise ExpressionSyntaxError("Positional argument after keyword argument", pos)
+            else:
+                args.append(self.expression())
+            if self.accept(')'):
+                return Call(func, tuple(args), tuple(kwargs))
+            self.expect(',')
+
+def parse_expression(expression: str) -> Program:
+    """
+    解析FASTEXPR表达式
+
+    支持四则运算、^、比较和逻辑运算、三元运算 a ? b : c、带关键字参数的
+    函数调用，以及用 ; 分隔、带变量赋值的多语句表达式
+
+    Args:
+        expression: Alpha表达式
+
+    Returns:
+        Program: 语法树
+
+    Raises:
+        ExpressionSyntaxError: 表达式有语法错误
+    """
+    return _Parser(expression).program()
@@ -0,0 +1,285 @@
+"""
+WorldQuant Brain 表达式静态检查工具
+提交前检查语法、运算符参数个数以及数据字段是否存在和类型是否匹配
+"""
+import logging
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .brainExpressionParser import (Assign, BinOp, Call, ExpressionSyntaxError, Name,
+                                    Ternary, UnaryOp, parse_expression)
+from .brainSimulationConfig import normalize_expression
+
+_TS = (2, 3)
+
+# 运算符 -> (最少位置参数, 最多位置参数)，None 表示不限
+OPERATOR_ARITY = {
+    # 算术
+    'abs': (1, 1), 'add': (2, None), 'subtract': (2, 2), 'multiply': (2, None),
+    'divide': (2, 2), 'inverse': (1, 1), 'log': (1, 1), 'exp': (1, 1), 'sqrt': (1, 1),
+    'sign': (1, 1), 'power': (2, 2), 'signed_power': (2, 2), 'reverse': (1, 1),
+    'max': (2, None), 'min': (2, None), 'densify': (1, 1), 's_log_1p': (1, 1),
+    'fraction': (1, 1), 'round': (1, 1), 'floor': (1, 1), 'ceiling': (1, 1),
+    # 逻辑
+    'if_else': (3, 3), 'is_nan': (1, 1), 'not': (1, 1), 'and': (2, 2), 'or': (2, 2),
+    'trade_when': (3, 3),
+    # 截面
+    'rank': (1, 1), 'zscore': (1, 1), 'scale': (1, 1), 'normalize': (1, 1),
+    'quantile': (1, 1), 'winsorize': (1, 1), 'bucket': (1, 1), 'tail': (1, 1),
+    'left_tail': (1, 1), 'right_tail': (1, 1), 'truncate': (1, 1),
+    'regression_neut': (2, 2), 'vector_neut': (2, 2), 'vector_proj': (2, 2),
+    # 时间序列
+    'ts_mean': _TS, 'ts_sum': _TS, 'ts_std_dev': _TS, 'ts_delta': _TS, 'ts_delay': _TS,
+    'ts_rank': _TS, 'ts_zscore': _TS, 'ts_decay_linear': _TS, 'ts_arg_max': _TS,
+    'ts_arg_min': _TS, 'ts_av_diff': _TS, 'ts_product': _TS, 'ts_scale': _TS,
+    'ts_quantile': _TS, 'ts_backfill': _TS, 'ts_count_nans': _TS, 'ts_max': _TS,
+    'ts_min': _TS, 'ts_median': _TS, 'ts_kurtosis': _TS, 'ts_skewness': _TS,
+    'ts_entropy': _TS, 'ts_ir': _TS, 'ts_max_diff': _TS, 'ts_min_diff': _TS,
+    'ts_returns': _TS, 'ts_percentage': _TS, 'ts_decay_exp_window': _TS,
+    'ts_corr': (3, 3), 'ts_covariance': (3, 3), 'ts_co_kurtosis': (3, 3),
+    'ts_co_skewness': (3, 3), 'ts_regression': (3, 5), 'ts_triple_corr': (4, 4),
+    'ts_partial_corr': (4, 4), 'ts_step': (1, 1), 'days_from_last_change': (1, 1),
+    'last_diff_value': (2, 2), 'hump': (1, 2), 'kth_element': (3, 3),
+    # 分组
+    'group_rank': (2, 2), 'group_zscore': (2, 2), 'group_neutralize': (2, 2),
+    'group_scale': (2, 2), 'group_normalize': (2, 2), 'group_count': (2, 2),
+    'group_sum': (2, 2), 'group_max': (2, 2), 'group_min': (2, 2),
+    'group_median': (2, 2), 'group_std_dev': (2, 2), 'group_mean': (3, 3),
+    'group_backfill': (3, 4), 'group_vector_neut': (3, 3),
+    'group_cartesian_product': (2, 2),
+    # 向量
+    'vec_avg': (1, 1), 'vec_sum': (1, 1), 'vec_max': (1, 1), 'vec_min': (1, 1),
+    'vec_count': (1, 1), 'vec_stddev': (1, 1), 'vec_range': (1, 1), 'vec_ir': (1, 1),
+    'vec_kurtosis': (1, 1), 'vec_skewness': (1, 1), 'vec_norm': (1, 1),
+    'vec_powersum': (1, 1), 'vec_choose': (1, 1), 'vec_filter': (1, 1),
+}
+
+# 平台内置的分组字段
+GROUP_FIELDS = {'market', 'sector', 'industry', 'subindustry', 'country', 'exchange', 'currency'}
+
+# 内置常量
+CONSTANTS = {'true', 'false', 'nan', 'inf'}
+
+def _group_arg_index(func: str) -> Optional[int]:
+    """分组运算符中分组参数的位置"""
+    if func in ('group_mean', 'group_vector_neut'):
+        return 2
+    if func.startswith('group_') and func != 'group_cartesian_product':
+        return 1
+    return None
+
+
+class ExpressionValidator:
+    def __init__(self, field_types: Optional[Dict[str, str]] = None, complete: bool = True,
+                 strict_operators: bool = False, cache_size: int = 100000):
+        """
+        初始化表达式检查器
+
+        Args:
+            field_types: 数据字段ID到类型(MATRIX/VECTOR/GROUP...)的映射，为None时不检查字段
+            complete: field_types 是否包含该范围的全部字段；为False时
+                      不认识的名称不视为错误，只检查已知字段的类型
+            strict_operators: 是否把 OPERATOR_ARITY 中没有的运算符视为错误
+            cache_size: 按规范化表达式缓存检查结果的数量
+        """
+        self.field_types = field_types
+        self.complete = complete
+        self.strict_operators = strict_operators
+        self._check = lru_cache(maxsize=cache_size)(self._validate)
+
+    @classmethod
+    def from_catalog(cls, search_scope: Dict, **kwargs) -> 'ExpressionValidator':
+        """
+        使用本地数据字段目录中已缓存的字段（不会下载）
+
+        Args:
+            search_scope: 搜索范围配置（instrumentType、region、delay、universe）
+        """
+        from .brainDataFieldsCatalog import get_catalog
+        field_types, complete = get_catalog().field_types(search_scope)
+        if not field_types:
+            return cls(None, **kwargs)
+        return cls(field_types, complete, **kwargs)
+
+    def validate(self, expression: str) -> List[str]:
+        """
+        检查表达式
+
+        Args:
+            expression: Alpha表达式
+
+        Returns:
+            list: 错误信息，空列表表示没有发现问题
+        """
+        return list(self._check(normalize_expression(expression)))
+
+    def is_valid(self, expression: str) -> bool:
+        """表达式是否通过检查"""
+        return not self._check(normalize_expression(expression))
+
+    def _validate(self, expression: str) -> Tuple[str, ...]:
+        try:
+            program = parse_expression(expression)
+        except ExpressionSyntaxError as e:
+            return (f"Syntax error: {e}",)
+
+        errors = []
+        variables = set()
+        for statement in program.statements:
+            if isinstance(statement, Assign):
+                self._visit(statement.value, variables, errors)
+                variables.add(statement.name)
+            else:
+                self._visit(statement, variables, errors)
+        if isinstance(program.statements[-1], Assign):
+            errors.append("Expression must end with a value, not an assignment")
+        return tuple(errors)
+
+    def _visit(self, node, variables: set, errors: List[str], vector_ok: bool = False):
+        """遍历语法树收集错误"""
+        if isinstance(node, Name):
+            self._check_name(node.id, variables, errors, vector_ok)
+        elif isinstance(node, Call):
+            self._check_call(node, variables, errors)
+        elif isinstance(node, BinOp):
+            self._visit(node.left, variables, errors)
+            self._visit(node.right, variables, errors)
+        elif isinstance(node, UnaryOp):
+            self._visit(node.operand, variables, errors)
+        elif isinstance(node, Ternary):
+            for child in node:
+                self._visit(child, variables, errors)
+
+    def _check_name(self, name: str, variables: set, errors: List[str], vector_ok: bool):
+        if name in variables or name in GROUP_FIELDS or name.lower() in CONSTANTS:
+            return
+        if self.field_types is None:
+            return
+        field_type = self.field_types.get(name)
+        if field_type is None:
+            if self.complete:
+                errors.append(f"Unknown data field {name!r}")
+        elif field_type == 'VECTOR' and not vector_ok:
+            errors.append(f"VECTOR field {name!r} must be reduced with a vec_* operator")
+
+    def _check_call(self, node: Call, variables: set, errors: List[str]):
+        func = node.func
+        arity = OPERATOR_ARITY.get(func)
+        if arity is None:
+            if self.strict_operators:
+                errors.append(f"Unknown operator {func!r}")
+        else:
+            low, high = arity
+            count = len(node.args)
+            if count < low or (high is not None and count > high):
+                expected = f"{low}" if low == high else f"{low}-{high or 'n'}"
+                errors.append(f"{func} expects {expected} arguments, got {count}")
+
+        group_index = _group_arg_index(func)
+        for index, arg in enumerate(node.args):
+            if index == group_index and isinstance(arg, Name):
+                self._check_group(func, arg.id, variables, errors)
+                continue
+            self._visit(arg, variables, errors, vector_ok=func.startswith('vec_') and index == 0)
+        for _, value in node.kwargs:
+            # 关键字参数的裸名称是选项值（如 driver=gaussian），不是数据字段
+            if not isinstance(value, Name):
+                self._visit(value, variables, errors)
+
+    def _check_group(self, func: str, name: str, variables: set, errors: List[str]):
+        if name in variables or name in GROUP_FIELDS or self.field_types is None:
+            return
+        field_type = self.field_types.get(name)
+        if field_type is None:
+            if self.complete:
+                errors.append(f"Unknown group field {name!r}")
+        elif field_type != 'GROUP':
+            errors.append(f"{func} expects a GROUP field, got {field_type} field {name!r}")
+
+
+def _collect_names(node, variables: set, names: set):
+    """收集语法树中引用的数据字段名称"""
+    if isinstance(node, Name):
+        if (node.id not in variables and node.id not in GROUP_FIELDS
+                and node.id.lower() not in CONSTANTS):
+            names.add(node.id)
+    elif isinstance(node, Call):
+        for arg in node.args:
+            _collect_names(arg, variables, names)
+        for _, value in node.kwargs:
+            if not isinstance(value, Name):
+                _collect_names(value, variables, names)
+    elif isinstance(node, BinOp):
+        _collect_names(node.left, variables, names)
+        _collect_names(node.right, variables, names)
+    elif isinstance(node, UnaryOp):
+        _collect_names(node.operand, variables, names)
+    elif isinstance(node, Ternary):
+        for child in node:
+            _collect_names(child, variables, names)
+
+@lru_cache(maxsize=100000)
+def referenced_fields(expression: str) -> Tuple[str, ...]:
+    """
+    表达式引用的数据字段（不含变量、内置分组字段和常量）
+
+    Args:
+        expression: Alpha表达式
+
+    Returns:
+        tuple: 排序后的字段名称，语法错误时为空
+    """
+    try:
+        program = parse_expression(normalize_expression(expression))
+    except ExpressionSyntaxError:
+        return ()
+    names, variables = set(), set()
+    for statement in program.statements:
+        if isinstance(statement, Assign):
+            _collect_names(statement.value, variables, names)
+            variables.add(statement.name)
+        else:
+            _collect_names(statement, variables, names)
+    return tuple(sorted(names))
+
+
+def _scope_of(alpha: Dict) -> Tuple:
+    settings = alpha['settings']
+    return (settings.get('instrumentType'), settings.get('region'),
+            settings.get('delay'), settings.get('universe'))
+
+def filter_valid_alphas(alphas: Iterable[Dict],
+                        on_invalid: Optional[Callable[[Dict, List[str]], None]] = None,
+                        validators: Optional[Dict[Tuple, ExpressionValidator]] = None
+                        ) -> Iterator[Dict]:
+    """
+    逐个检查alpha，只产出通过检查的
+
+    每个搜索范围(instrumentType, region, delay, universe)使用一个基于本地
+    数据字段目录的检查器，相同的表达式只解析一次
+
+    Args:
+        alphas: Alpha配置的列表或迭代器
+        on_invalid: 发现无效alpha时的回调 (alpha, 错误信息列表)
+        validators: 搜索范围到检查器的映射，缺少的范围按需从目录创建
+
+    Yields:
+        dict: 通过检查的Alpha配置
+    """
+    validators = {} if validators is None else validators
+    for alpha in alphas:
+        scope = _scope_of(alpha)
+        validator = validators.get(scope)
+        if validator is None:
+            instrument_type, region, delay, universe = scope
+            validator = validators[scope] = ExpressionValidator.from_catalog({
+                'instrumentType': instrument_type, 'region': region,
+                'delay': delay, 'universe': universe
+            })
+            if validator.field_types is None:
+                logging.info(f"No cached datafields for {scope}, checking syntax only")
+        errors = validator.validate(alpha['regular'])
+        if not errors:
+            yield alpha
+        elif on_invalid is not None:
+            on_invalid(alpha, errors)
@@ -2,60 +2,169 @@
 WorldQuant Brain 数据字段获取工具
 """
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Iterator, List, Tuple
 from urllib.parse import urlencode
 
-def get_datafields(session, search_scope, dataset_id='', search='', field_type=None):
+from .brainLogin import API_URL
+from .brainMetrics import DATAFIELDS_SECONDS
+from .brainRetryPolicy import request_with_retry
+
+DATAFIELDS_URL = f"{API_URL}/data-fields"
+
+# 每页数量（/data-fields 允许的最大 limit）
+PAGE_SIZE = 50
+
+# 同时请求的页数
+DEFAULT_PAGE_WORKERS = 4
+
+def _build_params(search_scope, dataset_id='', search=''):
+    """构建查询参数"""
+    params = {
+        'instrumentType': search_scope['instrumentType'],
+        'region': search_scope['region'],
+        'delay': str(search_scope['delay']),
+        'universe': search_scope['universe']
+    }
+
+    # 添加可选参数
+    if dataset_id:
+        params['dataset.id'] = dataset_id
+    if search:
+        params['search'] = search
+    return params
+
+def _get_page(session, url: str, params: Dict, offset: int, action: str) -> Dict:
+    """获取一页数据，暂时错误按重试策略重试，永久错误或重试用尽时抛出异常"""
+    response = request_with_retry(session, 'GET', f"{url}?{urlencode(params)}&offset={offset}",
+                                  action)
+    return response.json()
+
+def iter_offset_pages(session, url: str, params: Dict, page_size: int = PAGE_SIZE,
+                      max_workers: int = DEFAULT_PAGE_WORKERS,
+                      action: str = 'Page fetch') -> Iterator[Tuple[int, Dict]]:
+    """
+    并发获取按 limit/offset 分页的列表接口
+
+    第一页给出总数后，其余页在最多 max_workers 个请求的窗口内并发获取
+
+    Args:
+        session: Brain会话对象
+        url: 列表接口地址
+        params: 查询参数（limit 由 page_size 设置）
+        page_size: 每页数量
+        max_workers: 同时请求的页数
+        action: 错误信息中的操作名称
+
+    Yields:
+        tuple: 按到达顺序产出 (offset, 该页响应)，响应含 count 和 results
+    """
+    params = {**params, 'limit': page_size}
+    # 第一页同时给出总数
+    first = _get_page(session, url, params, 0, action)
+    yield 0, first
+
+    offsets = iter(range(page_size, first['count'], page_size))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = {}
+        try:
+            while True:
+                for offset in offsets:
+                    future = executor.submit(_get_page, session, url, params, offset, action)
+                    in_flight[future] = offset
+                    if len(in_flight) >= max_workers:
+                        break
+                if not in_flight:
+                    return
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield in_flight.pop(future), future.result()
+        finally:
+            # 提前结束或出错时不再发起剩余请求
+            for future in in_flight:
+                future.cancel()
+
+def _iter_offset_pages(session, params: Dict, max_workers: int) -> Iterator[Tuple[int, List[Dict]]]:
+    """并发获取数据字段各页，按到达顺序产出 (offset, 数据字段列表)"""
+    for offset, page in iter_offset_pages(session, DATAFIELDS_URL, params, PAGE_SIZE,
+                                          max_workers, 'Data fields fetch'):
+        yield offset, page['results']
+
+def iter_datafield_pages(session, search_scope, dataset_id='', search='',
+                         max_workers=DEFAULT_PAGE_WORKERS) -> Iterator[List[Dict]]:
+    """
+    逐页获取数据字段
+
+    第一页给出总数后，其余页在最多 max_workers 个请求的窗口内并发获取，
+    按到达顺序逐页产出，内存中最多只保留窗口内的几页
+
+    Args:
+        session: Brain会话对象
+        search_scope: 搜索范围配置
+        dataset_id: 数据集ID
+        search: 搜索关键词
+        max_workers: 同时请求的页数
+
+    Yields:
+        list: 一页数据字段（页与页之间不保证顺序）
+    """
+    params = _build_params(search_scope, dataset_id, search)
+    for _, page in _iter_offset_pages(session, params, max_workers):
+        yield page
+
+def iter_datafields(session, search_scope, dataset_id='', search='',
+                    max_workers=DEFAULT_PAGE_WORKERS) -> Iterator[Dict]:
+    """
+    逐个产出数据字段
+
+    Args:
+        session: Brain会话对象
+        search_scope: 搜索范围配置
+        dataset_id: 数据集ID
+        search: 搜索关键词
+        max_workers: 同时请求的页数
+
+    Yields:
+        dict: 数据字段
+    """
+    for page in iter_datafield_pages(session, search_scope, dataset_id, search, max_workers):
+        yield from page
+
+def get_datafields(session, search_scope, dataset_id='', search='', field_type=None,
+                   use_cache=True):
     """
     获取数据字段，支持类型过滤
-    
+
     Args:
         session: Brain会话对象
         search_scope: 搜索范围配置
         dataset_id: 数据集ID
         search: 搜索关键词
         field_type: 字段类型过滤(如'MATRIX')
-        
+        use_cache: 是否使用本地数据字段目录（过期时才重新下载）
+
     Returns:
         pd.DataFrame: 数据字段DataFrame
     """
-    # 构建参数字典
-    params = {
-        'instrumentType': search_scope['instrumentType'],
-        'region': search_scope['region'],
-        'delay': str(search_scope['delay']),
-        'universe': search_scope['universe'],
-        'limit': 50
-    }
-    
-    # 添加可选参数
-    if dataset_id:
-        params['dataset.id'] = dataset_id
-    if search:
-        params['search'] = search
-        
-    # 构建基础URL
-    base_url = "https://api.worldquantbrain.com/data-fields"
-    
-    # 获取总数
-    first_url = f"{base_url}?{urlencode(params)}&offset=0"
-    response = session.get(first_url)
-    if response.status_code != 200:
-        raise Exception(f"API请求失败: {response.json()}")
-        
-    count = response.json()['count']
-    
-    # 收集数据
-    datafields_list = []
-    for x in range(0, count, 50):
-        url = f"{base_url}?{urlencode(params)}&offset={x}"
-        response = session.get(url)
-        datafields_list.extend(response.json()['results'])
-    
-    # 转换为DataFrame
-    df = pd.DataFrame(datafields_list)
-    
-    # 类型过滤
-    if field_type and not df.empty:
-        df = df[df['type'] == field_type]
-    
-    return df
\ No newline at end of file
+    if use_cache:
+        from .brainDataFieldsCatalog import get_catalog
+        with DATAFIELDS_SECONDS.time(source='catalog'):
+            return get_catalog().get(session, search_scope, dataset_id, search, field_type)
+
+    with DATAFIELDS_SECONDS.time(source='api'):
+        return _download_datafields(session, search_scope, dataset_id, search, field_type)
+
+def _download_datafields(session, search_scope, dataset_id, search, field_type):
+    """直接从接口下载并过滤数据字段"""
+    # 逐页转换为DataFrame并过滤，不保留完整的原始列表
+    params = _build_params(search_scope, dataset_id, search)
+    frames = {}
+    for offset, page in _iter_offset_pages(session, params, DEFAULT_PAGE_WORKERS):
+        page_df = pd.DataFrame(page)
+        # 类型过滤
+        if field_type and not page_df.empty:
+            page_df = page_df[page_df['type'] == field_type]
+        frames[offset] = page_df
+
+    # 按offset拼接，保持与接口一致的顺序
+    return pd.concat([frames[offset] for offset in sorted(frames)], ignore_index=True)
@@ -1,7 +1,27 @@
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 import json
+import os
 from os.path import expanduser, join, dirname
+from threading import Lock
+from time import monotonic, perf_counter
+
+from .brainMetrics import (REAUTHENTICATIONS, REQUEST_SECONDS, REQUESTS, REQUESTS_IN_FLIGHT,
+                           endpoint_of, start_exporters_from_env)
+from .brainRateLimiter import request_limiter, is_throttled
+from .brainRetryPolicy import TRANSIENT, api_breaker, classify_response
+
+# API地址，可指向本地的模拟服务器(brainMockServer)做测试和基准测试
+API_URL = os.environ.get('BRAIN_API_URL', 'https://api.worldquantbrain.com').rstrip('/')
+
+AUTH_URL = f"{API_URL}/authentication"
+
+# 默认连接池大小
+DEFAULT_POOL_SIZE = 10
+
+# token过期前多少秒主动刷新
+DEFAULT_REFRESH_MARGIN = 300
 
 def get_credentials():
     try:
@@ -20,51 +40,135 @@ def get_credentials():
         raise
 
 
-def get_session(username=None, password=None):
-    if username is None or password is None:
-        username, password = get_credentials()
+class BrainSession(requests.Session):
+    def __init__(self, username, password, pool_size=DEFAULT_POOL_SIZE,
+                 refresh_margin=DEFAULT_REFRESH_MARGIN):
+        """
+        可在多个线程和协程间共享的Brain会话
+        
+        - 所有请求共享 request_limiter 的并发窗口
+        - 401时只由一个线程重新登录（single-flight），其他线程等待后直接重发
+        - 根据登录返回的token有效期，在过期前 refresh_margin 秒主动重新登录
+        - 连接池大小按并发数设置，复用keep-alive连接，避免重复TLS握手
         
-    def authenticate():
-        session = requests.Session()
-        session.auth = HTTPBasicAuth(username, password)  # 设置认证信息
-        response = session.post("https://api.worldquantbrain.com/authentication")
+        Args:
+            username: 用户名
+            password: 密码
+            pool_size: 连接池大小（应不小于并发请求数）
+            refresh_margin: 提前刷新token的秒数
+        """
+        super().__init__()
+        self.auth = HTTPBasicAuth(username, password)  # 设置认证信息
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        self.refresh_margin = refresh_margin
+        self.expires_at = None
+        self.auth_count = 0
+        self._auth_lock = Lock()
+        self._generation = 0
+        self.authenticate()
         
+    def authenticate(self):
+        """登录并记录token有效期"""
+        with self._auth_lock:
+            self._authenticate()
+            
+    def _authenticate(self):
+        response = super().request('POST', AUTH_URL)
         if response.status_code != 201:
             raise Exception(f"Authentication failed with status code: {response.status_code}")
-        return session
+            
+        try:
+            expiry = response.json().get('token', {}).get('expiry')
+        except ValueError:
+            expiry = None
+        self.expires_at = monotonic() + float(expiry) if expiry else None
+        self.auth_count += 1
+        self._generation += 1
+        REAUTHENTICATIONS.inc()
+        
+    @property
+    def generation(self):
+        """当前的登录代数，发起请求前读取，遇到401时传给 reauthenticate"""
+        return self._generation
+        
+    def reauthenticate(self, generation=None):
+        """
+        重新登录（single-flight）
+        
+        Args:
+            generation: 调用方发起请求时的登录代数；若已有其他线程完成了
+                        重新登录，则不再重复登录
+        """
+        with self._auth_lock:
+            if generation is None or generation == self._generation:
+                self._authenticate()
+                
+    def _needs_refresh(self):
+        return (self.expires_at is not None
+                and monotonic() >= self.expires_at - self.refresh_margin)
+        
+    def request(self, method, url, *args, **kwargs):
+        """统一的请求处理：限流、token主动刷新、401重新登录后重发、熔断统计"""
+        generation = self._generation
+        if self._needs_refresh():
+            self.reauthenticate(generation)
+            generation = self._generation
+            
+        request_limiter.acquire()
+        outcome = 'error'
+        try:
+            response = self._timed_request(method, url, *args, **kwargs)
+            if response.status_code == 401:
+                self.reauthenticate(generation)
+                response = self._timed_request(method, url, *args, **kwargs)
+            if is_throttled(response):
+                outcome = 'throttled'
+            elif response.status_code < 500:
+                outcome = 'ok'
+            api_breaker.record(classify_response(response))
+            return response
+        except requests.RequestException:
+            api_breaker.record(TRANSIENT)
+            raise
+        finally:
+            request_limiter.release(outcome)
+            
+    def _timed_request(self, method, url, *args, **kwargs):
+        """发送请求并记录耗时、状态码和在途数量"""
+        method, endpoint = method.upper(), endpoint_of(url)
+        status = 'error'
+        REQUESTS_IN_FLIGHT.inc()
+        start = perf_counter()
+        try:
+            response = super().request(method, url, *args, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            REQUEST_SECONDS.observe(perf_counter() - start, method=method, endpoint=endpoint)
+            REQUESTS.inc(method=method, endpoint=endpoint, status=status)
 
-    session = authenticate()
-    
-    # 包装所有HTTP方法
-    original_get = session.get
-    original_post = session.post
-    original_put = session.put
-    original_delete = session.delete
-    
-    def request_with_retry(method, *args, **kwargs):
-        """统一的请求重试处理"""
-        response = method(*args, **kwargs)
-        if response.status_code == 401:
-            nonlocal session
-            session = authenticate()
-            # 根据原始方法重新发送请求
-            if method == original_get:
-                response = session.get(*args, **kwargs)
-            elif method == original_post:
-                response = session.post(*args, **kwargs)
-            elif method == original_put:
-                response = session.put(*args, **kwargs)
-            elif method == original_delete:
-                response = session.delete(*args, **kwargs)
-        return response
-    
-    # 替换所有HTTP方法
-    session.get = lambda *args, **kwargs: request_with_retry(original_get, *args, **kwargs)
-    session.post = lambda *args, **kwargs: request_with_retry(original_post, *args, **kwargs)
-    session.put = lambda *args, **kwargs: request_with_retry(original_put, *args, **kwargs)
-    session.delete = lambda *args, **kwargs: request_with_retry(original_delete, *args, **kwargs)
+
+def get_session(username=None, password=None, pool_size=DEFAULT_POOL_SIZE):
+    """
+    获取已登录的Brain会话
     
-    return session
+    Args:
+        username: 用户名，默认读取account.txt
+        password: 密码，默认读取account.txt
+        pool_size: 连接池大小（应不小于并发请求数）
+        
+    Returns:
+        BrainSession: 线程安全的会话对象
+    """
+    if username is None or password is None:
+        username, password = get_credentials()
+        
+    # 按 BRAIN_METRICS_* 环境变量启动指标导出
+    start_exporters_from_env()
+    return BrainSession(username, password, pool_size=pool_size)
 # if __name__ == "__main__":
 #     try:
 #         # 自动从account.txt读取凭据
@@ -0,0 +1,470 @@
+"""
+WorldQuant Brain 运行指标
+计数器、仪表和直方图，可通过本地 Prometheus 文本接口或定期写出的JSON快照导出，
+并提供可选的采样分析器，用于查看吞吐量耗在哪里
+"""
+import json
+import logging
+import os
+import re
+import sys
+from bisect import bisect_left
+from collections import Counter as _Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread, get_ident
+from time import perf_counter, sleep, time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+
+# 请求和数据库操作耗时的直方图分桶(秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+DEFAULT_METRICS_PORT = 9108
+
+_ID_PATH = re.compile(r'/(simulations|alphas)/[\w-]+')
+
+def endpoint_of(url: str) -> str:
+    """把URL归并为接口路径，如 /simulations/{id}（避免每个ID一个标签值）"""
+    return _ID_PATH.sub(r'/\1/{id}', urlparse(url).path).rstrip('/') or '/'
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = Lock()
+
+    def _key(self, labels: Dict) -> Tuple:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _label_text(self, key: Tuple, extra: str = '') -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def _items(self) -> List[Tuple[Tuple, object]]:
+        with self._lock:
+            return list(self._values.items())
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{self._label_text(key)} {value}" for key, value in self._items()]
+
+    def snapshot(self) -> List[Dict]:
+        return [{'labels': dict(zip(self.labelnames, key)), 'value': value}
+                for key, value in self._items()]
+
+
+class Gauge(Counter):
+    """可增可减的当前值，也可以在读取时调用函数取值"""
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._functions = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float], **labels):
+        """读取指标时调用 function 取值"""
+        with self._lock:
+            self._functions[self._key(labels)] = function
+
+    def _items(self) -> List[Tuple[Tuple, object]]:
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for key, function in functions.items():
+            try:
+                values[key] = function()
+            except Exception as e:
+                logging.error(f"Gauge {self.name} function failed: {str(e)}")
+        return list(values.items())
+
+    @contextmanager
+    def track_in_progress(self, **labels):
+        """代码块执行期间值加一"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    """按分桶统计的观测值（如耗时）"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """记录代码块的耗时"""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def _items(self) -> List[Tuple[Tuple, object]]:
+        with self._lock:
+            return [(key, (list(counts), total, count))
+                    for key, (counts, total, count) in self._values.items()]
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in self._items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                labels = self._label_text(key, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(key)} {total}")
+            lines.append(f"{self.name}_count{self._label_text(key)} {count}")
+        return lines
+
+    def _quantile(self, counts: List[int], count: int, q: float) -> Optional[float]:
+        """按分桶线性插值估计分位数"""
+        if not count:
+            return None
+        rank = q * count
+        cumulative = 0
+        lower = 0.0
+        for bound, bucket_count in zip(self.buckets, counts):
+            if cumulative + bucket_count >= rank:
+                fraction = (rank - cumulative) / bucket_count if bucket_count else 0
+                return lower + (bound - lower) * fraction
+            cumulative += bucket_count
+            lower = bound
+        return self.buckets[-1]
+
+    def snapshot(self) -> List[Dict]:
+        result = []
+        for key, (counts, total, count) in self._items():
+            result.append({
+                'labels': dict(zip(self.labelnames, key)),
+                'count': count,
+                'sum': total,
+                'mean': total / count if count else None,
+                'p50': self._quantile(counts, count, 0.5),
+                'p99': self._quantile(counts, count, 0.99),
+            })
+        return result
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """指标注册表（同名指标只创建一次）"""
+        self._metrics = {}
+        self._lock = Lock()
+
+    def _get_or_create(self, cls, name: str, help: str, labelnames: Sequence[str], **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labelnames, **kwargs)
+            elif type(metric) is not cls or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} already registered with a different type or labels")
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help, labelnames, buckets=buckets)
+
+    def render_prometheus(self) -> str:
+        """Prometheus 文本格式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> Dict:
+        """全部指标的当前值（直方图给出次数、总和与估计的p50/p99）"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            'timestamp': time(),
+            'metrics': {metric.name: {'type': metric.kind, 'help': metric.help,
+                                      'values': metric.snapshot()}
+                        for metric in metrics}
+        }
+
+# 全局注册表
+metrics = MetricsRegistry()
+
+# 请求
+REQUEST_SECONDS = metrics.histogram(
+    'brain_request_seconds', 'Brain API request latency', ('method', 'endpoint'))
+REQUESTS = metrics.counter(
+    'brain_requests_total', 'Brain API responses by status code', ('method', 'endpoint', 'status'))
+REQUESTS_IN_FLIGHT = metrics.gauge(
+    'brain_requests_in_flight', 'Brain API requests currently in flight')
+REAUTHENTICATIONS = metrics.counter(
+    'brain_authentications_total', 'Logins, including re-authentication after 401 or expiry')
+
+# 模拟
+SIMULATION_SUBMITS = metrics.counter(
+    'brain_simulation_submits_total', 'Simulation POST attempts by outcome', ('outcome',))
+SIMULATION_RETRIES = metrics.counter(
+    'brain_simulation_retries_total', 'Simulation submissions retried, by error class',
+    ('reason',))
+SIMULATIONS_IN_FLIGHT = metrics.gauge(
+    'brain_simulations_in_flight', 'Submitted simulations waiting for completion')
+SIMULATION_RESULTS = metrics.counter(
+    'brain_simulation_results_total', 'Finished simulations by status', ('status',))
+ENGINE_QUEUE_DEPTH = metrics.gauge(
+    'brain_engine_queue_depth', 'Alpha groups waiting in the engine queue')
+
+# 提交
+SUBMISSIONS = metrics.counter(
+    'brain_submissions_total', 'Alpha submissions by final status', ('status',))
+SUBMIT_SECONDS = metrics.histogram(
+    'brain_submit_seconds', 'Time from submit request to final status',
+    buckets=(1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1200.0))
+
+# 熔断
+CIRCUIT_OPEN = metrics.gauge(
+    'brain_circuit_open', 'Whether the circuit breaker is pausing dispatch', ('name',))
+CIRCUIT_TRIPS = metrics.counter(
+    'brain_circuit_trips_total', 'Times the circuit breaker opened', ('name',))
+
+# 数据库
+DB_FLUSH_SECONDS = metrics.histogram(
+    'brain_db_flush_seconds', 'BulkWriter flush duration')
+DB_FLUSH_OPS = metrics.counter(
+    'brain_db_flush_ops_total', 'Updates written by BulkWriter')
+DB_WRITE_ERRORS = metrics.counter(
+    'brain_db_write_errors_total', 'Failed BulkWriter updates')
+DB_PENDING_UPDATES = metrics.gauge(
+    'brain_db_pending_updates', 'Updates buffered in BulkWriter')
+DB_OPERATION_SECONDS = metrics.histogram(
+    'brain_db_operation_seconds', 'SimulationDB operation duration', ('operation',))
+
+# 数据字段
+DATAFIELDS_SECONDS = metrics.histogram(
+    'brain_datafields_seconds', 'get_datafields duration', ('source',))
+
+
+class _ExportHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/metrics':
+            body, content_type = metrics.render_prometheus(), 'text/plain; version=0.0.4'
+        elif path == '/metrics.json':
+            body, content_type = json.dumps(metrics.snapshot(), default=str), 'application/json'
+        elif path == '/profile' and _profiler is not None:
+            body, content_type = _profiler.collapsed(), 'text/plain'
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        data = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+_server = None
+_snapshot_thread = None
+_profiler = None
+_export_lock = Lock()
+
+def start_metrics_server(port: int = DEFAULT_METRICS_PORT, host: str = '127.0.0.1') -> str:
+    """
+    启动本地指标接口：/metrics（Prometheus文本）、/metrics.json、/profile（采样分析器开启时）
+
+    Returns:
+        str: 接口地址
+    """
+    global _server
+    with _export_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _ExportHandler)
+            _server.daemon_threads = True
+            Thread(target=_server.serve_forever, name='brain-metrics', daemon=True).start()
+            logging.info(f"Metrics server listening on {host}:{_server.server_address[1]}")
+        host, port = _server.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+def write_snapshot(path: str):
+    """把当前指标写入JSON文件（先写临时文件再替换，读取方不会读到半个文件）"""
+    snapshot = metrics.snapshot()
+    if _profiler is not None:
+        snapshot['profile'] = _profiler.top()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot, f, default=str)
+    os.replace(tmp_path, path)
+
+def start_json_snapshots(path: str, interval: float = 30.0):
+    """每 interval 秒把指标写入一次JSON文件"""
+    global _snapshot_thread
+    with _export_lock:
+        if _snapshot_thread is not None:
+            return
+
+        def run():
+            while True:
+                sleep(interval)
+                try:
+                    write_snapshot(path)
+                except Exception as e:
+                    logging.error(f"Metrics snapshot failed: {str(e)}")
+
+        _snapshot_thread = Thread(target=run, name='brain-metrics-snapshot', daemon=True)
+        _snapshot_thread.start()
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.01, max_depth: int = 40):
+        """
+        采样分析器
+
+        在后台线程中每隔 interval 秒读取一次所有线程的调用栈并计数，
+        开销与被分析的代码无关，可以在长时间运行的任务中开启
+
+        Args:
+            interval: 采样间隔(秒)
+            max_depth: 每个调用栈最多记录的层数
+        """
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self._stacks = _Counter()
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+
+    def start(self) -> 'SamplingProfiler':
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='brain-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own = get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            stacks = []
+            for thread_id, frame in frames.items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stacks.append(';'.join(reversed(stack)))
+            with self._lock:
+                self.samples += 1
+                self._stacks.update(stacks)
+
+    def collapsed(self) -> str:
+        """折叠调用栈格式（每行 "栈;帧 次数"，可直接生成火焰图）"""
+        with self._lock:
+            return '\n'.join(f"{stack} {count}" for stack, count in self._stacks.most_common())
+
+    def top(self, n: int = 20) -> List[Tuple[str, int]]:
+        """采样次数最多的栈顶函数"""
+        leaves = _Counter()
+        with self._lock:
+            for stack, count in self._stacks.items():
+                leaves[stack.rsplit(';', 1)[-1]] += count
+        return leaves.most_common(n)
+
+def start_profiler(interval: float = 0.01) -> SamplingProfiler:
+    """启动全局采样分析器（结果可从 /profile 或JSON快照中读取）"""
+    global _profiler
+    with _export_lock:
+        if _profiler is None:
+            _profiler = SamplingProfiler(interval).start()
+        return _profiler
+
+def stop_profiler() -> Optional[SamplingProfiler]:
+    """停止全局采样分析器，返回其结果"""
+    global _profiler
+    with _export_lock:
+        profiler, _profiler = _profiler, None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+def start_exporters_from_env():
+    """
+    按环境变量启动导出：
+    BRAIN_METRICS_PORT（本地指标接口端口）、BRAIN_METRICS_JSON（JSON快照路径）、
+    BRAIN_METRICS_INTERVAL（快照间隔秒数）、BRAIN_PROFILE_INTERVAL（采样分析器间隔秒数）
+    """
+    if os.environ.get('BRAIN_METRICS_PORT'):
+        start_metrics_server(int(os.environ['BRAIN_METRICS_PORT']))
+    if os.environ.get('BRAIN_METRICS_JSON'):
+        start_json_snapshots(os.environ['BRAIN_METRICS_JSON'],
+                             float(os.environ.get('BRAIN_METRICS_INTERVAL', 30)))
+    if os.environ.get('BRAIN_PROFILE_INTERVAL'):
+        start_profiler(float(os.environ['BRAIN_PROFILE_INTERVAL']))
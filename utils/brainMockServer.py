@@ -0,0 +1,458 @@
+"""
+WorldQuant Brain 本地模拟服务器
+实现本项目用到的接口（登录、模拟与进度轮询、数据字段分页、alpha详情、PnL、提交），
+可配置延迟、401/429注入和并发上限，用于测试和基准测试，不消耗真实配额
+"""
+import json
+import logging
+import random
+import re
+import string
+from collections import Counter
+from datetime import datetime, timezone
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import monotonic, sleep
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+from uuid import uuid4
+
+import numpy as np
+
+# 默认端口（基准测试按 BRAIN_API_URL 指向这里）
+DEFAULT_MOCK_PORT = 18080
+
+# 每页最多返回的数据字段数（与 /data-fields 一致）
+MAX_PAGE_SIZE = 50
+
+# /users/self/alphas 每页最大数量
+MAX_ALPHA_PAGE_SIZE = 100
+
+# multi-simulation 允许的alpha数量
+MULTI_SIZE_RANGE = (2, 10)
+
+# 提交检查要求的最低sharpe
+SUBMIT_MIN_SHARPE = 1.25
+
+_SIMULATION_PATH = re.compile(r'^/simulations/([\w-]+)$')
+_ALPHA_PATH = re.compile(r'^/alphas/(\w+)(/submit|/recordsets/pnl)?$')
+
+
+class MockBrainServer:
+    def __init__(self, host: str = '127.0.0.1', port: int = DEFAULT_MOCK_PORT,
+                 latency: float = 0.0, jitter: float = 0.0,
+                 simulation_time: float = 1.0, simulation_jitter: float = 0.5,
+                 retry_after: float = 0.5, throttle_rate: float = 0.0,
+                 unauthorized_rate: float = 0.0, error_rate: float = 0.05,
+                 server_error_rate: float = 0.0, max_concurrent: Optional[int] = None, token_ttl: float = 4 * 3600,
+                 submit_time: float = 0.0, datafield_count: int = 1000,
+                 pnl_days: int = 500, seed: Optional[int] = None):
+        """
+        模拟的Brain API服务器
+
+        Args:
+            host: 监听地址
+            port: 监听端口，0表示随机端口
+            latency: 每个请求的基础延迟(秒)
+            jitter: 在基础延迟上随机增加的最大延迟(秒)
+            simulation_time: 模拟从提交到完成的平均时间(秒)
+            simulation_jitter: 模拟时间的随机波动(秒)
+            retry_after: 进度轮询和限流时返回的 Retry-After(秒)
+            throttle_rate: 已登录请求随机返回429的概率
+            unauthorized_rate: 已登录请求随机返回401（并使token失效）的概率
+            error_rate: 模拟以ERROR结束的概率
+            server_error_rate: 已登录请求随机返回503的概率
+            max_concurrent: 同时进行的模拟数上限，超过时返回并发上限错误；None表示不限
+            token_ttl: 登录token的有效期(秒)
+            submit_time: 提交检查耗时(秒)，期间 GET submit 返回 Retry-After
+            datafield_count: 每个搜索范围的数据字段数量
+            pnl_days: PnL记录的交易日数
+            seed: 随机数种子
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.simulation_time = simulation_time
+        self.simulation_jitter = simulation_jitter
+        self.retry_after = retry_after
+        self.throttle_rate = throttle_rate
+        self.unauthorized_rate = unauthorized_rate
+        self.error_rate = error_rate
+        self.server_error_rate = server_error_rate
+        self.max_concurrent = max_concurrent
+        self.token_ttl = token_ttl
+        self.submit_time = submit_time
+        self.datafield_count = datafield_count
+        self.pnl_days = pnl_days
+        self.counts = Counter()
+        self._random = random.Random(seed)
+        self._lock = Lock()
+        self._tokens = {}
+        self._simulations = {}
+        self._alphas = {}
+        self._submissions = {}
+        self._outage_until = 0.0
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """服务器地址，可作为 BRAIN_API_URL"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'MockBrainServer':
+        """在后台线程中开始服务"""
+        self._thread = Thread(target=self._server.serve_forever, name='brain-mock-server',
+                              daemon=True)
+        self._thread.start()
+        logging.info(f"Mock Brain server listening on {self.url}")
+        return self
+
+    def stop(self):
+        """停止服务"""
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self) -> Dict:
+        """按 "方法 接口 状态码" 统计的请求数，以及服务器状态"""
+        with self._lock:
+            active = sum(1 for sim in self._simulations.values()
+                         if sim['parent'] is None and sim['done_at'] > monotonic())
+            return {'requests': dict(self.counts), 'simulations': len(self._simulations),
+                    'active_simulations': active, 'alphas': len(self._alphas),
+                    'submissions': len(self._submissions)}
+
+    def outage(self, seconds: float):
+        """接下来 seconds 秒内所有已登录请求返回503（模拟服务中断）"""
+        with self._lock:
+            self._outage_until = monotonic() + seconds
+
+    def unavailable(self) -> bool:
+        return monotonic() < self._outage_until or self._chance(self.server_error_rate)
+
+    def _chance(self, rate: float) -> bool:
+        with self._lock:
+            return rate > 0 and self._random.random() < rate
+
+    def _delay(self):
+        if self.latency or self.jitter:
+            with self._lock:
+                extra = self._random.uniform(0, self.jitter)
+            sleep(self.latency + extra)
+
+    # 各接口的处理，返回 (状态码, 响应体, 响应头)
+
+    def authenticate(self, authorization: Optional[str]) -> Tuple[int, Dict, Dict]:
+        if not authorization or not authorization.startswith('Basic '):
+            return 401, {'detail': 'Invalid credentials.'}, {}
+        token = uuid4().hex
+        with self._lock:
+            self._tokens[token] = monotonic() + self.token_ttl
+        body = {'user': {'id': 'MOCK'}, 'token': {'expiry': self.token_ttl},
+                'permissions': ['TEST']}
+        return 201, body, {'Set-Cookie': f't={token}; Path=/'}
+
+    def check_token(self, token: Optional[str]) -> bool:
+        with self._lock:
+            expires_at = self._tokens.get(token)
+            if expires_at is None or expires_at <= monotonic():
+                self._tokens.pop(token, None)
+                return False
+        if self._chance(self.unauthorized_rate):
+            with self._lock:
+                self._tokens.pop(token, None)
+            return False
+        return True
+
+    def create_simulation(self, payload, base_url: str) -> Tuple[int, Dict, Dict]:
+        alphas = payload if isinstance(payload, list) else [payload]
+        if isinstance(payload, list) and not MULTI_SIZE_RANGE[0] <= len(payload) <= MULTI_SIZE_RANGE[1]:
+            return 400, {'detail': f'Multi-simulation must contain {MULTI_SIZE_RANGE} alphas'}, {}
+        if not all(isinstance(alpha, dict) and alpha.get('regular') and 'settings' in alpha
+                   for alpha in alphas):
+            return 400, {'detail': 'Invalid simulation payload'}, {}
+
+        now = monotonic()
+        with self._lock:
+            if self.max_concurrent is not None:
+                active = sum(1 for sim in self._simulations.values()
+                             if sim['parent'] is None and sim['done_at'] > now)
+                if active >= self.max_concurrent:
+                    return (429, {'detail': 'CONCURRENT_SIMULATION_LIMIT_EXCEEDED'},
+                            {'Retry-After': str(self.retry_after)})
+            done_at = now + max(0.0, self.simulation_time + self._random.uniform(
+                -self.simulation_jitter, self.simulation_jitter))
+            sim_id = uuid4().hex[:16]
+            children = None
+            if isinstance(payload, list):
+                children = [self._new_child(alpha, sim_id, done_at) for alpha in alphas]
+            self._simulations[sim_id] = {'done_at': done_at, 'parent': None,
+                                         'regular': alphas[0]['regular'],
+                                         'children': children, 'alpha': None, 'error': None}
+            if children is None:
+                self._finish(self._simulations[sim_id])
+        return 201, {}, {'Location': f"{base_url}/simulations/{sim_id}"}
+
+    def _new_child(self, alpha: Dict, parent: str, done_at: float) -> str:
+        child_id = uuid4().hex[:16]
+        self._simulations[child_id] = {'done_at': done_at, 'parent': parent,
+                                       'regular': alpha['regular'], 'children': None,
+                                       'alpha': None, 'error': None}
+        self._finish(self._simulations[child_id])
+        return child_id
+
+    def _finish(self, sim: Dict):
+        """预先决定模拟的结果（持有锁时调用）"""
+        if self._random.random() < self.error_rate:
+            sim['error'] = 'Mock simulation error'
+            return
+        alpha_id = ''.join(self._random.choices(string.ascii_letters + string.digits, k=7))
+        sharpe = self._random.gauss(0.8, 0.8)
+        now = _now()
+        self._alphas[alpha_id] = {
+            'id': alpha_id,
+            'type': 'REGULAR',
+            'status': 'UNSUBMITTED',
+            'dateCreated': now,
+            'dateModified': now,
+            'regular': {'code': sim['regular']},
+            'is': {
+                'sharpe': round(sharpe, 2),
+                'fitness': round(sharpe * 0.7, 2),
+                'turnover': round(self._random.uniform(0.01, 0.8), 4),
+                'returns': round(self._random.gauss(0.05, 0.05), 4),
+                'drawdown': round(self._random.uniform(0.01, 0.3), 4),
+                'margin': round(self._random.gauss(0.0005, 0.0005), 6),
+                'longCount': self._random.randint(100, 1500),
+                'shortCount': self._random.randint(100, 1500),
+                'pnl': int(sharpe * 1000000),
+                'checks': [{'name': 'LOW_SHARPE', 'limit': SUBMIT_MIN_SHARPE,
+                            'value': round(sharpe, 2),
+                            'result': 'PASS' if sharpe >= SUBMIT_MIN_SHARPE else 'FAIL'}]
+            }
+        }
+        sim['alpha'] = alpha_id
+
+    def get_simulation(self, sim_id: str) -> Tuple[int, Dict, Dict]:
+        with self._lock:
+            sim = self._simulations.get(sim_id)
+        if sim is None:
+            return 404, {'detail': 'Not found.'}, {}
+        remaining = sim['done_at'] - monotonic()
+        if remaining > 0:
+            progress = 1 - remaining / max(self.simulation_time + self.simulation_jitter, 1e-6)
+            return (200, {'progress': round(max(progress, 0.0), 2)},
+                    {'Retry-After': f"{min(self.retry_after, remaining):.3f}"})
+        if sim['children'] is not None:
+            return 200, {'id': sim_id, 'status': 'COMPLETE', 'children': sim['children']}, {}
+        if sim['error']:
+            return 200, {'id': sim_id, 'status': 'ERROR', 'message': sim['error']}, {}
+        return 200, {'id': sim_id, 'status': 'COMPLETE', 'alpha': sim['alpha']}, {}
+
+    def get_alpha(self, alpha_id: str) -> Tuple[int, Dict, Dict]:
+        with self._lock:
+            alpha = self._alphas.get(alpha_id)
+        if alpha is None:
+            return 404, {'detail': 'Not found.'}, {}
+        return 200, alpha, {}
+
+    def get_pnl(self, alpha_id: str) -> Tuple[int, Dict, Dict]:
+        with self._lock:
+            alpha = self._alphas.get(alpha_id)
+        if alpha is None:
+            return 404, {'detail': 'Not found.'}, {}
+        # 每个alpha的PnL由ID决定，重复请求结果一致
+        rng = np.random.default_rng(int.from_bytes(alpha_id.encode(), 'little') % (2 ** 32))
+        daily = rng.normal(alpha['is']['sharpe'] / 16, 1.0, self.pnl_days) * 1000
+        dates = np.arange(np.datetime64('2019-01-01'), np.datetime64('2019-01-01') + self.pnl_days)
+        records = [[str(date), float(value)] for date, value in zip(dates, np.cumsum(daily))]
+        return 200, {'schema': {'properties': [{'name': 'date'}, {'name': 'pnl'}]},
+                     'records': records}, {}
+
+    def submit(self, alpha_id: str, start: bool) -> Tuple[int, Dict, Dict]:
+        """POST 开始提交检查；GET 查询结果（尚未开始时同时开始）"""
+        with self._lock:
+            alpha = self._alphas.get(alpha_id)
+            if alpha is None:
+                return 404, {'detail': 'Not found.'}, {}
+            if alpha_id not in self._submissions:
+                self._submissions[alpha_id] = monotonic() + self.submit_time
+            elif start:
+                return 403, {'detail': 'Already submitted.'}, {}
+            remaining = self._submissions[alpha_id] - monotonic()
+        if start:
+            return 201, {}, {'Retry-After': f"{max(remaining, 0):.3f}"}
+        if remaining > 0:
+            return 200, {}, {'Retry-After': f"{min(self.retry_after, remaining):.3f}"}
+        checks = alpha['is']['checks']
+        if not all(check['result'] == 'PASS' for check in checks):
+            return 403, {'id': alpha_id, 'is': {'checks': checks}}, {}
+        with self._lock:
+            if alpha['status'] != 'ACTIVE':
+                alpha['status'] = 'ACTIVE'
+                alpha['dateModified'] = alpha['dateSubmitted'] = _now()
+        return 200, {'id': alpha_id, 'is': {'checks': checks}}, {}
+
+    def list_alphas(self, query: Dict[str, List[str]]) -> Tuple[int, Dict, Dict]:
+        """GET /users/self/alphas：支持 order、dateModified>=、status 过滤和 limit/offset 分页"""
+        params = {key: values[0] for key, values in query.items()}
+        limit = min(int(params.get('limit', MAX_ALPHA_PAGE_SIZE)), MAX_ALPHA_PAGE_SIZE)
+        offset = int(params.get('offset', 0))
+        with self._lock:
+            alphas = [dict(alpha) for alpha in self._alphas.values()]
+        for field in ('dateCreated', 'dateModified'):
+            since = params.get(f'{field}>')
+            if since:
+                since = datetime.fromisoformat(since)
+                alphas = [alpha for alpha in alphas
+                          if datetime.fromisoformat(alpha[field]) >= since]
+        if params.get('status'):
+            alphas = [alpha for alpha in alphas if alpha['status'] == params['status']]
+        order = params.get('order', '-dateCreated')
+        field = order.lstrip('-')
+        if field not in ('dateCreated', 'dateModified'):
+            return 400, {'detail': f'Invalid order: {order}'}, {}
+        alphas.sort(key=lambda alpha: (alpha[field], alpha['id']), reverse=order.startswith('-'))
+        return 200, {'count': len(alphas), 'results': alphas[offset:offset + limit]}, {}
+
+    def get_datafields(self, query: Dict[str, List[str]]) -> Tuple[int, Dict, Dict]:
+        params = {key: values[0] for key, values in query.items()}
+        missing = [key for key in ('instrumentType', 'region', 'delay', 'universe')
+                   if key not in params]
+        if missing:
+            return 400, {'detail': f'Missing parameters: {missing}'}, {}
+        limit = min(int(params.get('limit', MAX_PAGE_SIZE)), MAX_PAGE_SIZE)
+        offset = int(params.get('offset', 0))
+        fields = _mock_datafields(self.datafield_count, params['region'])
+        dataset_id = params.get('dataset.id')
+        if dataset_id:
+            fields = [field for field in fields if field['dataset']['id'] == dataset_id]
+        search = params.get('search', '').lower()
+        if search:
+            fields = [field for field in fields
+                      if search in field['id'] or search in field['description'].lower()]
+        return 200, {'count': len(fields), 'results': fields[offset:offset + limit]}, {}
+
+
+def _now() -> str:
+    """与Brain接口格式相同的当前时间（秒精度，带时区）"""
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+@lru_cache(maxsize=16)
+def _mock_datafields(count: int, region: str) -> List[Dict]:
+    """生成确定的数据字段列表（调用方不能修改）"""
+    fields = []
+    for index in range(count):
+        field_type = 'GROUP' if index % 25 == 0 else 'VECTOR' if index % 10 == 0 else 'MATRIX'
+        fields.append({
+            'id': f'mock_field_{index}',
+            'description': f'Mock {field_type.lower()} field {index} ({region})',
+            'dataset': {'id': f'mock{index // 100}', 'name': f'Mock dataset {index // 100}'},
+            'type': field_type,
+            'coverage': 0.9,
+            'userCount': index % 50,
+            'alphaCount': index % 200
+        })
+    return fields
+
+
+def mock_field_ids(count: int = 1000, field_type: str = 'MATRIX') -> List[str]:
+    """模拟服务器某个搜索范围下指定类型的数据字段ID（与 datafield_count 对应）"""
+    return [field['id'] for field in _mock_datafields(count, 'USA') if field['type'] == field_type]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 响应头和响应体分开写入，开启Nagle时keep-alive连接上每个请求会多等约40ms
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def mock(self) -> MockBrainServer:
+        return self.server.mock
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def _dispatch(self, method: str):
+        parsed = urlparse(self.path)
+        path = parsed.path.rstrip('/')
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        self.mock._delay()
+
+        endpoint = re.sub(r'/(simulations|alphas)/[\w-]+', r'/\1/{id}', path)
+        try:
+            status, payload, headers = self._route(method, path, parsed.query, body)
+        except Exception as e:
+            logging.error(f"Mock server error for {method} {path}: {str(e)}")
+            status, payload, headers = 500, {'detail': str(e)}, {}
+        with self.mock._lock:
+            self.mock.counts[f"{method} {endpoint} {status}"] += 1
+        self._send(status, payload, headers)
+
+    def _route(self, method: str, path: str, query: str, body: bytes) -> Tuple[int, Dict, Dict]:
+        mock = self.mock
+        if path == '/authentication':
+            if method != 'POST':
+                return 405, {'detail': 'Method not allowed.'}, {}
+            return mock.authenticate(self.headers.get('Authorization'))
+
+        cookie = self.headers.get('Cookie') or ''
+        token = next((part.split('=', 1)[1] for part in cookie.split('; ')
+                      if part.startswith('t=')), None)
+        if not mock.check_token(token):
+            return 401, {'detail': 'Incorrect authentication credentials.'}, {}
+        if mock.unavailable():
+            return 503, {'detail': 'Service temporarily unavailable.'}, {}
+        if mock._chance(mock.throttle_rate):
+            return 429, {'detail': 'API rate limit exceeded'}, {'Retry-After': str(mock.retry_after)}
+
+        if path == '/simulations' and method == 'POST':
+            try:
+                payload = json.loads(body or b'null')
+            except ValueError:
+                return 400, {'detail': 'Invalid JSON.'}, {}
+            host = self.headers.get('Host') or '%s:%s' % self.server.server_address[:2]
+            return mock.create_simulation(payload, f"http://{host}")
+        if path == '/users/self/alphas' and method == 'GET':
+            return mock.list_alphas(parse_qs(query))
+        if path == '/data-fields' and method == 'GET':
+            return mock.get_datafields(parse_qs(query))
+        match = _SIMULATION_PATH.match(path)
+        if match and method == 'GET':
+            return mock.get_simulation(match.group(1))
+        match = _ALPHA_PATH.match(path)
+        if match:
+            alpha_id, suffix = match.groups()
+            if suffix == '/submit':
+                return mock.submit(alpha_id, start=method == 'POST')
+            if method == 'GET':
+                return mock.get_pnl(alpha_id) if suffix else mock.get_alpha(alpha_id)
+        return 404, {'detail': 'Not found.'}, {}
+
+    def _send(self, status: int, payload: Dict, headers: Dict):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
@@ -0,0 +1,345 @@
+"""
+WorldQuant Brain alpha PnL 存储与自相关检查工具
+把已完成alpha的每日PnL存入内存映射矩阵，批量计算候选与已有alpha的最大相关性
+
+相关性按存储的日历计算：日历是已写入或检查过的alpha中最近的 length 个交易日，
+有更新的PnL时向前滚动，较早写入的alpha在之后新增的日期上没有数据（计算时记为0）
+"""
+import json
+import logging
+import os
+from os.path import exists, expanduser, join
+from threading import Lock, RLock
+from time import sleep
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .brainRetryPolicy import request_with_retry
+from .brainSimulationTracker import ALPHAS_URL, parse_retry_after
+
+DEFAULT_PNL_PATH = os.environ.get(
+    'BRAIN_PNL_PATH',
+    join(expanduser('~'), '.cache', 'brain', 'pnl')
+)
+
+# 默认保存的交易日数
+DEFAULT_LENGTH = 1000
+
+# 每次计算相关性处理的行数
+CHUNK_ROWS = 4096
+
+def fetch_alpha_pnl(session, alpha_id: str,
+                    max_wait: float = 120) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    获取alpha的每日PnL
+
+    Args:
+        session: Brain会话对象
+        alpha_id: Alpha ID
+        max_wait: 等待服务器生成PnL的最长时间(秒)
+
+    Returns:
+        tuple: (日期数组 datetime64[D], 每日PnL变化数组)
+    """
+    url = f"{ALPHAS_URL}/{alpha_id}/recordsets/pnl"
+    waited = 0.0
+    while True:
+        # 限流和暂时错误由重试策略处理，这里只等待PnL生成
+        response = request_with_retry(session, 'GET', url, f"PnL fetch for {alpha_id}")
+        retry_after = parse_retry_after(response, 0)
+        if not retry_after:
+            break
+        if waited >= max_wait:
+            raise Exception(f"PnL for {alpha_id} not ready after {waited:.0f}s")
+        sleep(retry_after)
+        waited += retry_after
+
+    data = response.json()
+    names = [prop['name'] for prop in data['schema']['properties']]
+    date_index, pnl_index = names.index('date'), names.index('pnl')
+    records = data['records']
+    dates = np.array([record[date_index] for record in records], dtype='datetime64[D]')
+    cumulative = np.array([record[pnl_index] for record in records], dtype=float)
+    # 记录集给出累计PnL，转为每日变化
+    return dates[1:], np.diff(cumulative)
+
+
+class PnLStore:
+    def __init__(self, path: str = DEFAULT_PNL_PATH, length: int = DEFAULT_LENGTH):
+        """
+        alpha PnL 存储
+
+        每个alpha一行、按统一日历对齐的 float32 每日PnL，存放在内存映射文件中，
+        行号与 alpha_ids.txt 中的顺序一致。日历是见过的最近 length 个交易日，
+        PnL更新到日历之后时整体向前滚动，日历外的日期丢弃、缺失的日期为NaN。
+        按行标准化后的矩阵另存一份(pnl_std.f32)，写入时只标准化新的一行，
+        计算相关性时不再重复标准化整个矩阵
+
+        Args:
+            path: 存储目录
+            length: 每行的交易日数（目录已存在时以目录中的设置为准）
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        # 写入、扩容和读取都持有该锁，多个提交线程共用一个存储时不会读到替换中的矩阵
+        self._lock = RLock()
+        meta_path = join(path, 'meta.json')
+        if exists(meta_path):
+            with open(meta_path) as f:
+                length = json.load(f)['length']
+        else:
+            with open(meta_path, 'w') as f:
+                json.dump({'length': length}, f)
+        self.length = length
+        self.dates = np.load(join(path, 'dates.npy')) if exists(join(path, 'dates.npy')) else None
+
+        self.alpha_ids = []
+        if exists(join(path, 'alpha_ids.txt')):
+            with open(join(path, 'alpha_ids.txt')) as f:
+                self.alpha_ids = [line.strip() for line in f if line.strip()]
+        self._rows = {alpha_id: row for row, alpha_id in enumerate(self.alpha_ids)}
+        self._matrix = None
+        self._standardized = None
+        self._capacity = 0
+        backfill = not exists(join(path, 'pnl_std.f32'))
+        self._open(max(len(self.alpha_ids), 1024))
+        if backfill and self.alpha_ids:
+            # 旧版本的存储没有标准化矩阵，补算一次
+            for start in range(0, len(self.alpha_ids), CHUNK_ROWS):
+                end = min(start + CHUNK_ROWS, len(self.alpha_ids))
+                self._standardized[start:end] = _standardize(self._matrix[start:end])
+            self._standardized.flush()
+
+    def _map(self, name: str, capacity: int) -> np.memmap:
+        """按容量映射（必要时扩大）一个矩阵文件"""
+        matrix_path = join(self.path, name)
+        size = capacity * self.length * 4
+        with open(matrix_path, 'ab') as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(matrix_path, dtype=np.float32, mode='r+', shape=(capacity, self.length))
+
+    def _open(self, capacity: int):
+        """按容量打开（必要时扩大）内存映射矩阵，调用方持有锁"""
+        if self._matrix is not None:
+            self._matrix.flush()
+            self._standardized.flush()
+        # 新的映射建好后一次替换，旧映射在仍被引用时保持有效
+        self._matrix = self._map('pnl.f32', capacity)
+        self._standardized = self._map('pnl_std.f32', capacity)
+        self._capacity = capacity
+
+    def __len__(self):
+        return len(self.alpha_ids)
+
+    def __contains__(self, alpha_id: str) -> bool:
+        return alpha_id in self._rows
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """已写入的 alpha数 × 交易日数 矩阵"""
+        with self._lock:
+            return self._matrix[:len(self.alpha_ids)]
+
+    def _align(self, dates: np.ndarray, pnl: np.ndarray) -> np.ndarray:
+        """按存储的日历对齐，PnL包含日历之后的日期时先把日历向前滚动"""
+        with self._lock:
+            if self.dates is None:
+                calendar = dates[-self.length:]
+                if len(calendar) < self.length:
+                    # 历史不足时日历向前补空
+                    pad = np.arange(self.length - len(calendar), 0, -1)
+                    calendar = np.concatenate([calendar[0] - pad.astype('timedelta64[D]'),
+                                               calendar])
+                np.save(join(self.path, 'dates.npy'), calendar)
+                # 完整的日历建好后再赋值，其他线程不会读到一半
+                self.dates = calendar
+            elif len(dates) and dates[-1] > self.dates[-1]:
+                self._roll(dates[dates > self.dates[-1]])
+            calendar = self.dates
+        row = np.full(self.length, np.nan, dtype=np.float32)
+        columns = np.searchsorted(calendar, dates)
+        inside = (columns < self.length) & (calendar[np.minimum(columns, self.length - 1)] == dates)
+        row[columns[inside]] = pnl[inside]
+        return row
+
+    def _roll(self, newer: np.ndarray):
+        """
+        把日历向前滚动到包含 newer 中的日期，已存储的行左移，新日期记为NaN（调用方持有锁）
+
+        每个新交易日最多发生一次，按块改写矩阵，内存占用与存储数量无关
+        """
+        shift = min(len(newer), self.length)
+        calendar = np.concatenate([self.dates, newer])[-self.length:]
+        for start in range(0, len(self.alpha_ids), CHUNK_ROWS):
+            end = min(start + CHUNK_ROWS, len(self.alpha_ids))
+            chunk = np.full((end - start, self.length), np.nan, dtype=np.float32)
+            chunk[:, :self.length - shift] = self._matrix[start:end, shift:]
+            self._matrix[start:end] = chunk
+            self._standardized[start:end] = _standardize(chunk)
+        self._matrix.flush()
+        self._standardized.flush()
+        np.save(join(self.path, 'dates.npy'), calendar)
+        self.dates = calendar
+        logging.info(f"PnL calendar rolled forward {shift} days to {calendar[-1]}")
+
+    def get(self, alpha_id: str) -> Optional[np.ndarray]:
+        """读取已存储的PnL"""
+        with self._lock:
+            row = self._rows.get(alpha_id)
+            return None if row is None else np.array(self._matrix[row])
+
+    def add(self, alpha_id: str, dates: np.ndarray, pnl: np.ndarray):
+        """
+        写入一个alpha的每日PnL（已存在时覆盖）
+
+        Args:
+            alpha_id: Alpha ID
+            dates: 日期数组
+            pnl: 每日PnL变化
+        """
+        with self._lock:
+            row = self._align(np.asarray(dates, dtype='datetime64[D]'), np.asarray(pnl))
+            index = self._rows.get(alpha_id)
+            if index is not None:
+                self._write_row(index, row)
+                return
+            index = len(self.alpha_ids)
+            if index >= self._capacity:
+                self._open(self._capacity * 2)
+            # 先写矩阵再追加ID，中途退出时多出的行会被下一次写入覆盖
+            self._write_row(index, row)
+            with open(join(self.path, 'alpha_ids.txt'), 'a') as f:
+                f.write(alpha_id + '\n')
+            self.alpha_ids.append(alpha_id)
+            self._rows[alpha_id] = index
+
+    def _write_row(self, index: int, row: np.ndarray):
+        self._matrix[index] = row
+        self._standardized[index] = _standardize(row[None])[0]
+        self._matrix.flush()
+        self._standardized.flush()
+
+    def fetch(self, session, alpha_id: str) -> np.ndarray:
+        """获取并存储alpha的PnL（已存储时直接返回）"""
+        if alpha_id not in self._rows:
+            self.add(alpha_id, *fetch_alpha_pnl(session, alpha_id))
+        return self.get(alpha_id)
+
+    def sync(self, session, alpha_ids: Optional[Iterable[str]] = None) -> int:
+        """
+        为尚未存储的alpha下载PnL
+
+        Args:
+            session: Brain会话对象
+            alpha_ids: Alpha ID列表，默认为 SimulationDB 中所有模拟成功的alpha
+
+        Returns:
+            int: 新存储的数量
+        """
+        if alpha_ids is None:
+            from .brainSimulationRecord import db
+            alpha_ids = db.iter_alpha_ids('success')
+        added = 0
+        for alpha_id in alpha_ids:
+            if alpha_id in self._rows:
+                continue
+            try:
+                self.fetch(session, alpha_id)
+                added += 1
+            except Exception as e:
+                logging.error(f"PnL sync failed for {alpha_id}: {str(e)}")
+        logging.info(f"PnL store synced {added} alphas, {len(self)} stored")
+        return added
+
+    def max_correlation(self, candidates: np.ndarray, exclude: Optional[List[Optional[str]]] = None
+                        ) -> Tuple[np.ndarray, List[Optional[str]]]:
+        """
+        批量计算候选与全部已存储alpha的最大相关性
+
+        候选按行标准化（缺失值在去均值后记为0）后与已标准化的存储矩阵分块做矩阵乘法，
+        内存占用与存储数量无关
+
+        Args:
+            candidates: 候选数 × 交易日数 的PnL矩阵（已按日历对齐）
+            exclude: 与候选一一对应的alpha_id，计算时排除自身
+
+        Returns:
+            tuple: (每个候选的最大相关性, 对应的alpha_id)，存储为空时为 -1 和 None
+        """
+        candidates = _standardize(np.atleast_2d(np.asarray(candidates, dtype=np.float32)))
+        best = np.full(len(candidates), -1.0)
+        best_row = np.full(len(candidates), -1)
+        with self._lock:
+            exclude_rows = np.array([self._rows.get(alpha_id, -1) if alpha_id else -1
+                                     for alpha_id in (exclude or [None] * len(candidates))])
+            matrix = self._standardized[:len(self.alpha_ids)]
+            for start in range(0, len(matrix), CHUNK_ROWS):
+                chunk = np.asarray(matrix[start:start + CHUNK_ROWS])
+                corr = chunk @ candidates.T
+                rows = np.arange(start, start + len(chunk))
+                corr[rows[:, None] == exclude_rows[None, :]] = -np.inf
+                arg = corr.argmax(axis=0)
+                value = corr[arg, np.arange(len(candidates))]
+                better = value > best
+                best[better] = value[better]
+                best_row[better] = rows[arg[better]]
+            ids = [self.alpha_ids[row] if row >= 0 else None for row in best_row]
+        return best, ids
+
+    def max_correlation_for(self, session,
+                            alpha_ids: List[str]) -> Dict[str, Tuple[float, Optional[str]]]:
+        """
+        计算若干alpha与已存储alpha的最大相关性（排除自身）
+
+        Args:
+            session: Brain会话对象（候选PnL不在存储中时下载，不写入存储）
+            alpha_ids: 候选Alpha ID列表
+
+        Returns:
+            dict: alpha_id -> (最大相关性, 最相关的alpha_id)
+        """
+        if not alpha_ids:
+            return {}
+        fetched = {alpha_id: fetch_alpha_pnl(session, alpha_id)
+                   for alpha_id in alpha_ids if alpha_id not in self}
+        # 对齐和计算期间日历不会滚动
+        with self._lock:
+            rows = [self._align(*fetched[alpha_id]) if alpha_id in fetched else self.get(alpha_id)
+                    for alpha_id in alpha_ids]
+            best, ids = self.max_correlation(np.vstack(rows), exclude=list(alpha_ids))
+        return {alpha_id: (float(value), other)
+                for alpha_id, value, other in zip(alpha_ids, best, ids)}
+
+    def rank_candidates(self, session, alpha_ids: List[str]) -> List[Tuple[str, float]]:
+        """
+        按与已存储alpha的最大相关性从低到高排序候选
+
+        Returns:
+            list: (alpha_id, 最大相关性)
+        """
+        result = self.max_correlation_for(session, alpha_ids)
+        return sorted(((alpha_id, value) for alpha_id, (value, _) in result.items()),
+                      key=lambda item: item[1])
+
+def _standardize(matrix: np.ndarray) -> np.ndarray:
+    """按行去均值并缩放为单位范数，缺失值记为0"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    valid = ~np.isnan(matrix)
+    counts = np.maximum(valid.sum(axis=1, keepdims=True), 1)
+    means = np.where(valid, matrix, 0).sum(axis=1, keepdims=True) / counts
+    centered = np.where(valid, matrix - means, 0)
+    norms = np.linalg.norm(centered, axis=1, keepdims=True)
+    return np.divide(centered, norms, out=np.zeros_like(centered), where=norms > 0)
+
+_store = None
+_store_lock = Lock()
+
+def get_pnl_store() -> PnLStore:
+    """获取默认路径下的全局PnL存储"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = PnLStore()
+        return _store
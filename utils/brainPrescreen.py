@@ -0,0 +1,391 @@
+"""
+WorldQuant Brain 本地预筛选工具
+在本地面板数据上用NumPy粗略回测FASTEXPR表达式，提交模拟前过滤或排序候选
+"""
+import logging
+from collections import OrderedDict
+from itertools import islice
+from os.path import exists, join
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .brainExpressionParser import (BinOp, Call, ExpressionSyntaxError, Name, Number,
+                                    UnaryOp, parse_expression)
+from .brainSimulationConfig import normalize_expression
+
+# 年化使用的交易日数
+TRADING_DAYS = 252
+
+# 收益面板的文件名（不含扩展名）
+RETURNS_PANEL = 'returns'
+
+class UnsupportedExpression(ValueError):
+    """表达式超出本地回测支持的子集"""
+
+
+class PanelStore:
+    def __init__(self, path: str):
+        """
+        本地面板数据目录
+
+        每个数据字段一个文件 {字段名}.npy（日期 × 股票，按内存映射读取）或
+        {字段名}.parquet（行为日期、列为股票）。所有面板的日期和股票顺序必须一致。
+        分组字段（如 subindustry.npy）为整数编码，可以是一维（每只股票一个分组）。
+        {returns}.npy 为每日收益，第 t 行是第 t 天的收益
+
+        Args:
+            path: 面板文件目录
+        """
+        self.path = path
+        self._panels = {}
+
+    def has(self, name: str) -> bool:
+        """是否有该字段的面板"""
+        return name in self._panels or any(
+            exists(join(self.path, f"{name}{ext}")) for ext in ('.npy', '.parquet'))
+
+    def get(self, name: str) -> np.ndarray:
+        """读取一个面板（.npy 使用内存映射，不会整体载入内存）"""
+        panel = self._panels.get(name)
+        if panel is None:
+            npy = join(self.path, f"{name}.npy")
+            if exists(npy):
+                panel = np.load(npy, mmap_mode='r')
+            elif exists(join(self.path, f"{name}.parquet")):
+                import pandas as pd
+                panel = pd.read_parquet(join(self.path, f"{name}.parquet")).to_numpy(dtype=float)
+            else:
+                raise UnsupportedExpression(f"No local panel for {name!r}")
+            self._panels[name] = panel
+        return panel
+
+    @property
+    def returns(self) -> np.ndarray:
+        return self.get(RETURNS_PANEL)
+
+    def group(self, name: str) -> np.ndarray:
+        """读取分组面板，广播为 日期 × 股票 的整数数组，缺失分组为 -1"""
+        groups = np.asarray(self.get(name))
+        if groups.ndim == 1:
+            groups = np.broadcast_to(groups, self.returns.shape)
+        if groups.dtype.kind == 'f':
+            groups = np.where(np.isnan(groups), -1, groups).astype(np.int64)
+        return groups
+
+
+def _group_rank(x: np.ndarray, groups: Optional[np.ndarray] = None) -> np.ndarray:
+    """按行（每个日期）在分组内排名，结果在 [0, 1]，不分组时为截面排名"""
+    rows, cols = x.shape
+    valid = ~np.isnan(x)
+    if groups is not None:
+        valid &= groups >= 0
+    flat = np.flatnonzero(valid)
+    out = np.full(x.shape, np.nan)
+    if not len(flat):
+        return out
+    row = flat // cols
+    group = groups.ravel()[flat] if groups is not None else np.zeros(len(flat), dtype=np.int64)
+    order = np.lexsort((x.ravel()[flat], group, row))
+    row, group = row[order], group[order]
+    # 每个(日期, 分组)是一段，段内位置即排名
+    starts = np.flatnonzero(np.r_[True, (row[1:] != row[:-1]) | (group[1:] != group[:-1])])
+    counts = np.diff(np.r_[starts, len(order)])
+    segment = np.repeat(np.arange(len(starts)), counts)
+    position = np.arange(len(order)) - starts[segment]
+    size = counts[segment]
+    out.ravel()[flat[order]] = np.where(size > 1, position / np.maximum(size - 1, 1), 0.5)
+    return out
+
+def _group_neutralize(x: np.ndarray, groups: np.ndarray) -> np.ndarray:
+    """减去每个日期内分组的均值"""
+    rows, cols = x.shape
+    valid = ~np.isnan(x) & (groups >= 0)
+    num_groups = int(groups.max()) + 1 if groups.size else 1
+    key = (np.arange(rows)[:, None] * num_groups + np.where(valid, groups, 0)).ravel()
+    weights = valid.ravel().astype(float)
+    sums = np.bincount(key, np.where(valid, x, 0).ravel(), rows * num_groups)
+    counts = np.bincount(key, weights, rows * num_groups)
+    means = sums / np.maximum(counts, 1)
+    return np.where(valid, x - means[key].reshape(rows, cols), np.nan)
+
+def _shift(x: np.ndarray, days: int) -> np.ndarray:
+    out = np.full(x.shape, np.nan)
+    if days < len(x):
+        out[days:] = x[:len(x) - days]
+    return out
+
+def _ts_mean(x: np.ndarray, days: int) -> np.ndarray:
+    """滚动均值（忽略缺失值，窗口未满时为NaN）"""
+    valid = ~np.isnan(x)
+    sums = np.cumsum(np.where(valid, x, 0), axis=0)
+    counts = np.cumsum(valid, axis=0)
+    sums[days:] = sums[days:] - sums[:-days]
+    counts[days:] = counts[days:] - counts[:-days]
+    out = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+    out[:days - 1] = np.nan
+    return out
+
+def _ts_rank(x: np.ndarray, days: int) -> np.ndarray:
+    """当天的值在过去 days 天中的排名，结果在 [0, 1]"""
+    below = np.zeros(x.shape)
+    count = np.zeros(x.shape)
+    for lag in range(1, days):
+        past = _shift(x, lag)
+        valid = ~np.isnan(past)
+        below += valid & (past < x)
+        count += valid
+    out = np.where(count > 0, below / np.maximum(count, 1), np.nan)
+    out[np.isnan(x)] = np.nan
+    out[:days - 1] = np.nan
+    return out
+
+
+class PrescreenEngine:
+    def __init__(self, store: PanelStore, cache_bytes: int = 512 * 1024 ** 2):
+        """
+        本地预筛选引擎
+
+        支持 rank、group_rank、ts_mean、ts_delta、ts_delay、ts_rank、group_neutralize、
+        abs、sign、log 以及四则运算和 ^。每个运算对整个 日期 × 股票 面板一次完成，
+        子表达式按语法树缓存，多个表达式共享相同的部分只计算一次
+
+        Args:
+            store: 面板数据目录
+            cache_bytes: 子表达式缓存的内存上限(字节)
+        """
+        self.store = store
+        self.cache_bytes = cache_bytes
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, node, value: np.ndarray):
+        if value.nbytes > self.cache_bytes:
+            return
+        self._cache[node] = value
+        self._cached_bytes += value.nbytes
+        while self._cached_bytes > self.cache_bytes:
+            _, old = self._cache.popitem(last=False)
+            self._cached_bytes -= old.nbytes
+
+    def evaluate(self, expression: str) -> np.ndarray:
+        """
+        计算表达式的 日期 × 股票 面板
+
+        Raises:
+            UnsupportedExpression: 表达式包含不支持的运算符、多语句或缺少本地面板
+        """
+        try:
+            program = parse_expression(normalize_expression(expression))
+        except ExpressionSyntaxError as e:
+            raise UnsupportedExpression(str(e))
+        if len(program.statements) != 1:
+            raise UnsupportedExpression("Multi-statement expressions are not supported")
+        return self._eval(program.statements[0])
+
+    def _eval(self, node):
+        if isinstance(node, Number):
+            # 常数也按numpy计算，1/0 等得到 nan 而不是抛出 ZeroDivisionError
+            return np.float64(node.value)
+        cached = self._cache.get(node)
+        if cached is not None:
+            self._cache.move_to_end(node)
+            self.hits += 1
+            return cached
+        self.misses += 1
+        value = self._compute(node)
+        if isinstance(value, np.ndarray):
+            self._remember(node, value)
+        return value
+
+    def _panel(self, node) -> np.ndarray:
+        value = self._eval(node)
+        if not isinstance(value, np.ndarray):
+            return np.full(self.store.returns.shape, float(value))
+        return value
+
+    def _days(self, node) -> int:
+        if not isinstance(node, Number) or node.value < 1:
+            raise UnsupportedExpression("Lookback must be a positive number")
+        return int(node.value)
+
+    def _group(self, node) -> np.ndarray:
+        if not isinstance(node, Name):
+            raise UnsupportedExpression("Group argument must be a group field")
+        return self.store.group(node.id)
+
+    def _compute(self, node):
+        if isinstance(node, Name):
+            return np.asarray(self.store.get(node.id), dtype=float)
+        if isinstance(node, UnaryOp) and node.op in '-+':
+            value = self._eval(node.operand)
+            return -value if node.op == '-' else value
+        if isinstance(node, BinOp) and node.op in ('+', '-', '*', '/', '^'):
+            left, right = self._eval(node.left), self._eval(node.right)
+            with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                if node.op == '+':
+                    value = left + right
+                elif node.op == '-':
+                    value = left - right
+                elif node.op == '*':
+                    value = left * right
+                elif node.op == '/':
+                    value = left / right
+                else:
+                    value = np.power(left, right)
+            if isinstance(value, np.ndarray):
+                value[np.isinf(value)] = np.nan
+            elif np.isinf(value):
+                value = np.float64(np.nan)
+            return value
+        if isinstance(node, Call):
+            return self._call(node)
+        raise UnsupportedExpression(f"Unsupported syntax {type(node).__name__}")
+
+    def _call(self, node: Call):
+        func, args = node.func, node.args
+        if node.kwargs:
+            raise UnsupportedExpression(f"Keyword arguments of {func} are not supported")
+        if func in ('rank', 'abs', 'sign', 'log') and len(args) == 1:
+            x = self._panel(args[0])
+            if func == 'rank':
+                return _group_rank(x)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                value = {'abs': np.abs, 'sign': np.sign, 'log': np.log}[func](x)
+            value[np.isinf(value)] = np.nan
+            return value
+        if func in ('group_rank', 'group_neutralize') and len(args) == 2:
+            x, groups = self._panel(args[0]), self._group(args[1])
+            return _group_rank(x, groups) if func == 'group_rank' else _group_neutralize(x, groups)
+        if func in ('ts_mean', 'ts_delta', 'ts_delay', 'ts_rank') and len(args) == 2:
+            x, days = self._panel(args[0]), self._days(args[1])
+            if func == 'ts_mean':
+                return _ts_mean(x, days)
+            if func == 'ts_delta':
+                return x - _shift(x, days)
+            if func == 'ts_delay':
+                return _shift(x, days)
+            return _ts_rank(x, days)
+        raise UnsupportedExpression(f"Operator {func} with {len(args)} arguments is not supported")
+
+    def weights(self, expression: str, neutralization: str = 'MARKET') -> np.ndarray:
+        """
+        表达式对应的每日持仓权重（中性化后每天绝对值之和为1）
+
+        Args:
+            expression: Alpha表达式
+            neutralization: 中性化方式，对应同名分组面板（如 SUBINDUSTRY -> subindustry），
+                            NONE 表示不中性化，找不到分组面板时按 MARKET 处理
+        """
+        value = self.evaluate(expression)
+        # 复制一份，避免改动缓存中的面板
+        alpha = np.array(np.broadcast_to(value, self.store.returns.shape), dtype=float)
+        group_name = (neutralization or 'NONE').lower()
+        if group_name not in ('none', 'market') and self.store.has(group_name):
+            alpha = _group_neutralize(alpha, self.store.group(group_name))
+        elif group_name != 'none':
+            alpha = alpha - np.nanmean(alpha, axis=1, keepdims=True)
+        gross = np.nansum(np.abs(alpha), axis=1, keepdims=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(gross > 0, alpha / gross, np.nan)
+
+    def score(self, expression: str, settings: Optional[Dict] = None) -> Dict:
+        """
+        粗略回测一个表达式
+
+        第 t 天的权重用第 t+1 天的收益计算PnL（对应 delay=1）
+
+        Args:
+            expression: Alpha表达式
+            settings: 模拟设置（使用其中的 neutralization）
+
+        Returns:
+            dict: sharpe、returns(年化)、turnover(日均)、fitness、coverage(有权重的股票比例)
+
+        Raises:
+            UnsupportedExpression: 表达式超出支持的子集
+        """
+        neutralization = (settings or {}).get('neutralization', 'MARKET')
+        weights = self.weights(expression, neutralization)
+        returns = np.asarray(self.store.returns, dtype=float)
+
+        held = np.nan_to_num(weights)
+        pnl = np.nansum(held[:-1] * returns[1:], axis=1)
+        active = ~np.isnan(weights).all(axis=1)
+        pnl = pnl[active[:-1]]
+        if len(pnl) < 2 or not pnl.std():
+            return {'sharpe': 0.0, 'returns': 0.0, 'turnover': 0.0, 'fitness': 0.0,
+                    'coverage': 0.0}
+
+        sharpe = pnl.mean() / pnl.std() * np.sqrt(TRADING_DAYS)
+        annual_returns = pnl.mean() * TRADING_DAYS
+        turnover = np.abs(np.diff(held, axis=0)).sum(axis=1)[active[1:]].mean()
+        universe = ~np.isnan(returns)
+        coverage = (~np.isnan(weights) & universe).sum() / max(universe.sum(), 1)
+        fitness = sharpe * np.sqrt(abs(annual_returns) / max(turnover, 0.125))
+        return {'sharpe': float(sharpe), 'returns': float(annual_returns),
+                'turnover': float(turnover), 'fitness': float(fitness),
+                'coverage': float(coverage)}
+
+    def score_alphas(self, alphas: Iterable[Dict],
+                     batch_size: int = 256) -> Iterator[Tuple[Dict, Optional[Dict]]]:
+        """
+        批量回测
+
+        每批按表达式排序后再计算，相同或相近的表达式相邻，子表达式缓存命中率更高
+
+        Args:
+            alphas: Alpha配置的列表或迭代器
+            batch_size: 每批数量
+
+        Yields:
+            tuple: (Alpha配置, 回测指标)，不支持的表达式指标为None
+        """
+        alphas = iter(alphas)
+        while True:
+            batch = list(islice(alphas, batch_size))
+            if not batch:
+                return
+            for alpha in sorted(batch, key=lambda a: normalize_expression(a['regular'])):
+                try:
+                    yield alpha, self.score(alpha['regular'], alpha.get('settings'))
+                except (UnsupportedExpression, ArithmeticError) as e:
+                    logging.debug(f"Prescreen skipped {alpha['regular']}: {str(e)}")
+                    yield alpha, None
+
+def prescreen_alphas(alphas: Iterable[Dict], panel_path: str, metric: str = 'sharpe',
+                     min_score: Optional[float] = None, top: Optional[int] = None,
+                     keep_unsupported: bool = True, set_priority: bool = False) -> List[Dict]:
+    """
+    用本地回测过滤并排序候选，结果可直接传给 run_alpha_simulation
+
+    Args:
+        alphas: Alpha配置的列表或迭代器
+        panel_path: 面板文件目录
+        metric: 排序使用的指标（sharpe、fitness、returns...）
+        min_score: 指标低于该值的候选被丢弃
+        top: 只保留得分最高的前 top 个
+        keep_unsupported: 无法本地回测的候选是否保留（排在最后）
+        set_priority: 是否把得分写入 alpha['priority']，模拟队列按其排序
+                      （无法回测的候选不设置，保持默认优先级）
+
+    Returns:
+        list: 按得分从高到低排列的Alpha配置
+    """
+    engine = PrescreenEngine(PanelStore(panel_path))
+    scored, unsupported = [], []
+    for alpha, stats in engine.score_alphas(alphas):
+        if stats is None:
+            if keep_unsupported:
+                unsupported.append(alpha)
+        elif min_score is None or stats[metric] >= min_score:
+            if set_priority:
+                alpha['priority'] = stats[metric]
+            scored.append((stats[metric], alpha))
+    scored.sort(key=lambda item: item[0], reverse=True)
+    result = [alpha for _, alpha in scored] + unsupported
+    logging.info(f"Prescreen kept {len(scored)} scored and {len(unsupported)} unscored alphas "
+                 f"(cache hits {engine.hits}, misses {engine.misses})")
+    return result[:top] if top else result
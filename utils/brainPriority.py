@@ -0,0 +1,257 @@
+"""
+WorldQuant Brain 模拟任务优先级
+按优先级安排模拟顺序，同时为每个活动(campaign)保留一部分名额，
+避免大批量的低价值组合长时间挡住后加入的高价值表达式
+
+优先级来源：
+- 手动：alpha['priority']（越大越先模拟），alpha['campaign'] 指定所属活动
+- 本地预筛：prescreen_alphas(..., set_priority=True) 把预筛得分写入 priority
+- 数据集历史命中率：hit_rate_priorities 按表达式引用的数据集在库中的历史成功率打分
+"""
+import logging
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .brainExpressionValidator import referenced_fields
+
+# 每次领取中按活动轮流分配的名额比例，其余名额按全局优先级分配
+DEFAULT_FAIR_SHARE = 0.25
+
+# 内存中排序的窗口大小
+DEFAULT_WINDOW = 10000
+
+# 视为命中的IS sharpe下限
+DEFAULT_HIT_SHARPE = 1.25
+
+# 命中率平滑：数据集的历史命中率向整体命中率收缩，相当于先验的模拟次数
+HIT_RATE_PRIOR_WEIGHT = 20
+
+# 只在本地使用的字段，提交模拟时去掉
+LOCAL_KEYS = ('priority', 'campaign', 'datasets')
+
+def get_priority(alpha: Dict) -> float:
+    """alpha的优先级，未设置时为0"""
+    return float(alpha.get('priority') or 0)
+
+def fair_select(candidates: List[Dict], limit: int,
+                fair_share: float = DEFAULT_FAIR_SHARE) -> List[Dict]:
+    """
+    从候选中选出最多 limit 个
+
+    先把 limit * fair_share 个名额按活动轮流分配（每个活动取自己优先级最高的），
+    剩余名额按全局优先级分配。优先级相同时保持候选的原有顺序
+
+    Args:
+        candidates: 候选（含 priority、campaign）
+        limit: 最多选出的数量
+        fair_share: 轮流分配的名额比例，0 表示只按优先级
+
+    Returns:
+        list: 选中的候选，按优先级从高到低
+    """
+    ordered = sorted(candidates, key=lambda c: -get_priority(c))
+    if len(ordered) <= limit:
+        return ordered
+
+    # 活动按各自最高优先级排列
+    queues = OrderedDict()
+    for candidate in ordered:
+        queues.setdefault(candidate.get('campaign'), deque()).append(candidate)
+    reserved = int(limit * fair_share)
+    picked, picked_ids = [], set()
+    while len(picked) < reserved and queues:
+        for campaign in list(queues):
+            if len(picked) >= reserved:
+                break
+            queue = queues[campaign]
+            candidate = queue.popleft()
+            picked.append(candidate)
+            picked_ids.add(id(candidate))
+            if not queue:
+                del queues[campaign]
+    for candidate in ordered:
+        if len(picked) >= limit:
+            break
+        if id(candidate) not in picked_ids:
+            picked.append(candidate)
+    picked.sort(key=lambda c: -get_priority(c))
+    return picked
+
+
+class PriorityScheduler:
+    def __init__(self, fair_share: float = DEFAULT_FAIR_SHARE, window: int = DEFAULT_WINDOW,
+                 step: int = 100):
+        """
+        内存中的优先级调度
+
+        每次读入 window 个alpha，按 step 个一组用 fair_select 依次选出，
+        输入不超过 window 个时即为全局顺序，超过时只在窗口内排序（内存有界）
+
+        Args:
+            fair_share: 每组中按活动轮流分配的名额比例
+            window: 一次排序的alpha数量
+            step: 每组数量（与领取数量相当）
+        """
+        self.fair_share = fair_share
+        self.window = window
+        self.step = step
+
+    def order(self, alphas: Iterable[Dict]) -> Iterator[Dict]:
+        """
+        按优先级和公平份额排列alpha
+
+        Args:
+            alphas: Alpha配置的列表或迭代器
+
+        Yields:
+            dict: Alpha配置
+        """
+        alphas = iter(alphas)
+        while True:
+            remaining = list(islice(alphas, self.window))
+            if not remaining:
+                return
+            if not any('priority' in alpha for alpha in remaining):
+                # 没有设置优先级时保持原顺序
+                yield from remaining
+                continue
+            while remaining:
+                selected = fair_select(remaining, self.step, self.fair_share)
+                yield from selected
+                selected_ids = {id(alpha) for alpha in selected}
+                remaining = [alpha for alpha in remaining if id(alpha) not in selected_ids]
+
+
+class DatasetIndex:
+    def __init__(self):
+        """
+        按本地数据字段目录把表达式映射到其引用的数据集
+
+        每个搜索范围只读取一次目录
+        """
+        self._maps = {}
+
+    def _field_map(self, scope: Tuple) -> Dict[str, str]:
+        field_map = self._maps.get(scope)
+        if field_map is None:
+            from .brainDataFieldsCatalog import get_catalog
+            instrument_type, region, delay, universe = scope
+            field_map = self._maps[scope] = get_catalog().field_datasets({
+                'instrumentType': instrument_type, 'region': region,
+                'delay': delay, 'universe': universe
+            })
+            if not field_map:
+                logging.info(f"No cached datafields for {scope}, datasets unknown")
+        return field_map
+
+    def datasets(self, alpha: Dict) -> List[str]:
+        """alpha引用的数据集ID（排序后），目录中没有的字段被忽略"""
+        settings = alpha['settings']
+        field_map = self._field_map((settings.get('instrumentType'), settings.get('region'),
+                                     settings.get('delay'), settings.get('universe')))
+        return sorted({field_map[name] for name in referenced_fields(alpha['regular'])
+                       if name in field_map})
+
+def dataset_hit_rates(min_sharpe: float = DEFAULT_HIT_SHARPE,
+                      prior_weight: float = HIT_RATE_PRIOR_WEIGHT,
+                      tag: bool = True) -> Tuple[Dict[str, float], float]:
+    """
+    各数据集的历史命中率（IS sharpe 不低于 min_sharpe 的比例）
+
+    按 (命中数 + prior_weight * 整体命中率) / (模拟数 + prior_weight) 平滑，
+    模拟次数少的数据集接近整体命中率
+
+    Args:
+        min_sharpe: 视为命中的sharpe下限
+        prior_weight: 平滑强度
+        tag: 是否先为已完成但没有 datasets 字段的记录补充数据集
+
+    Returns:
+        tuple: (数据集ID到命中率的映射, 整体命中率)
+    """
+    from .brainSimulationRecord import db
+    if tag:
+        tag_datasets()
+    counts, (hits, total) = db.dataset_hit_counts(min_sharpe)
+    base = hits / total if total else 0.0
+    rates = {dataset: (dataset_hits + prior_weight * base) / (dataset_total + prior_weight)
+             for dataset, (dataset_hits, dataset_total) in counts.items()}
+    return rates, base
+
+def hit_rate_priorities(alphas: Iterable[Dict], rates: Optional[Dict[str, float]] = None,
+                        base: Optional[float] = None, index: Optional[DatasetIndex] = None,
+                        overwrite: bool = False) -> Iterator[Dict]:
+    """
+    按数据集历史命中率设置优先级
+
+    alpha的优先级为其引用的数据集中最高的命中率，没有历史的数据集按整体命中率，
+    同时记录 datasets 字段。已有优先级（手动或预筛）的alpha默认保持不变
+
+    Args:
+        alphas: Alpha配置的列表或迭代器
+        rates: 数据集命中率，默认由 dataset_hit_rates 计算
+        base: 整体命中率
+        index: 数据集映射，默认新建
+        overwrite: 是否覆盖已经设置的优先级
+
+    Yields:
+        dict: Alpha配置
+    """
+    if rates is None:
+        rates, base = dataset_hit_rates()
+    base = base or 0.0
+    index = index or DatasetIndex()
+    for alpha in alphas:
+        if overwrite or 'priority' not in alpha:
+            datasets = index.datasets(alpha)
+            alpha['datasets'] = datasets
+            alpha['priority'] = max((rates.get(dataset, base) for dataset in datasets),
+                                    default=base)
+        yield alpha
+
+def tag_datasets(batch_size: int = 1000, index: Optional[DatasetIndex] = None) -> int:
+    """
+    为库中已完成但没有 datasets 字段的记录补充数据集（用于统计命中率）
+
+    Returns:
+        int: 补充的记录数
+    """
+    from .brainSimulationRecord import db
+    index = index or DatasetIndex()
+    tagged = 0
+    docs = db.iter_untagged_alphas()
+    while True:
+        batch = list(islice(docs, batch_size))
+        if not batch:
+            break
+        tagged += db.set_alpha_datasets({doc['_id']: index.datasets(doc) for doc in batch})
+    if tagged:
+        logging.info(f"Tagged datasets for {tagged} alphas")
+    return tagged
+
+def reprioritize_pending(min_sharpe: float = DEFAULT_HIT_SHARPE, batch_size: int = 1000) -> int:
+    """
+    按最新的数据集命中率重新计算队列中等待模拟的记录的优先级
+
+    只更新优先级来自命中率或未设置的记录，手动或预筛设置的优先级保持不变
+
+    Args:
+        min_sharpe: 视为命中的sharpe下限
+        batch_size: 每次写入的数量
+
+    Returns:
+        int: 更新的记录数
+    """
+    from .brainSimulationRecord import db
+    rates, base = dataset_hit_rates(min_sharpe)
+    alphas = hit_rate_priorities(db.iter_reprioritizable_alphas(), rates, base, overwrite=True)
+    updated = 0
+    while True:
+        batch = list(islice(alphas, batch_size))
+        if not batch:
+            break
+        updated += db.set_priorities({alpha['sim_hash']: alpha['priority'] for alpha in batch},
+                                     {alpha['sim_hash']: alpha['datasets'] for alpha in batch})
+    logging.info(f"Reprioritized {updated} queued alphas (base hit rate {base:.3f})")
+    return updated
@@ -0,0 +1,167 @@
+"""
+WorldQuant Brain 自适应并发限制
+使用AIMD（加性增、乘性减）根据响应情况调整并发窗口
+"""
+import asyncio
+import logging
+from collections import deque
+from threading import Condition
+from time import monotonic
+from typing import Dict, Optional
+
+# 表示达到账户并发/频率上限的响应内容
+LIMIT_MARKERS = ('CONCURRENT_SIMULATION_LIMIT', 'SIMULATION_LIMIT_EXCEEDED', 'rate limit')
+
+class RateLimitError(Exception):
+    """请求被限流（429或并发模拟上限）"""
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def is_throttled(response) -> bool:
+    """
+    判断响应是否表示限流
+
+    Args:
+        response: HTTP响应
+
+    Returns:
+        bool: 是否为429或并发上限错误
+    """
+    if response.status_code == 429:
+        return True
+    if response.status_code < 400:
+        return False
+    text = response.text or ''
+    return any(marker.lower() in text.lower() for marker in LIMIT_MARKERS)
+
+def parse_retry_after(response, default: Optional[float] = None) -> Optional[float]:
+    """
+    解析Retry-After响应头
+
+    Args:
+        response: HTTP响应
+        default: 响应头缺失或无法解析时的返回值
+
+    Returns:
+        float: 建议等待的秒数
+    """
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return default
+
+
+class AdaptiveLimiter:
+    def __init__(self, name: str, initial: float = 3, min_window: float = 1,
+                 max_window: float = 50, decrease_factor: float = 0.5,
+                 decrease_interval: float = 2.0, rate_window: float = 60.0):
+        """
+        AIMD并发限制器
+
+        每个成功的请求让窗口增加 1/window（约每轮增加1），
+        遇到限流时窗口乘以 decrease_factor。同一次拥塞引起的多个429
+        在 decrease_interval 秒内只收缩一次
+
+        Args:
+            name: 名称（用于日志）
+            initial: 初始窗口
+            min_window: 最小窗口
+            max_window: 最大窗口
+            decrease_factor: 限流时的收缩倍数
+            decrease_interval: 两次收缩之间的最小间隔(秒)
+            rate_window: 统计吞吐量的时间窗口(秒)
+        """
+        self.name = name
+        self.window = float(initial)
+        self.min_window = float(min_window)
+        self.max_window = float(max_window)
+        self.decrease_factor = decrease_factor
+        self.decrease_interval = decrease_interval
+        self.rate_window = rate_window
+        self.in_flight = 0
+        self.counts = {'ok': 0, 'throttled': 0, 'error': 0}
+        self._completed = deque()
+        self._last_decrease = 0.0
+        self._cond = Condition()
+
+    @property
+    def limit(self) -> int:
+        """当前允许的在途数量"""
+        return max(int(self.window), int(self.min_window))
+
+    def try_acquire(self) -> bool:
+        """不等待地尝试占用一个名额"""
+        with self._cond:
+            if self.in_flight < self.limit:
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """
+        占用一个名额，窗口已满时阻塞等待
+
+        Args:
+            timeout: 最长等待时间(秒)
+
+        Returns:
+            bool: 是否成功占用
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.in_flight < self.limit, timeout):
+                return False
+            self.in_flight += 1
+            return True
+
+    async def acquire_async(self, poll_interval: float = 0.05):
+        """在事件循环中占用一个名额（等待时不占用线程）"""
+        while not self.try_acquire():
+            await asyncio.sleep(poll_interval)
+
+    def release(self, outcome: str = 'ok'):
+        """
+        释放名额并根据结果调整窗口
+
+        Args:
+            outcome: 'ok'、'throttled' 或 'error'
+        """
+        now = monotonic()
+        with self._cond:
+            self.in_flight -= 1
+            self.counts[outcome] += 1
+            if outcome == 'ok':
+                self.window = min(self.max_window, self.window + 1.0 / self.window)
+                self._completed.append(now)
+            elif outcome == 'throttled' and now - self._last_decrease >= self.decrease_interval:
+                self.window = max(self.min_window, self.window * self.decrease_factor)
+                self._last_decrease = now
+                logging.info(f"Limiter {self.name} throttled, window -> {self.window:.2f}")
+            self._cond.notify_all()
+
+    def throughput(self) -> float:
+        """最近 rate_window 秒内每分钟完成的数量"""
+        cutoff = monotonic() - self.rate_window
+        with self._cond:
+            while self._completed and self._completed[0] < cutoff:
+                self._completed.popleft()
+            return len(self._completed) * 60.0 / self.rate_window
+
+    def stats(self) -> Dict:
+        """当前窗口、在途数量和吞吐量"""
+        return {
+            'name': self.name,
+            'window': round(self.window, 2),
+            'in_flight': self.in_flight,
+            'throughput_per_min': round(self.throughput(), 1),
+            **self.counts
+        }
+
+    def __repr__(self):
+        return f"AdaptiveLimiter({self.stats()})"
+
+# 所有HTTP请求共享的限制器（由get_session返回的会话使用）
+request_limiter = AdaptiveLimiter('requests', initial=10, max_window=64)
@@ -0,0 +1,274 @@
+"""
+WorldQuant Brain 请求重试策略
+把响应分为 永久错误/限流/认证/暂时错误，按带抖动的指数退避（优先使用Retry-After）重试，
+并用熔断器在服务整体故障时暂停派发请求
+"""
+import asyncio
+import logging
+import random
+from threading import Lock
+from time import monotonic, sleep
+from typing import Dict, Iterable, Optional
+
+import requests
+
+from .brainMetrics import CIRCUIT_OPEN, CIRCUIT_TRIPS
+from .brainRateLimiter import RateLimitError, is_throttled, parse_retry_after
+
+# 错误类别
+OK = 'ok'
+PERMANENT = 'permanent'
+THROTTLED = 'throttled'
+AUTH = 'auth'
+TRANSIENT = 'transient'
+
+# 视为暂时错误的状态码（其余4xx为永久错误）
+TRANSIENT_STATUS = {408, 409, 425, 500, 502, 503, 504}
+
+def classify_response(response) -> str:
+    """
+    判断响应的错误类别
+
+    Returns:
+        str: 'ok'、'throttled'(429/并发上限)、'auth'(401/403)、
+             'transient'(5xx、超时等，可以重试)或 'permanent'(其余4xx，重试也不会成功)
+    """
+    status = response.status_code
+    if status < 400:
+        return OK
+    if is_throttled(response):
+        return THROTTLED
+    if status in (401, 403):
+        return AUTH
+    if status in TRANSIENT_STATUS or status >= 500:
+        return TRANSIENT
+    return PERMANENT
+
+def classify_exception(error: Exception) -> str:
+    """判断异常的错误类别（连接错误和未知异常按暂时错误处理）"""
+    if isinstance(error, RateLimitError):
+        return THROTTLED
+    if isinstance(error, ApiError):
+        return error.kind
+    return TRANSIENT
+
+def _response_detail(response) -> str:
+    try:
+        body = response.json()
+    except ValueError:
+        return (response.text or '')[:200]
+    if isinstance(body, dict):
+        return str(body.get('message') or body.get('detail') or body)[:200]
+    return str(body)[:200]
+
+
+class ApiError(Exception):
+    """分类后的接口错误"""
+    def __init__(self, message: str, kind: str = TRANSIENT, status: Optional[int] = None,
+                 retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.kind = kind
+        self.status = status
+        self.retry_after = retry_after
+
+    @classmethod
+    def from_response(cls, response, action: str = 'Request') -> 'ApiError':
+        status = response.status_code
+        kind = classify_response(response)
+        if kind == OK:
+            # 非预期的成功状态码（如应为201却得到200）按暂时错误处理
+            kind = TRANSIENT
+        return cls(f"{action} failed with status {status}: {_response_detail(response)}",
+                   kind, status, parse_retry_after(response))
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = 6, base_delay: float = 2.0, max_delay: float = 120.0,
+                 max_auth_attempts: int = 2, max_throttled_attempts: Optional[int] = None):
+        """
+        重试策略
+
+        - permanent: 不重试
+        - auth: 重新登录后立即重试，最多 max_auth_attempts 次
+        - throttled: 优先按Retry-After等待，不计入 max_attempts
+        - transient: 带完全抖动的指数退避，最多 max_attempts 次
+
+        Args:
+            max_attempts: 暂时错误的最多尝试次数
+            base_delay: 第一次重试的退避上限(秒)，之后每次翻倍
+            max_delay: 退避上限(秒)
+            max_auth_attempts: 认证错误的最多尝试次数
+            max_throttled_attempts: 限流的最多尝试次数，None表示不限
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_auth_attempts = max_auth_attempts
+        self.max_throttled_attempts = max_throttled_attempts
+
+    def should_retry(self, kind: str, attempt: int) -> bool:
+        """
+        是否还应重试
+
+        Args:
+            kind: 错误类别
+            attempt: 该类别已失败的次数
+        """
+        if kind == PERMANENT:
+            return False
+        if kind == AUTH:
+            return attempt < self.max_auth_attempts
+        if kind == THROTTLED:
+            return self.max_throttled_attempts is None or attempt < self.max_throttled_attempts
+        return attempt < self.max_attempts
+
+    def delay(self, kind: str, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        下一次重试前的等待时间(秒)
+
+        服务器给出Retry-After时按其等待（加最多10%的抖动，避免同时醒来），
+        否则在 [0, min(max_delay, base_delay * 2^(attempt-1))] 中均匀取值
+        """
+        if kind == AUTH:
+            return 0.0
+        if retry_after:
+            return retry_after * (1 + random.random() * 0.1)
+        cap = min(self.max_delay, self.base_delay * 2 ** max(attempt - 1, 0))
+        return random.uniform(0, cap)
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 10, recovery_time: float = 30.0,
+                 max_recovery_time: float = 300.0):
+        """
+        熔断器
+
+        连续 failure_threshold 次暂时错误（5xx、连接失败）后断开 recovery_time 秒，
+        期间派发请求的调用方在 wait() 中等待；恢复后第一个结果若仍是暂时错误则
+        立即再次断开，断开时间加倍（不超过 max_recovery_time），成功则复位
+
+        Args:
+            name: 名称（用于日志和指标）
+            failure_threshold: 触发断开的连续暂时错误次数
+            recovery_time: 首次断开的时长(秒)
+            max_recovery_time: 断开时长上限(秒)
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.max_recovery_time = max_recovery_time
+        self.failures = 0
+        self.trips = 0
+        self._open_until = 0.0
+        self._current_recovery = recovery_time
+        self._half_open = False
+        self._lock = Lock()
+        CIRCUIT_OPEN.set_function(lambda: int(self.is_open), name=name)
+
+    @property
+    def is_open(self) -> bool:
+        return monotonic() < self._open_until
+
+    def remaining(self) -> float:
+        """距离恢复的秒数，未断开时为0"""
+        return max(self._open_until - monotonic(), 0.0)
+
+    def record(self, kind: str):
+        """记录一次请求结果的类别"""
+        with self._lock:
+            if kind == TRANSIENT:
+                self.failures += 1
+                if self._half_open or self.failures >= self.failure_threshold:
+                    self._trip()
+            elif kind != THROTTLED:
+                # 限流说明服务本身可用，但不作为恢复的依据
+                if self._half_open:
+                    logging.info(f"Circuit {self.name} closed")
+                self.failures = 0
+                self._half_open = False
+                self._current_recovery = self.recovery_time
+
+    def _trip(self):
+        if self.is_open:
+            return
+        if self._half_open:
+            self._current_recovery = min(self._current_recovery * 2, self.max_recovery_time)
+        self._open_until = monotonic() + self._current_recovery
+        self._half_open = True
+        self.failures = 0
+        self.trips += 1
+        CIRCUIT_TRIPS.inc(name=self.name)
+        logging.warning(f"Circuit {self.name} opened for {self._current_recovery:.1f}s "
+                        f"after repeated server errors")
+
+    def wait(self):
+        """断开期间阻塞等待"""
+        remaining = self.remaining()
+        while remaining > 0:
+            sleep(remaining)
+            remaining = self.remaining()
+
+    async def wait_async(self):
+        """断开期间等待（不占用线程）"""
+        remaining = self.remaining()
+        while remaining > 0:
+            await asyncio.sleep(remaining)
+            remaining = self.remaining()
+
+    def stats(self) -> Dict:
+        return {'open': self.is_open, 'remaining': round(self.remaining(), 1),
+                'failures': self.failures, 'trips': self.trips}
+
+# 默认重试策略
+default_policy = RetryPolicy()
+
+# Brain API 共用的熔断器（由 BrainSession 记录每个响应）
+api_breaker = CircuitBreaker('brain-api')
+
+def request_with_retry(session, method: str, url: str, action: str = 'Request',
+                       policy: Optional[RetryPolicy] = None,
+                       breaker: Optional[CircuitBreaker] = None,
+                       accept: Iterable[int] = (), **kwargs):
+    """
+    按重试策略发送请求
+
+    Args:
+        session: Brain会话对象
+        method: HTTP方法
+        url: 地址
+        action: 错误信息中的操作名称
+        policy: 重试策略，默认 default_policy
+        breaker: 熔断器，默认 api_breaker
+        accept: 按正常结果直接返回的错误状态码（如提交检查未通过的403）
+        **kwargs: 传给 session.request 的参数
+
+    Returns:
+        成功(<400)或状态码在 accept 中的响应
+
+    Raises:
+        ApiError: 永久错误，或重试次数用尽
+    """
+    policy = policy or default_policy
+    breaker = breaker or api_breaker
+    attempts = {}
+    while True:
+        breaker.wait()
+        # 401时只在登录代数未变化时重新登录，其他线程已登录过则直接重试
+        generation = getattr(session, 'generation', None)
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            error = ApiError(f"{action} failed: {str(e)}", TRANSIENT)
+        else:
+            if classify_response(response) == OK or response.status_code in accept:
+                return response
+            error = ApiError.from_response(response, action)
+
+        attempts[error.kind] = attempts.get(error.kind, 0) + 1
+        if not policy.should_retry(error.kind, attempts[error.kind]):
+            raise error
+        if error.kind == AUTH and hasattr(session, 'reauthenticate'):
+            session.reauthenticate(generation)
+        delay = policy.delay(error.kind, attempts[error.kind], error.retry_after)
+        logging.info(f"{action} {error.kind}, retrying in {delay:.1f}s: {str(error)}")
+        sleep(delay)
@@ -1,219 +1,734 @@
 """
 WorldQuant Brain simulation 管理工具
 """
+import asyncio
 from time import sleep
 import logging
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Iterable, Iterator
 import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from threading import Thread
 
 from .brainLogin import get_session
-from .brainSimulationConfig import get_simulation_data
-from .brainSimulationRecord import db, save_simulation_record
+from .brainSimulationConfig import get_simulation_data, get_simulation_hash
+from .brainSimulationRecord import db, save_simulation_record, configure_logging
+from .brainSimulationTracker import SimulationTracker, SIMULATIONS_URL, parse_retry_after
+from .brainRateLimiter import AdaptiveLimiter, RateLimitError, is_throttled, request_limiter
+from .brainRetryPolicy import (AUTH, PERMANENT, THROTTLED, ApiError, RetryPolicy, api_breaker,
+                               classify_exception)
+from .brainSimulationWorker import SimulationWorker
+from .brainPriority import DEFAULT_FAIR_SHARE, LOCAL_KEYS, PriorityScheduler
+from .brainExpressionValidator import filter_valid_alphas
+from .brainMetrics import (ENGINE_QUEUE_DEPTH, SIMULATION_RETRIES, SIMULATION_SUBMITS,
+                           SIMULATIONS_IN_FLIGHT)
 
-# 配置logging
-logging.basicConfig(
-    filename='simulation.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# 单个multi-simulation最多包含的alpha数量
+MAX_MULTI_SIZE = 10
+
+# 结果中保留的命中缓存记录的数量上限
+CACHED_SAMPLE_SIZE = 100
+
+# 只有这些设置一致的alpha才能放进同一个multi-simulation
+MULTI_COMPATIBLE_KEYS = ('instrumentType', 'region', 'universe', 'delay', 'language')
 
 class SimulationManager:
-    def __init__(self, max_workers=3, max_retries=6, retry_delay=10):
+    def __init__(self, max_workers=3, max_retries=6, retry_delay=10, max_concurrency=50,
+                 multi_size=1, session=None, worker=None, retry_policy=None, breaker=None,
+                 fair_share=DEFAULT_FAIR_SHARE):
         """
         初始化模拟管理器
         
         Args:
-            max_workers: 最大并发数
-            max_retries: 单个alpha最大重试次数
-            retry_delay: 重试等待时间(秒)
+            max_workers: 初始并发数，之后由 limiter 按AIMD自动调整
+            max_retries: 暂时错误(5xx、连接失败)的最多尝试次数（限流不计入）
+            retry_delay: 指数退避的基础等待时间(秒)，限流时优先使用Retry-After
+            max_concurrency: 并发窗口上限
+            multi_size: 每个multi-simulation请求包含的alpha数量，1表示逐个提交
+            session: 共享的 BrainSession，默认新建一个连接池与并发数匹配的会话
+            worker: 领取任务的 SimulationWorker，给出时提交前确认仍持有该alpha
+            retry_policy: 重试策略，默认按 max_retries 和 retry_delay 创建
+            breaker: 熔断器，断开期间暂停提交，默认为全局的 api_breaker
+            fair_share: 按优先级排序时每组中按活动(campaign)轮流分配的名额比例
         """
+        if not 1 <= multi_size <= MAX_MULTI_SIZE:
+            raise ValueError(f"multi_size must be between 1 and {MAX_MULTI_SIZE}")
+        configure_logging()
+        self.multi_size = multi_size
         self.max_workers = max_workers
         self.max_retries = max_retries
         self.retry_delay = retry_delay
-        self.session_lock = Lock()
-        self.session = get_session()
-        
-    def _get_new_session(self):
-        """获取新的会话（线程安全）"""
-        with self.session_lock:
-            self.session = get_session()
-            return self.session
+        self.retry_policy = retry_policy or RetryPolicy(max_attempts=max_retries,
+                                                        base_delay=retry_delay)
+        self.breaker = breaker or api_breaker
+        self.limiter = AdaptiveLimiter('simulations', initial=max_workers,
+                                       max_window=max_concurrency)
+        # 连接池需容纳全部在途请求，另留给进度轮询
+        self.session = session or get_session(pool_size=max_concurrency + 8)
+        self.worker = worker
+        self.scheduler = PriorityScheduler(fair_share)
+
+    def _post_simulation(self, payload) -> str:
+        """
+        发送一次模拟请求
+        
+        Args:
+            payload: Alpha配置，或multi-simulation的Alpha配置列表
             
-    def simulate_single_alpha(self, alpha: Dict) -> bool:
+        Returns:
+            str: 模拟进度的Location
         """
-        模拟单个Alpha
+        # priority、campaign 等只在本地使用
+        if isinstance(payload, list):
+            payload = [_api_payload(alpha) for alpha in payload]
+        else:
+            payload = _api_payload(payload)
+        try:
+            sim_resp = self.session.post(SIMULATIONS_URL, json=payload)
+        except Exception:
+            SIMULATION_SUBMITS.inc(outcome='transient')
+            raise
+        
+        if is_throttled(sim_resp):
+            SIMULATION_SUBMITS.inc(outcome=THROTTLED)
+            raise RateLimitError(f"Simulation throttled with status {sim_resp.status_code}",
+                                 parse_retry_after(sim_resp))
+        if sim_resp.status_code != 201:
+            error = ApiError.from_response(sim_resp, 'Simulation')
+            SIMULATION_SUBMITS.inc(outcome=error.kind)
+            raise error
+        SIMULATION_SUBMITS.inc(outcome='ok')
+            
+        # 获取位置信息
+        return sim_resp.headers.get('Location', '')
+
+    def _record_submitted(self, alphas: List[Dict], location: str):
+        """记录已提交的模拟，等待跟踪器确认完成"""
+        for index, alpha in enumerate(alphas):
+            extra_info = {
+                'simulation_id': location.split('/')[-1],
+                'location': location
+            }
+            if len(alphas) > 1:
+                # multi-simulation的子模拟按提交顺序对应
+                extra_info['multi_index'] = index
+            save_simulation_record(
+                alpha_id=None,
+                datafield=alpha['regular'],
+                status='simulating',
+                extra_info=extra_info,
+                sim_hash=get_simulation_hash(alpha)
+            )
+
+    def _handle_failure(self, alphas: List[Dict], error: Exception,
+                        attempts: Dict[str, int],
+                        generation: Optional[int] = None) -> Optional[float]:
+        """
+        按错误类别处理一次失败的提交
+        
+        - permanent(如表达式错误的400): 不重试，直接记为failed
+        - auth: 重新登录（多个线程同时遇到时只登录一次）后立即重试
+        - throttled / transient: 按重试策略退避，次数用尽后记为failed
         
         Args:
-            alpha: Alpha配置
+            alphas: 本次提交的Alpha配置
+            error: 本次尝试的异常
+            attempts: 各类别已失败的次数（会被更新）
+            generation: 发起本次请求前会话的登录代数
             
         Returns:
-            bool: 是否成功
+            float: 重试前的等待时间(秒)；None表示不再重试
         """
-        retries = 0
-        while retries < self.max_retries:
-            try:
-                # 发送模拟请求
-                sim_resp = self.session.post(
-                    'https://api.worldquantbrain.com/simulations',
-                    json=alpha
-                )
-                
-                if sim_resp.status_code != 201:
-                    raise Exception(f"Simulation failed with status {sim_resp.status_code}")
-                    
-                # 获取位置信息
-                sim_id = sim_resp.headers.get('Location', '').split('/')[-1]
-                
-                # 记录成功
+        kind = classify_exception(error)
+        attempts[kind] = attempts.get(kind, 0) + 1
+        attempt = attempts[kind]
+        if kind == THROTTLED:
+            logging.info(f"Simulation throttled - Alphas: {[a['regular'] for a in alphas]}")
+        else:
+            logging.error(f"Attempt {attempt} failed ({kind}) - {str(error)}")
+        
+        if not self.retry_policy.should_retry(kind, attempt):
+            extra_info = {'error': str(error), 'error_kind': kind,
+                          'attempts': sum(attempts.values())}
+            if kind == PERMANENT:
+                extra_info['permanent'] = True
+            for alpha in alphas:
                 save_simulation_record(
-                    alpha_id=sim_id,
+                    alpha_id=None,
                     datafield=alpha['regular'],
-                    status='success'
+                    status='failed',
+                    extra_info=extra_info,
+                    sim_hash=get_simulation_hash(alpha)
                 )
-                
-                logging.info(f"Simulation success - Alpha: {alpha['regular']}")
-                return True
+            return None
+            
+        if kind == AUTH:
+            self.session.reauthenticate(generation)
+        SIMULATION_RETRIES.inc(reason=kind)
+        return self.retry_policy.delay(kind, attempt, getattr(error, 'retry_after', None))
+            
+    def simulate_single_alpha(self, alpha: Dict) -> bool:
+        """
+        提交单个Alpha模拟
+        
+        只负责提交，alpha状态记为simulating，完成情况由 track_simulations 跟踪
+        
+        Args:
+            alpha: Alpha配置
+            
+        Returns:
+            bool: 是否提交成功
+        """
+        attempts = {}
+        while True:
+            # 熔断期间暂停提交
+            self.breaker.wait()
+            self.limiter.acquire()
+            generation = getattr(self.session, 'generation', None)
+            try:
+                location = self._post_simulation(alpha)
                 
             except Exception as e:
-                retries += 1
-                error_msg = f"Attempt {retries} failed - {str(e)}"
-                logging.error(error_msg)
-                
-                if retries >= self.max_retries:
-                    # 记录失败
-                    save_simulation_record(
-                        alpha_id=None,
-                        datafield=alpha['regular'],
-                        status='failed',
-                        extra_info={'error': str(e), 'attempts': retries}
-                    )
+                self.limiter.release(THROTTLED if isinstance(e, RateLimitError) else 'error')
+                delay = self._handle_failure([alpha], e, attempts, generation)
+                if delay is None:
                     return False
-                    
-                # 如果是认证错误，重新获取session
-                if "401" in str(e) or "403" in str(e):
-                    self.session = self._get_new_session()
-                    
-                sleep(self.retry_delay)
+                sleep(delay)
                 
-        return False
+            else:
+                self.limiter.release('ok')
+                self._record_submitted([alpha], location)
+                return True
         
-    def run_batch_simulation(self, alpha_list: List[Dict], batch_size: int = 1000):
+    def run_batch_simulation(self, alpha_list: Iterable[Dict], batch_size: int = 1000):
         """
         批量运行Alpha模拟
         
+        由 AsyncSimulationEngine 以连续窗口执行，不再按批次等待，
+        每个alpha会一直跟踪到模拟完成。带有 priority 的alpha按优先级
+        从高到低提交，并为每个活动(campaign)保留公平份额
+        
         Args:
             alpha_list: Alpha配置列表
-            batch_size: 每批处理的数量
+            batch_size: 每处理多少个alpha记录一次进度
+        """
+        engine = AsyncSimulationEngine(self, log_interval=batch_size)
+        total = len(alpha_list) if hasattr(alpha_list, '__len__') else None
+        return run_coroutine(engine.run(self.scheduler.order(alpha_list), total))
+
+
+def _api_payload(alpha: Dict) -> Dict:
+    """去掉只在本地使用的字段"""
+    if not any(key in alpha for key in LOCAL_KEYS):
+        return alpha
+    return {key: value for key, value in alpha.items() if key not in LOCAL_KEYS}
+
+
+def group_compatible_alphas(alphas: Iterable[Dict], size: int) -> Iterator[List[Dict]]:
+    """
+    把设置兼容的alpha分组，用于multi-simulation
+    
+    按流式处理，某组凑满 size 个立即输出，结束时输出剩余的不满组
+    
+    Args:
+        alphas: Alpha配置的列表或迭代器
+        size: 每组数量
+        
+    Yields:
+        list: 一组兼容的Alpha配置
+    """
+    if size <= 1:
+        for alpha in alphas:
+            yield [alpha]
+        return
+        
+    groups = {}
+    for alpha in alphas:
+        settings = alpha['settings']
+        key = (alpha['type'],) + tuple(settings.get(k) for k in MULTI_COMPATIBLE_KEYS)
+        group = groups.setdefault(key, [])
+        group.append(alpha)
+        if len(group) >= size:
+            yield groups.pop(key)
+    yield from groups.values()
+
+
+class AsyncSimulationEngine:
+    def __init__(self, manager: SimulationManager, concurrency: Optional[int] = None,
+                 log_interval: int = 1000):
+        """
+        基于asyncio的模拟引擎
+        
+        在途模拟数量由 manager.limiter 的AIMD窗口决定，某个alpha完成后
+        立即补充下一个，没有批次屏障，也没有固定的批间休眠。模拟从提交到
+        完成都占用窗口，完成情况由共享的 SimulationTracker 轮询
+        
+        Args:
+            manager: 模拟管理器（提供session、限制器、重试参数和记录逻辑）
+            concurrency: 工作协程数量（在途模拟的硬上限），默认取窗口上限
+            log_interval: 每完成多少个alpha记录一次进度
+        """
+        self.manager = manager
+        self.limiter = manager.limiter
+        self.concurrency = concurrency or int(manager.limiter.max_window)
+        self.log_interval = log_interval
+        self.processed = 0
+        self.success_count = 0
+        self._stopping = False
+        
+    async def _call(self, func, *args, **kwargs):
+        """在请求线程池中执行阻塞调用"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+        
+    async def simulate_alpha(self, alpha: Dict) -> bool:
+        """
+        模拟单个Alpha直到完成
+        
+        Args:
+            alpha: Alpha配置
+            
+        Returns:
+            bool: 是否成功
         """
-        total = len(alpha_list)
-        processed = 0
+        return await self.simulate_group([alpha]) == 1
         
-        # 分批处理
-        for i in range(0, total, batch_size):
-            batch = alpha_list[i:i + batch_size]
-            success_count = 0
+    async def simulate_group(self, alphas: List[Dict]) -> int:
+        """
+        模拟一组Alpha直到完成（重试等待不占用线程）
+        
+        多于一个alpha时作为一个multi-simulation提交，只占用一个窗口名额
+        
+        Args:
+            alphas: 设置兼容的Alpha配置列表
             
-            # 使用线程池并发处理
-            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                future_to_alpha = {
-                    executor.submit(self.simulate_single_alpha, alpha): alpha 
-                    for alpha in batch
-                }
+        Returns:
+            int: 成功数量
+        """
+        manager = self.manager
+        if manager.worker is not None:
+            # 租约已被回收的alpha可能已由其他工作者提交
+            alphas = await self._call(manager.worker.confirm, alphas)
+            if not alphas:
+                return 0
+        multi = len(alphas) > 1
+        payload = alphas if multi else alphas[0]
+        attempts = {}
+        while not self._stopping:
+            # 熔断期间暂停提交，已提交的模拟继续由跟踪器轮询
+            await manager.breaker.wait_async()
+            await self.limiter.acquire_async()
+            generation = getattr(manager.session, 'generation', None)
+            try:
+                location = await self._call(manager._post_simulation, payload)
+                break
+                
+            except Exception as e:
+                # 限流时窗口收缩后再排队
+                self.limiter.release(THROTTLED if isinstance(e, RateLimitError) else 'error')
+                delay = await self._call(manager._handle_failure, alphas, e, attempts,
+                                         generation)
+                if delay is None:
+                    return 0
+                await asyncio.sleep(delay)
+        else:
+            # 已停止，不再重试
+            return 0
+                
+        SIMULATIONS_IN_FLIGHT.inc()
+        try:
+            await self._call(manager._record_submitted, alphas, location)
+            regulars = [alpha['regular'] for alpha in alphas]
+            sim_hashes = [get_simulation_hash(alpha) for alpha in alphas]
+            if multi:
+                results = await self.tracker.track_multi(location, regulars, sim_hashes)
+            else:
+                results = [await self.tracker.track(location, regulars[0], sim_hashes[0])]
+        finally:
+            SIMULATIONS_IN_FLIGHT.dec()
+            self.limiter.release('ok')
+        return sum(1 for result in results if result['status'] == 'success')
+        
+    async def _worker(self, queue: asyncio.Queue):
+        """持续从队列中取一组alpha进行模拟"""
+        while True:
+            group = await queue.get()
+            ENGINE_QUEUE_DEPTH.set(queue.qsize())
+            if group is None:
+                return
+            if self._stopping:
+                # 停止后不再提交，领取的记录会被放回队列
+                continue
+            try:
+                success = await self.simulate_group(group)
+                self.success_count += success
+            except Exception as e:
+                logging.error(f"Unexpected error for alphas "
+                              f"{[alpha['regular'] for alpha in group]}: {str(e)}")
+            before = self.processed
+            self.processed += len(group)
+            if self.processed // self.log_interval > before // self.log_interval:
+                self._log_progress()
                 
-                for future in as_completed(future_to_alpha):
-                    alpha = future_to_alpha[future]
-                    try:
-                        if future.result():
-                            success_count += 1
-                    except Exception as e:
-                        logging.error(f"Unexpected error for alpha {alpha['regular']}: {str(e)}")
+    def _log_progress(self):
+        """记录进度"""
+        total = f"/{self.total}" if self.total else ''
+        logging.info(f"Processed {self.processed}{total} - "
+                     f"success rate: {(self.success_count/max(self.processed, 1))*100:.2f}% - "
+                     f"simulations: {self.limiter.stats()} - requests: {request_limiter.stats()}")
+        
+    async def feed(self, alphas: Iterable[Dict]):
+        """
+        从输入中取出alpha分组放入队列（需先调用 start）
+        
+        输入可能是数据库游标一类的阻塞迭代器，因此在单独的线程中
+        每次取一小块；队列满时停止读取，预读量不超过队列长度加一块
+        """
+        loop = asyncio.get_running_loop()
+        groups = group_compatible_alphas(alphas, self.manager.multi_size)
+        while not self._stopping:
+            chunk = await loop.run_in_executor(self._feed_executor, _take,
+                                               groups, self.concurrency)
+            if not chunk:
+                return
+            for group in chunk:
+                await self._queue.put(group)
+            ENGINE_QUEUE_DEPTH.set(self._queue.qsize())
             
-            processed += len(batch)
+    def start(self, total: Optional[int] = None):
+        """
+        在当前事件循环中启动工作协程和跟踪器
+        
+        run 会自动调用；长期运行的调用方可以 start 后多次 feed，最后 close
+        
+        Args:
+            total: alpha总数（仅用于进度日志）
+        """
+        self.total = total
+        self._stopping = False
+        self._queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency,
+                                            thread_name_prefix='brain-sim')
+        self._feed_executor = ThreadPoolExecutor(max_workers=1,
+                                                 thread_name_prefix='brain-feed')
+        self.tracker = SimulationTracker(self.manager.session)
+        self.tracker.start()
+        self._workers = [asyncio.ensure_future(self._worker(self._queue))
+                         for _ in range(self.concurrency)]
+        
+    def stop(self):
+        """
+        停止提交新的模拟
+        
+        队列中尚未提交的alpha不再提交（已领取的记录由 SimulationWorker.stop 放回队列），
+        已提交的模拟继续跟踪到完成
+        """
+        self._stopping = True
+        
+    @property
+    def in_flight(self) -> int:
+        """已提交、等待完成的模拟数量"""
+        return self.tracker.pending
+        
+    async def close(self) -> Dict:
+        """
+        等待队列中的alpha和已提交的模拟全部完成后停止
+        
+        Returns:
+            dict: 处理数量和成功数量
+        """
+        try:
+            for _ in self._workers:
+                await self._queue.put(None)
+            await asyncio.gather(*self._workers)
+            await self.tracker.close()
+        finally:
+            self._shutdown()
             
-            # 打印进度
-            progress = (processed / total) * 100
-            logging.info(f"Processed {processed}/{total} ({progress:.2f}%) - "
-                       f"Batch success rate: {(success_count/len(batch))*100:.2f}%")
+        self._log_progress()
+        return {'processed': self.processed, 'success': self.success_count}
+        
+    def _shutdown(self):
+        for worker in self._workers:
+            worker.cancel()
+        self.tracker._task.cancel()
+        self._executor.shutdown(wait=False)
+        self._feed_executor.shutdown(wait=False)
+        # 中断或出错时也写完已缓冲的状态更新
+        db.flush()
+        
+    async def run(self, alphas: Iterable[Dict], total: Optional[int] = None) -> Dict:
+        """
+        运行模拟
+        
+        Args:
+            alphas: Alpha配置的列表或迭代器（按需读取，不会一次性载入）
+            total: alpha总数（仅用于进度日志），默认取列表长度
             
-            # 每批处理完后短暂休息
-            sleep(5)
+        Returns:
+            dict: 处理数量和成功数量
+        """
+        self.start(total or (len(alphas) if hasattr(alphas, '__len__') else None))
+        try:
+            await self.feed(alphas)
+        except BaseException:
+            self._shutdown()
+            raise
+        return await self.close()
 
-def run_alpha_simulation(alpha_list: List[Dict], batch_id: Optional[str] = None):
+
+def _take(iterator: Iterator, n: int) -> List:
+    """从迭代器中最多取出n个元素"""
+    return list(islice(iterator, n))
+
+def run_coroutine(coro):
     """
-    运行Alpha模拟的主函数
+    同步执行协程
+    
+    在Jupyter等已有事件循环的线程中，改到独立线程里运行
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+        
+    result = {}
+    def runner():
+        try:
+            result['value'] = asyncio.run(coro)
+        except BaseException as e:
+            result['error'] = e
+    thread = Thread(target=runner, name='brain-sim-loop')
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result.get('value')
+
+def _claim_batch(alphas: Iterable[Dict], worker: SimulationWorker, batch_id: str,
+                 chunk_size: int = 1000) -> Iterator[Dict]:
+    """逐块登记并领取alpha，只把本工作者领取到的交给引擎"""
+    alphas = iter(alphas)
+    while True:
+        chunk = list(islice(alphas, chunk_size))
+        if not chunk:
+            return
+        # 库中没有的alpha先登记为pending，失败过的可以重新领取
+        db.add_batch(chunk, None, campaign=batch_id)
+        # 已在库中的记录使用本次给出的优先级
+        db.set_priorities({get_simulation_hash(alpha): alpha['priority']
+                           for alpha in chunk if 'priority' in alpha})
+        yield from worker.claim(('pending', 'failed'), batch_id,
+                                [get_simulation_hash(alpha) for alpha in chunk],
+                                limit=len(chunk))
+
+def _log_batch_statistics(batch_id: str):
+    """打印最终统计信息"""
+    stats = db.get_statistics(batch_id)
+    logging.info(f"Batch {batch_id} completed:")
+    logging.info(f"Total: {stats['total']}")
+    logging.info(f"Success: {stats['success']}")
+    logging.info(f"Failed: {stats['failed']}")
+    logging.info(f"Claimed: {stats['claimed']}")
+    logging.info(f"Simulating: {stats['simulating']}")
+    logging.info(f"Pending: {stats['pending']}")
+
+async def run_alpha_simulation_async(alpha_list: Iterable[Dict], batch_id: Optional[str] = None,
+                                     max_concurrency: int = 50, multi_size: int = 1,
+                                     validate: bool = True, session=None,
+                                     fair_share: float = DEFAULT_FAIR_SHARE):
+    """
+    运行Alpha模拟的主函数（asyncio版本）
     
     Args:
-        alpha_list: Alpha配置列表
+        alpha_list: Alpha配置的列表或迭代器（逐块去重和领取，不会一次性载入）
         batch_id: 批次ID
+        max_concurrency: 并发窗口上限，实际并发由AIMD自动探测
+        multi_size: 每个multi-simulation请求包含的alpha数量(1-10)
+        validate: 是否在提交前用本地解析器检查表达式，跳过语法、参数个数或数据字段有误的alpha
+        session: 使用的 BrainSession，默认用配置文件中的账户登录
+        fair_share: 带有 priority 的alpha按优先级提交时，每组中按活动(campaign)轮流分配的名额比例
+        
+    Returns:
+        dict: batch_id、实际模拟的数量、未通过检查的数量、命中缓存的数量，
+              以及最多 CACHED_SAMPLE_SIZE 条命中缓存的已有记录
     """
-    # 添加批次信息
     if batch_id is None:
         batch_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+    total = len(alpha_list) if hasattr(alpha_list, '__len__') else None
     
-    # 对于pending状态的alpha，更新它们的batch_id
-    regulars = [alpha['regular'] for alpha in alpha_list]
-    db.alphas.update_many(
-        {
-            'regular': {'$in': regulars},
-            'status': 'pending'
-        },
-        {
-            '$set': {
-                'batch_id': batch_id,
-                'updated_at': datetime.now()
-            }
-        }
-    )
+    # 已经模拟过(或正在模拟)的(表达式, 设置)组合直接使用已有结果，
+    # 其余的领取后再提交，其他进程正在处理的不会重复提交
+    skipped = {'cached': 0, 'invalid': 0}
+    cached_sample = []
     
-    # # 将新的alpha添加到数据库
-    # inserted = db.add_batch(alpha_list, batch_id)
-    # logging.info(f"Added {inserted} alphas to batch {batch_id}")
+    def on_cached(doc):
+        skipped['cached'] += 1
+        if len(cached_sample) < CACHED_SAMPLE_SIZE:
+            cached_sample.append(doc)
     
-    # 创建模拟管理器并运行
-    manager = SimulationManager(max_workers=5)
-    manager.run_batch_simulation(alpha_list)
+    def on_invalid(alpha, errors):
+        skipped['invalid'] += 1
+        if skipped['invalid'] <= 20:
+            logging.warning(f"Invalid expression skipped - {alpha['regular']}: {errors}")
+        db.mark_invalid(get_simulation_hash(alpha), errors)
+        
+    # 高优先级的alpha先登记和领取
+    alpha_list = PriorityScheduler(fair_share).order(alpha_list)
+    if validate:
+        alpha_list = filter_valid_alphas(alpha_list, on_invalid)
+    worker = SimulationWorker(fair_share=fair_share)
+    worker.start()
+    try:
+        feed = _claim_batch(db.iter_uncached(alpha_list, on_cached=on_cached), worker, batch_id)
+        
+        # 创建模拟管理器并运行
+        manager = SimulationManager(max_concurrency=max_concurrency, multi_size=multi_size,
+                                    session=session, worker=worker, fair_share=fair_share)
+        result = await AsyncSimulationEngine(manager).run(feed, total)
+    finally:
+        worker.stop()
+    if skipped['cached']:
+        logging.info(f"Skipped {skipped['cached']} alphas already simulated")
+    if skipped['invalid']:
+        logging.info(f"Skipped {skipped['invalid']} alphas that failed validation")
     
-    # 打印最终统计信息
-    stats = db.get_statistics(batch_id)
-    logging.info(f"Batch {batch_id} completed:")
-    logging.info(f"Total: {stats['total']}")
-    logging.info(f"Success: {stats['success']}")
-    logging.info(f"Failed: {stats['failed']}")
-    logging.info(f"Pending: {stats['pending']}")
+    _log_batch_statistics(batch_id)
+    return {'batch_id': batch_id, 'simulated': result['processed'],
+            'invalid': skipped['invalid'], 'cached': skipped['cached'],
+            'cached_sample': cached_sample}
 
-def rerun_alphas(status: str = 'pending'):
+def run_alpha_simulation(alpha_list: Iterable[Dict], batch_id: Optional[str] = None,
+                         max_concurrency: int = 50, multi_size: int = 1,
+                         validate: bool = True, session=None,
+                         fair_share: float = DEFAULT_FAIR_SHARE):
     """
-    重新运行指定状态的Alpha
+    运行Alpha模拟的主函数
     
     Args:
-        status: 要处理的Alpha状态 ('pending' 或 'failed')
+        alpha_list: Alpha配置的列表或迭代器
+        batch_id: 批次ID
+        max_concurrency: 并发窗口上限，实际并发由AIMD自动探测
+        multi_size: 每个multi-simulation请求包含的alpha数量(1-10)
+        validate: 是否在提交前用本地解析器检查表达式，跳过语法、参数个数或数据字段有误的alpha
+        session: 使用的 BrainSession，默认用配置文件中的账户登录
+        fair_share: 带有 priority 的alpha按优先级提交时，每组中按活动(campaign)轮流分配的名额比例
+        
+    Returns:
+        dict: batch_id、实际模拟的数量、未通过检查的数量、命中缓存的数量，
+              以及最多 CACHED_SAMPLE_SIZE 条命中缓存的已有记录
     """
-    # 如果是pending状态，先清理旧的batch_id
-    if status == 'pending':
-        db.clean_pending_batches()
+    return run_coroutine(run_alpha_simulation_async(alpha_list, batch_id, max_concurrency,
+                                                    multi_size, validate, session, fair_share))
+
+async def rerun_alphas_async(status: str = 'pending', multi_size: int = 1,
+                             max_concurrency: int = 50, claim_size: int = 100,
+                             session=None, worker_id: Optional[str] = None,
+                             fair_share: float = DEFAULT_FAIR_SHARE):
+    """
+    重新运行指定状态的Alpha（asyncio版本）
     
-    # 获取需要重跑的alpha
-    alphas = db.get_alphas_by_status(status)
-    if not alphas:
+    从数据库逐批原子领取任务交给模拟引擎，内存占用与任务总数无关。
+    每批按优先级从高到低领取，其中 fair_share 比例的名额按活动(campaign)轮流分配。
+    可以在多个进程或机器上同时运行（每个进程可使用不同账户的session），
+    每个alpha只会被其中一个提交；进程退出或失联后，未提交的任务在
+    租约过期后回到队列
+    
+    Args:
+        status: 要处理的Alpha状态 ('pending' 或 'failed')
+        multi_size: 每个multi-simulation请求包含的alpha数量(1-10)
+        max_concurrency: 并发窗口上限
+        claim_size: 每次领取的数量
+        session: 使用的 BrainSession，默认用配置文件中的账户登录
+        worker_id: 工作者ID，默认由主机名和进程号生成
+        fair_share: 每批中按活动轮流分配的名额比例，0 表示只按优先级
+    """
+    total = db.count_alphas_by_status(status)
+    if not total:
         print(f"No {status} alphas found")
         return
         
-    # 生成新的batch_id
+    # 生成新的batch_id，领取的alpha归入该批次
     batch_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+    with SimulationWorker(worker_id, claim_size=claim_size, fair_share=fair_share) as worker:
+        manager = SimulationManager(max_concurrency=max_concurrency, multi_size=multi_size,
+                                    session=session, worker=worker, fair_share=fair_share)
+        await AsyncSimulationEngine(manager).run(worker.iter_claims([status], batch_id), total)
+    _log_batch_statistics(batch_id)
+
+def rerun_alphas(status: str = 'pending', multi_size: int = 1,
+                 max_concurrency: int = 50, claim_size: int = 100,
+                 session=None, worker_id: Optional[str] = None,
+                 fair_share: float = DEFAULT_FAIR_SHARE):
+    """
+    重新运行指定状态的Alpha
+    
+    Args:
+        status: 要处理的Alpha状态 ('pending' 或 'failed')
+        multi_size: 每个multi-simulation请求包含的alpha数量(1-10)
+        max_concurrency: 并发窗口上限
+        claim_size: 每次领取的数量
+        session: 使用的 BrainSession，默认用配置文件中的账户登录
+        worker_id: 工作者ID，默认由主机名和进程号生成
+        fair_share: 每批中按活动轮流分配的名额比例，0 表示只按优先级
+    """
+    run_coroutine(rerun_alphas_async(status, multi_size, max_concurrency, claim_size,
+                                     session, worker_id, fair_share))
+
+async def track_simulations_async(poll_concurrency: int = 4) -> Dict:
+    """
+    跟踪所有已提交但尚未完成的模拟（asyncio版本）
     
-    # 准备alpha配置
-    alpha_list = []
+    Args:
+        poll_concurrency: 同时进行的轮询请求数
+        
+    Returns:
+        dict: 完成数量和成功数量
+    """
+    alphas = [alpha for alpha in db.get_simulating_alphas() if alpha.get('location')]
+    if not alphas:
+        print("No simulating alphas found")
+        return {'processed': 0, 'success': 0}
+        
+    # multi-simulation的子模拟共用一个Location，按提交顺序还原
+    by_location = {}
     for alpha in alphas:
-        alpha_list.append({
-            'type': alpha['type'],
-            'settings': alpha['settings'],
-            'regular': alpha['regular']
-        })
+        by_location.setdefault(alpha['location'], []).append(alpha)
+        
+    tracker = SimulationTracker(get_session(), poll_concurrency=poll_concurrency)
+    tracker.start()
+    futures = []
+    for location, group in by_location.items():
+        if 'multi_index' in group[0]:
+            group.sort(key=lambda alpha: alpha['multi_index'])
+            futures.append(tracker.track_multi(location,
+                                               [alpha['regular'] for alpha in group],
+                                               [alpha.get('sim_hash') for alpha in group]))
+        else:
+            futures.append(tracker.track(location, group[0]['regular'], group[0].get('sim_hash')))
+    tracked = await asyncio.gather(*futures, return_exceptions=True)
+    await tracker.close()
+    
+    results = []
+    for result in tracked:
+        results.extend(result if isinstance(result, list) else [result])
+    success = sum(1 for r in results if isinstance(r, dict) and r['status'] == 'success')
+    logging.info(f"Tracked {len(results)} simulations, {success} succeeded")
+    return {'processed': len(results), 'success': success}
+
+def track_simulations(poll_concurrency: int = 4) -> Dict:
+    """
+    跟踪所有已提交但尚未完成的模拟，完成后把IS指标写入数据库
     
-    # 使用原有的run_alpha_simulation函数
-    run_alpha_simulation(alpha_list, batch_id)
+    Args:
+        poll_concurrency: 同时进行的轮询请求数
+        
+    Returns:
+        dict: 完成数量和成功数量
+    """
+    return run_coroutine(track_simulations_async(poll_concurrency))
 
-__all__ = ['run_alpha_simulation', 'rerun_alphas']
\ No newline at end of file
+__all__ = ['run_alpha_simulation', 'rerun_alphas', 'track_simulations',
+           'run_alpha_simulation_async', 'rerun_alphas_async', 'track_simulations_async']
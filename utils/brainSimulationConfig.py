@@ -1,6 +1,11 @@
 """
 WorldQuant Brain simulation 配置文件
 """
+import json
+import re
+from hashlib import sha1
+from threading import Lock
+from typing import Dict
 
 DEFAULT_SIMULATION_CONFIG = {
     'type': 'REGULAR',
@@ -20,6 +25,72 @@ DEFAULT_SIMULATION_CONFIG = {
     }
 }
 
+# settings 内容哈希的长度（十六进制位数）
+PROFILE_ID_LENGTH = 16
+
+def _canonical_json(value) -> str:
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+
+class SettingsProfile(dict):
+    """
+    不可变的模拟设置
+
+    由 intern_settings 创建，内容相同的设置在进程内只有一个实例，
+    大量alpha共用同一个对象；profile_id 为内容哈希，数据库中的alpha只保存该ID。
+    需要修改时用 intern_settings({**profile, ...}) 得到新的设置
+    """
+    __slots__ = ('profile_id', 'canonical')
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("SettingsProfile is immutable, use intern_settings({**profile, ...})")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __hash__(self):
+        return hash(self.profile_id)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        # 跨进程传递时在目标进程中重新驻留
+        return intern_settings, (dict(self),)
+
+    def __repr__(self):
+        return f"SettingsProfile({self.profile_id}, {dict.__repr__(self)})"
+
+_profiles = {}
+_profiles_lock = Lock()
+
+def intern_settings(settings: Dict) -> SettingsProfile:
+    """
+    获取与 settings 内容相同的唯一 SettingsProfile
+
+    Args:
+        settings: 模拟设置
+
+    Returns:
+        SettingsProfile: 驻留的不可变设置
+    """
+    if isinstance(settings, SettingsProfile):
+        return settings
+    canonical = _canonical_json(settings)
+    profile = _profiles.get(canonical)
+    if profile is None:
+        with _profiles_lock:
+            profile = _profiles.get(canonical)
+            if profile is None:
+                profile = SettingsProfile(settings)
+                profile.canonical = canonical
+                profile.profile_id = sha1(canonical.encode('utf-8')).hexdigest()[:PROFILE_ID_LENGTH]
+                _profiles[canonical] = profile
+    return profile
+
 def get_simulation_data(datafield, config=None):
     """
     获取模拟配置数据
@@ -29,12 +100,46 @@ def get_simulation_data(datafield, config=None):
         config: 自定义配置(可选)，会覆盖默认配置
         
     Returns:
-        dict: 完整的模拟配置
+        dict: 完整的模拟配置，settings 为共享的不可变 SettingsProfile
     """
-    simulation_data = DEFAULT_SIMULATION_CONFIG.copy()
-    
+    settings = DEFAULT_SIMULATION_CONFIG['settings']
     if config:
-        simulation_data['settings'].update(config)
+        settings = {**settings, **config}
+    return {
+        'type': DEFAULT_SIMULATION_CONFIG['type'],
+        'settings': intern_settings(settings),
+        'regular': datafield
+    }
+
+def normalize_expression(expression):
+    """
+    规范化Alpha表达式（去掉所有空白）
     
-    simulation_data['regular'] = datafield
-    return simulation_data
\ No newline at end of file
+    Args:
+        expression: Alpha表达式
+        
+    Returns:
+        str: 规范化后的表达式
+    """
+    return re.sub(r'\s+', '', expression)
+
+def get_simulation_hash(simulation_data):
+    """
+    计算模拟配置的内容哈希
+    
+    对类型、规范化后的表达式和settings做规范化JSON序列化后取sha1，
+    表达式和设置都相同的模拟得到相同的哈希
+    
+    Args:
+        simulation_data: get_simulation_data 返回的模拟配置
+        
+    Returns:
+        str: 40位十六进制哈希
+    """
+    # 与整体做规范化JSON序列化的结果相同，settings 只序列化一次
+    settings = simulation_data['settings']
+    settings_json = (settings.canonical if isinstance(settings, SettingsProfile)
+                     else _canonical_json(settings))
+    canonical = (f'{{"regular":{json.dumps(normalize_expression(simulation_data["regular"]))},'
+                 f'"settings":{settings_json},"type":{json.dumps(simulation_data["type"])}}}')
+    return sha1(canonical.encode('utf-8')).hexdigest()
\ No newline at end of file
@@ -0,0 +1,415 @@
+"""
+WorldQuant Brain 模拟守护进程
+长期运行：保持一个已登录的会话和数据库连接，持续领取 alphas 集合中的待模拟记录，
+通过本地HTTP接口接收入队请求；收到 SIGTERM/SIGINT 或 /stop 后不再提交新的模拟，
+等待已提交的模拟完成后退出
+
+用法:
+    python -m utils.brainSimulationDaemon run --concurrency 50
+    python -m utils.brainSimulationDaemon enqueue 'rank(close)' 'ts_rank(volume, 5)' --priority 2
+    python -m utils.brainSimulationDaemon enqueue --file expressions.txt --config '{"decay": 4}'
+    python -m utils.brainSimulationDaemon status
+    python -m utils.brainSimulationDaemon stop
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Thread
+from time import monotonic
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+import requests
+from pymongo.errors import PyMongoError
+
+from .brainExpressionValidator import filter_valid_alphas
+from .brainLogin import get_session
+from .brainPriority import DEFAULT_FAIR_SHARE
+from .brainSimulation import AsyncSimulationEngine, SimulationManager, run_coroutine
+from .brainSimulationConfig import DEFAULT_SIMULATION_CONFIG, get_simulation_data, get_simulation_hash
+from .brainSimulationRecord import configure_logging, db
+from .brainSimulationWorker import SimulationWorker
+
+DEFAULT_DAEMON_PORT = int(os.environ.get('BRAIN_DAEMON_PORT', 9110))
+
+# 队列为空时第一次等待的时间(秒)，之后每次加倍
+DEFAULT_IDLE_INTERVAL = 1.0
+
+# 队列为空时等待的上限(秒)
+DEFAULT_MAX_IDLE_INTERVAL = 60.0
+
+def build_alphas(request: Dict) -> List[Dict]:
+    """
+    把入队请求转换为Alpha配置
+
+    Args:
+        request: {'expressions': [...]} 或 {'alphas': [{'regular': ..., 'settings': ...}]}，
+                 可带 config（覆盖默认设置）、priority、campaign
+
+    Returns:
+        list: Alpha配置
+    """
+    config = request.get('config')
+    alphas = []
+    for expression in request.get('expressions') or []:
+        alphas.append(get_simulation_data(expression, config))
+    for item in request.get('alphas') or []:
+        alpha = get_simulation_data(item['regular'], {**(config or {}), **item.get('settings', {})})
+        alpha['type'] = item.get('type', DEFAULT_SIMULATION_CONFIG['type'])
+        for key in ('priority', 'campaign'):
+            if key in item:
+                alpha[key] = item[key]
+        alphas.append(alpha)
+    if 'priority' in request:
+        for alpha in alphas:
+            alpha.setdefault('priority', request['priority'])
+    return alphas
+
+
+class _DaemonHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: Dict):
+        data = json.dumps(body, default=str).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/status':
+            self._send(200, self.server.simulation_daemon.status())
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        daemon = self.server.simulation_daemon
+        path = urlparse(self.path).path
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if path == '/enqueue':
+                self._send(200, daemon.enqueue(build_alphas(request), request.get('campaign')))
+            elif path == '/stop':
+                daemon.request_stop()
+                self._send(200, {'stopping': True})
+            else:
+                self._send(404, {'error': 'not found'})
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, {'error': str(e)})
+        except Exception as e:
+            logging.error(f"Daemon request {path} failed: {str(e)}")
+            self._send(500, {'error': str(e)})
+
+
+class SimulationDaemon:
+    def __init__(self, max_concurrency: int = 50, multi_size: int = 1, claim_size: int = 100,
+                 fair_share: float = DEFAULT_FAIR_SHARE, port: int = DEFAULT_DAEMON_PORT,
+                 host: str = '127.0.0.1', idle_interval: float = DEFAULT_IDLE_INTERVAL,
+                 max_idle_interval: float = DEFAULT_MAX_IDLE_INTERVAL, validate: bool = True,
+                 session=None, worker_id: Optional[str] = None):
+        """
+        长期运行的模拟服务
+
+        只登录一次、只连接一次数据库，持续按优先级领取pending记录交给同一个
+        AsyncSimulationEngine，在途模拟保持在AIMD窗口附近，没有批次之间的空档。
+        有新记录写入时通过MongoDB change stream立即唤醒（需要副本集），
+        否则按 idle_interval 到 max_idle_interval 的退避间隔轮询
+
+        Args:
+            max_concurrency: 并发窗口上限
+            multi_size: 每个multi-simulation请求包含的alpha数量(1-10)
+            claim_size: 每次领取的数量
+            fair_share: 每次领取中按活动(campaign)轮流分配的名额比例
+            port: 本地HTTP接口端口，0 表示随机端口，None 表示不开启
+            host: 本地HTTP接口地址
+            idle_interval: 队列为空时第一次等待的时间(秒)
+            max_idle_interval: 队列为空时等待的上限(秒)
+            validate: 入队时是否用本地解析器检查表达式
+            session: 使用的 BrainSession，默认用配置文件中的账户登录
+            worker_id: 工作者ID，默认由主机名和进程号生成
+        """
+        self.max_concurrency = max_concurrency
+        self.multi_size = multi_size
+        self.fair_share = fair_share
+        self.port = port
+        self.host = host
+        self.idle_interval = idle_interval
+        self.max_idle_interval = max_idle_interval
+        self.validate = validate
+        self.session = session
+        self.worker = SimulationWorker(worker_id, claim_size=claim_size, fair_share=fair_share)
+        self.batch_id = f"daemon_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        self.claimed = 0
+        self.enqueued = 0
+        self.change_stream = False
+        self.engine = None
+        self._validators = {}
+        self._loop = None
+        self._server = None
+        self._watch_stop = Event()
+        self._started_at = None
+
+    @property
+    def url(self) -> Optional[str]:
+        """本地HTTP接口地址"""
+        if self._server is None:
+            return None
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def enqueue(self, alphas: List[Dict], campaign: Optional[str] = None) -> Dict:
+        """
+        把alpha写入队列并唤醒领取（可在任意线程中调用）
+
+        Args:
+            alphas: Alpha配置，可带 priority、campaign
+            campaign: alpha没有指定 campaign 时所属的活动
+
+        Returns:
+            dict: 新入队数量 queued、库中已有的数量 existing、未通过检查的表达式 invalid
+        """
+        invalid = []
+        if self.validate:
+            def on_invalid(alpha, errors):
+                invalid.append({'regular': alpha['regular'], 'errors': errors})
+                db.mark_invalid(get_simulation_hash(alpha), errors)
+            alphas = list(filter_valid_alphas(alphas, on_invalid, self._validators))
+        queued = db.add_batch(alphas, None, campaign=campaign) if alphas else 0
+        # 已在库中的记录使用本次给出的优先级
+        db.set_priorities({get_simulation_hash(alpha): alpha['priority']
+                           for alpha in alphas if 'priority' in alpha})
+        self.enqueued += queued
+        self.notify()
+        logging.info(f"Enqueued {queued} alphas ({len(alphas) - queued} already known, "
+                     f"{len(invalid)} invalid)")
+        return {'queued': queued, 'existing': len(alphas) - queued, 'invalid': invalid}
+
+    def notify(self):
+        """有新的待模拟记录，立即唤醒领取（可在任意线程中调用）"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def request_stop(self):
+        """停止提交新的模拟，等待已提交的模拟完成后退出（可在任意线程中调用）"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._begin_stop)
+
+    def _begin_stop(self):
+        if self._stop.is_set():
+            logging.info("Daemon already draining")
+            return
+        logging.info(f"Daemon stopping, draining {self.engine.in_flight} in-flight simulations")
+        self._stop.set()
+        self._wake.set()
+        self.engine.stop()
+
+    def status(self) -> Dict:
+        """运行状态"""
+        engine = self.engine
+        return {
+            'worker_id': self.worker.worker_id,
+            'batch_id': self.batch_id,
+            'uptime_seconds': round(monotonic() - self._started_at, 1) if self._started_at else 0,
+            'stopping': self._loop is not None and self._stop.is_set(),
+            'change_stream': self.change_stream,
+            'enqueued': self.enqueued,
+            'claimed': self.claimed,
+            'processed': engine.processed if engine else 0,
+            'success': engine.success_count if engine else 0,
+            'in_flight': engine.in_flight if engine else 0,
+            'limiter': engine.limiter.stats() if engine else None,
+            'statistics': db.get_total_statistics()
+        }
+
+    def _watch(self):
+        """监听 alphas 集合中新的pending记录（change stream，不可用时退回轮询）"""
+        pipeline = [{'$match': {'$or': [
+            {'operationType': 'insert'},
+            {'updateDescription.updatedFields.status': 'pending'}
+        ]}}]
+        try:
+            with db.alphas.watch(pipeline, max_await_time_ms=1000) as stream:
+                self.change_stream = True
+                logging.info("Watching alphas with a change stream")
+                while not self._watch_stop.is_set() and stream.alive:
+                    if stream.try_next() is not None:
+                        self.notify()
+        except (PyMongoError, NotImplementedError) as e:
+            logging.info(f"Change streams unavailable, polling with backoff: {str(e)}")
+        finally:
+            self.change_stream = False
+
+    def _start_server(self):
+        if self.port is None:
+            return
+        self._server = ThreadingHTTPServer((self.host, self.port), _DaemonHandler)
+        self._server.daemon_threads = True
+        self._server.simulation_daemon = self
+        Thread(target=self._server.serve_forever, name='brain-daemon-http', daemon=True).start()
+        logging.info(f"Daemon listening on {self.url}")
+
+    def _install_signal_handlers(self):
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self._loop.add_signal_handler(sig, self._begin_stop)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # Windows 或非主线程（如Jupyter）中只能通过 /stop 停止
+                return
+
+    async def _claim_loop(self):
+        """持续领取pending记录交给引擎，队列为空时退避等待"""
+        loop = asyncio.get_running_loop()
+        delay = self.idle_interval
+        while not self._stop.is_set():
+            self._wake.clear()
+            alphas = await loop.run_in_executor(None, self.worker.claim, ('pending',),
+                                                self.batch_id)
+            if alphas:
+                delay = self.idle_interval
+                self.claimed += len(alphas)
+                await self.engine.feed(alphas)
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), delay)
+                delay = self.idle_interval
+            except asyncio.TimeoutError:
+                delay = min(delay * 2, self.max_idle_interval)
+
+    async def run_async(self) -> Dict:
+        """
+        运行直到收到停止请求（asyncio版本）
+
+        Returns:
+            dict: 处理数量和成功数量
+        """
+        configure_logging()
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._started_at = monotonic()
+        # 连接池需容纳全部在途请求，另留给进度轮询
+        self.session = self.session or get_session(pool_size=self.max_concurrency + 8)
+        manager = SimulationManager(max_concurrency=self.max_concurrency,
+                                    multi_size=self.multi_size, session=self.session,
+                                    worker=self.worker, fair_share=self.fair_share)
+        self.engine = AsyncSimulationEngine(manager)
+        self.worker.start()
+        self.engine.start()
+        self._start_server()
+        self._watch_stop.clear()
+        watcher = Thread(target=self._watch, name='brain-daemon-watch', daemon=True)
+        watcher.start()
+        self._install_signal_handlers()
+        logging.info(f"Daemon {self.worker.worker_id} started, batch {self.batch_id}")
+        try:
+            await self._claim_loop()
+        finally:
+            self.engine.stop()
+            result = await self.engine.close()
+            self._watch_stop.set()
+            if self._server is not None:
+                self._server.shutdown()
+                self._server.server_close()
+            # 尚未提交的记录放回队列
+            self.worker.stop()
+            logging.info(f"Daemon stopped after {result['processed']} alphas "
+                         f"({result['success']} succeeded)")
+        return result
+
+    def run(self) -> Dict:
+        """运行直到收到 SIGTERM/SIGINT 或 /stop 请求"""
+        return run_coroutine(self.run_async())
+
+def _daemon_url(port: int) -> str:
+    return f"http://127.0.0.1:{port}"
+
+def enqueue_expressions(expressions: List[str], config: Optional[Dict] = None,
+                        priority: Optional[float] = None, campaign: Optional[str] = None,
+                        port: int = DEFAULT_DAEMON_PORT) -> Dict:
+    """
+    把表达式发送给本机运行中的守护进程入队
+
+    Args:
+        expressions: Alpha表达式
+        config: 覆盖默认设置的设置
+        priority: 优先级
+        campaign: 所属活动
+
+    Returns:
+        dict: 入队结果（见 SimulationDaemon.enqueue）
+    """
+    request = {'expressions': list(expressions), 'config': config, 'campaign': campaign}
+    if priority is not None:
+        request['priority'] = priority
+    response = requests.post(f"{_daemon_url(port)}/enqueue", json=request, timeout=300)
+    response.raise_for_status()
+    return response.json()
+
+def daemon_status(port: int = DEFAULT_DAEMON_PORT) -> Dict:
+    """读取本机守护进程的运行状态"""
+    response = requests.get(f"{_daemon_url(port)}/status", timeout=30)
+    response.raise_for_status()
+    return response.json()
+
+def stop_daemon(port: int = DEFAULT_DAEMON_PORT) -> Dict:
+    """请求本机守护进程停止（等待已提交的模拟完成后退出）"""
+    response = requests.post(f"{_daemon_url(port)}/stop", json={}, timeout=30)
+    response.raise_for_status()
+    return response.json()
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Long-running simulation daemon')
+    parser.add_argument('--port', type=int, default=DEFAULT_DAEMON_PORT)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the daemon until SIGTERM/SIGINT')
+    run_parser.add_argument('--concurrency', type=int, default=50)
+    run_parser.add_argument('--multi-size', type=int, default=1)
+    run_parser.add_argument('--claim-size', type=int, default=100)
+    run_parser.add_argument('--fair-share', type=float, default=DEFAULT_FAIR_SHARE)
+    run_parser.add_argument('--no-validate', action='store_true')
+
+    enqueue_parser = commands.add_parser('enqueue', help='queue expressions on the daemon')
+    enqueue_parser.add_argument('expressions', nargs='*')
+    enqueue_parser.add_argument('--file', help='read expressions from this file, one per line')
+    enqueue_parser.add_argument('--config', help='settings overrides as JSON')
+    enqueue_parser.add_argument('--priority', type=float)
+    enqueue_parser.add_argument('--campaign')
+
+    commands.add_parser('status', help='print the daemon status')
+    commands.add_parser('stop', help='drain in-flight simulations and exit')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        SimulationDaemon(max_concurrency=args.concurrency, multi_size=args.multi_size,
+                         claim_size=args.claim_size, fair_share=args.fair_share,
+                         port=args.port, validate=not args.no_validate).run()
+        return
+    if args.command == 'enqueue':
+        expressions = list(args.expressions)
+        if args.file:
+            with open(args.file) as f:
+                expressions.extend(line.strip() for line in f if line.strip())
+        if not expressions:
+            parser.error('no expressions given')
+        config = json.loads(args.config) if args.config else None
+        result = enqueue_expressions(expressions, config, args.priority, args.campaign,
+                                     args.port)
+    elif args.command == 'status':
+        result = daemon_status(args.port)
+    else:
+        result = stop_daemon(args.port)
+    json.dump(result, sys.stdout, indent=2, default=str)
+    print()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+WorldQuant Brain alpha 组合生成工具
+按 表达式模板 × 数据字段/运算符 × 设置网格 惰性生成模拟配置
+"""
+import itertools
+from string import Formatter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .brainBloomFilter import BloomFilter
+from .brainSimulationConfig import DEFAULT_SIMULATION_CONFIG, get_simulation_hash, intern_settings
+
+def get_placeholders(template: str) -> List[str]:
+    """
+    获取表达式模板中的占位符
+
+    Args:
+        template: 表达式模板，如 'group_rank({field}/cap, subindustry)'
+
+    Returns:
+        list: 按出现顺序排列的占位符名称（不重复）
+    """
+    names = []
+    for _, name, _, _ in Formatter().parse(template):
+        if name and name not in names:
+            names.append(name)
+    return names
+
+def _as_values(values) -> Tuple:
+    """把占位符取值转为元组（DataFrame取'id'列，单个字符串视为一个取值）"""
+    if hasattr(values, 'columns'):
+        values = values['id']
+    if isinstance(values, str):
+        return (values,)
+    return tuple(values)
+
+def expand_settings_grid(grid: Optional[Dict] = None) -> Iterator[Dict]:
+    """
+    展开设置网格
+
+    Args:
+        grid: 设置名到取值列表的映射，如 {'decay': [0, 4], 'truncation': [0.01, 0.08]}，
+              单个取值可以不写成列表
+
+    Yields:
+        dict: 每种取值组合对应的设置覆盖项
+    """
+    grid = grid or {}
+    keys = list(grid)
+    pools = [grid[key] if isinstance(grid[key], (list, tuple)) else [grid[key]]
+             for key in keys]
+    for combo in itertools.product(*pools):
+        yield dict(zip(keys, combo))
+
+
+class AlphaGenerator:
+    def __init__(self, templates, values: Dict, settings_grid: Optional[Dict] = None,
+                 base_settings: Optional[Dict] = None, alpha_type: str = 'REGULAR'):
+        """
+        初始化组合生成器
+
+        每个模板只在自己用到的占位符上展开，再与设置网格做笛卡尔积。
+        组合按需逐个产生，内存中只保留各占位符的取值和设置网格，
+        产生的alpha共用各设置组合的 SettingsProfile
+
+        Args:
+            templates: 表达式模板或模板列表，如 '{op}({field}/cap, subindustry)'
+            values: 占位符到取值的映射，取值可以是字符串列表，或 get_datafields
+                    返回的DataFrame（使用'id'列）
+            settings_grid: 设置网格，如 {'decay': [0, 4], 'truncation': [0.01, 0.08]}
+            base_settings: 覆盖默认设置的固定设置
+            alpha_type: 模拟类型
+        """
+        self.templates = [templates] if isinstance(templates, str) else list(templates)
+        self.values = {name: _as_values(v) for name, v in values.items()}
+        self.settings = dict(DEFAULT_SIMULATION_CONFIG['settings'], **(base_settings or {}))
+        self.settings_grid = list(expand_settings_grid(settings_grid))
+        # 每种设置组合只创建一个共享的 SettingsProfile
+        self.profiles = [intern_settings(dict(self.settings, **overrides))
+                         for overrides in self.settings_grid]
+        self.alpha_type = alpha_type
+
+        for template in self.templates:
+            missing = [name for name in get_placeholders(template) if name not in self.values]
+            if missing:
+                raise ValueError(f"No values for placeholders {missing} in template {template!r}")
+
+    def count(self) -> int:
+        """组合总数（去重前），不需要枚举"""
+        total = 0
+        for template in self.templates:
+            combos = 1
+            for name in get_placeholders(template):
+                combos *= len(self.values[name])
+            total += combos
+        return total * len(self.settings_grid)
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self) -> Iterator[Dict]:
+        return self.generate()
+
+    def iter_expressions(self) -> Iterator[str]:
+        """按模板逐个产生表达式"""
+        for template in self.templates:
+            names = get_placeholders(template)
+            for combo in itertools.product(*(self.values[name] for name in names)):
+                yield template.format(**dict(zip(names, combo)))
+
+    def generate(self, shard: int = 0, num_shards: int = 1, dedup: bool = True,
+                 error_rate: float = 1e-6) -> Iterator[Dict]:
+        """
+        惰性产生模拟配置
+
+        按 sim_hash 分片，相同的组合总是落在同一个分片，多个工作者
+        各取一个分片即可不重不漏。去重使用布隆过滤器，内存与组合数量
+        成比例但每个组合只占几个字节；误判时会以 error_rate 的概率
+        跳过一个未出现过的组合
+
+        Args:
+            shard: 当前分片序号(0 ~ num_shards-1)
+            num_shards: 分片总数（通常为工作者数量）
+            dedup: 是否跳过重复的(表达式, 设置)组合
+            error_rate: 去重布隆过滤器的误判率
+
+        Yields:
+            dict: 与 get_simulation_data 格式相同的模拟配置
+        """
+        if not 0 <= shard < num_shards:
+            raise ValueError("shard must be between 0 and num_shards - 1")
+        seen = BloomFilter(max(self.count() // num_shards, 1000), error_rate) if dedup else None
+
+        for expression in self.iter_expressions():
+            for profile in self.profiles:
+                alpha = {
+                    'type': self.alpha_type,
+                    'settings': profile,
+                    'regular': expression
+                }
+                sim_hash = get_simulation_hash(alpha)
+                if num_shards > 1 and int(sim_hash[:8], 16) % num_shards != shard:
+                    continue
+                if seen is not None:
+                    if sim_hash in seen:
+                        continue
+                    seen.add(sim_hash)
+                yield alpha
+
+def generate_alphas(templates, values: Dict, settings_grid: Optional[Dict] = None,
+                    base_settings: Optional[Dict] = None, shard: int = 0,
+                    num_shards: int = 1) -> Iterator[Dict]:
+    """
+    惰性生成模拟配置，可直接传给 run_alpha_simulation
+
+    Args:
+        templates: 表达式模板或模板列表
+        values: 占位符到取值的映射
+        settings_grid: 设置网格
+        base_settings: 覆盖默认设置的固定设置
+        shard: 当前分片序号
+        num_shards: 分片总数
+
+    Returns:
+        Iterator[dict]: 模拟配置的迭代器
+    """
+    generator = AlphaGenerator(templates, values, settings_grid, base_settings)
+    return generator.generate(shard, num_shards)
@@ -2,65 +2,658 @@
 WorldQuant Brain simulation 记录工具
 使用MongoDB存储记录
 """
+import atexit
 import logging
-from datetime import datetime
-from typing import Optional, Dict, List
-from pymongo import MongoClient, ASCENDING
-from pymongo.errors import DuplicateKeyError
-
-# 配置logging
-logging.basicConfig(
-    filename='simulation.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+import os
+import random
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from itertools import islice
+from threading import Event, Lock, Thread
+from time import perf_counter
+from uuid import uuid4
+from typing import Callable, Optional, Dict, Iterable, Iterator, List, Tuple
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+
+from .brainBloomFilter import BloomFilter
+from .brainMetrics import (DB_FLUSH_OPS, DB_FLUSH_SECONDS, DB_OPERATION_SECONDS,
+                           DB_PENDING_UPDATES, DB_WRITE_ERRORS)
+from .brainPriority import DEFAULT_FAIR_SHARE, fair_select
+from .brainSimulationConfig import get_simulation_hash, intern_settings, SettingsProfile
+
+DEFAULT_DB_URL = os.environ.get('BRAIN_MONGO_URL', 'mongodb://localhost:27017/')
+DEFAULT_DB_NAME = os.environ.get('BRAIN_MONGO_DB', 'brain_simulation')
+
+# 索引结构版本，修改 _init_db 中的索引时递增
+SCHEMA_VERSION = 10
+
+# 统计计数的状态
+STATUSES = ('pending', 'claimed', 'simulating', 'success', 'failed')
+
+# 不再重新提交的提交状态（'failed' 和 'correlated' 的alpha下次仍是候选）
+FINAL_SUBMISSION_STATUSES = ('submitted', 'rejected')
+
+# 读取模拟配置时的字段（旧记录内嵌 settings，新记录只保存 settings_id）
+ALPHA_FIELDS = {'type': 1, 'settings': 1, 'settings_id': 1, 'regular': 1}
+
+# 全局统计文档的 _id（批次统计文档的 _id 为 {'batch_id': 批次ID}）
+GLOBAL_STATS_ID = 'all'
+
+# 启动耗时(秒)，用于衡量首次使用数据库的开销
+startup_timings = {}
+
+_logging_configured = False
+
+def configure_logging(filename: str = 'simulation.log'):
+    """配置logging（只在第一次调用时生效，导入模块时不再配置）"""
+    global _logging_configured
+    if _logging_configured:
+        return
+    _logging_configured = True
+    logging.basicConfig(
+        filename=filename,
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+
+class BulkWriter:
+    def __init__(self, collection, max_ops: int = 500, flush_interval: float = 1.0,
+                 watch_fields: Tuple[str, ...] = (),
+                 on_change: Optional[Callable[[Dict[Tuple[Tuple, Tuple], int]], None]] = None):
+        """
+        缓冲写入器
+        
+        收集对单个文档的 $set/$inc 更新，在后台线程中按数量或时间阈值用
+        bulk_write(ordered=False) 批量写入。同一文档的多次更新在缓冲区中
+        合并为一条（后写的 $set 覆盖先写的，$inc 累加），因此无序写入
+        不会打乱状态变化的先后。进程退出时通过 atexit 保证写完
+        
+        修改 watch_fields[0] 的更新先读出文档当前的跟踪字段，把它作为条件加入过滤，
+        再按(修改前, 修改后)分组批量写入，每组匹配的数量就是实际发生的变化数。
+        其他进程先改了文档时条件不匹配，这些更新放回缓冲区按新的状态重试，
+        多个进程同时修改同一文档时不会重复或遗漏计数
+        
+        Args:
+            collection: MongoDB集合
+            max_ops: 缓冲的文档数达到该值时触发写入
+            flush_interval: 最长写入间隔(秒)
+            watch_fields: 需要跟踪变化的字段（如 ('status', 'batch_id')）
+            on_change: 写入后以 {(修改前的值, 修改后的值): 文档数} 调用
+        """
+        self.collection = collection
+        self.max_ops = max_ops
+        self.flush_interval = flush_interval
+        self.watch_fields = tuple(watch_fields)
+        self.on_change = on_change
+        self.stats = {'flushes': 0, 'ops': 0, 'errors': 0, 'retries': 0,
+                      'flush_seconds': 0.0, 'max_flush_seconds': 0.0}
+        self._pending = {}
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._wakeup = Event()
+        self._closed = False
+        self._thread = Thread(target=self._run, name='brain-db-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        
+    def update(self, filter: Dict, set_fields: Optional[Dict] = None,
+               inc_fields: Optional[Dict] = None):
+        """
+        加入一条更新
+        
+        Args:
+            filter: 定位单个文档的条件
+            set_fields: $set 字段
+            inc_fields: $inc 字段
+        """
+        key = tuple(sorted(filter.items()))
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = self._pending[key] = {'filter': filter, '$set': {}, '$inc': {}}
+            self._merge(entry, set_fields or {}, inc_fields or {})
+            size = len(self._pending)
+        DB_PENDING_UPDATES.set(size)
+            
+        if size >= self.max_ops:
+            self._wakeup.set()
+        if size >= self.max_ops * 10:
+            # 后台写入跟不上时由调用方直接写入
+            self.flush()
+            
+    @staticmethod
+    def _merge(entry: Dict, set_fields: Dict, inc_fields: Dict):
+        entry['$set'].update(set_fields)
+        for field, value in inc_fields.items():
+            entry['$inc'][field] = entry['$inc'].get(field, 0) + value
+            
+    def flush(self) -> int:
+        """
+        立即写入缓冲区中的全部更新
+        
+        Returns:
+            int: 写入的文档数
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+                
+            start = perf_counter()
+            written = 0
+            changes = Counter()
+            try:
+                try:
+                    plain, groups = self._plan(pending)
+                except PyMongoError as e:
+                    self.stats['errors'] += 1
+                    DB_WRITE_ERRORS.inc()
+                    logging.error(f"Bulk write failed, {len(pending)} updates requeued: {str(e)}")
+                    self._requeue(pending)
+                    return 0
+                batches = [(None, plain)] + list(groups.items())
+                for index, (transition, entries) in enumerate(batches):
+                    if not entries:
+                        continue
+                    try:
+                        matched = self._write(entries, transition)
+                    except BulkWriteError as e:
+                        write_errors = e.details.get('writeErrors', [])
+                        matched = e.details.get('nMatched', 0)
+                        self.stats['errors'] += len(write_errors)
+                        DB_WRITE_ERRORS.inc(len(write_errors))
+                        logging.error(f"Bulk write error: {write_errors[:3]}")
+                    except PyMongoError as e:
+                        # 连接类错误：未写入的更新放回缓冲区，下次重试
+                        rest = {key: entry for _, group in batches[index:]
+                                for key, entry in group.items()}
+                        self.stats['errors'] += 1
+                        DB_WRITE_ERRORS.inc()
+                        logging.error(f"Bulk write failed, {len(rest)} updates requeued: {str(e)}")
+                        self._requeue(rest)
+                        break
+                    written += len(entries)
+                    if transition is None:
+                        continue
+                    changes[transition] += matched
+                    if matched < len(entries):
+                        self._retry_unmatched(entries, transition)
+            finally:
+                elapsed = perf_counter() - start
+                self.stats['flushes'] += 1
+                self.stats['flush_seconds'] += elapsed
+                self.stats['max_flush_seconds'] = max(self.stats['max_flush_seconds'], elapsed)
+                DB_FLUSH_SECONDS.observe(elapsed)
+                DB_PENDING_UPDATES.set(len(self._pending))
+                if changes and self.on_change:
+                    try:
+                        self.on_change(dict(changes))
+                    except Exception as e:
+                        logging.error(f"Change hook failed: {str(e)}")
+                
+            self.stats['ops'] += written
+            DB_FLUSH_OPS.inc(written)
+            return written
+            
+    def _write(self, entries: Dict, transition: Optional[Tuple[Tuple, Tuple]]) -> int:
+        """批量写入一组更新，有 transition 时以修改前的值为条件，返回匹配的数量"""
+        condition = dict(zip(self.watch_fields, transition[0])) if transition else {}
+        ops = [UpdateOne({**entry['filter'], **condition},
+                         {op: fields for op, fields in entry.items() if op != 'filter' and fields})
+               for entry in entries.values()]
+        return self.collection.bulk_write(ops, ordered=False).matched_count
+        
+    def _plan(self, pending: Dict) -> Tuple[Dict, Dict]:
+        """
+        把更新分为普通更新和按(修改前, 修改后)分组的跟踪更新
+        
+        Returns:
+            tuple: (普通更新, {(修改前的值, 修改后的值): 更新})
+        """
+        plain, groups = {}, defaultdict(dict)
+        watched = {key: entry for key, entry in pending.items()
+                   if self.watch_fields and self.watch_fields[0] in entry['$set']}
+        current = self._read_current(watched)
+        for key, entry in pending.items():
+            doc = current.get(key)
+            if doc is None:
+                # 不跟踪的更新，或者没有找到文档（写入不会生效）
+                plain[key] = entry
+                continue
+            old = tuple(doc.get(field) for field in self.watch_fields)
+            if any(field in entry['filter'] and entry['filter'][field] != value
+                   for field, value in zip(self.watch_fields, old)):
+                # 带条件的更新（如只修改pending记录）不会匹配，直接丢弃
+                continue
+            new = tuple(entry['$set'].get(field, value)
+                        for field, value in zip(self.watch_fields, old))
+            if new == old:
+                plain[key] = entry
+            else:
+                groups[(old, new)][key] = entry
+        return plain, groups
+        
+    def _read_current(self, entries: Dict) -> Dict:
+        """一次查询读出更新对应文档当前的跟踪字段（按过滤条件中的定位字段匹配）"""
+        by_fields = defaultdict(dict)
+        for key, entry in entries.items():
+            fields = tuple(sorted(field for field in entry['filter']
+                                  if field not in self.watch_fields))
+            values = tuple(entry['filter'][field] for field in fields)
+            by_fields[fields].setdefault(values, []).append(key)
+        current = {}
+        for fields, lookup in by_fields.items():
+            if len(fields) == 1:
+                query = {fields[0]: {'$in': [values[0] for values in lookup]}}
+            else:
+                query = {'$or': [dict(zip(fields, values)) for values in lookup]}
+            projection = {field: 1 for field in fields + self.watch_fields}
+            for doc in self.collection.find(query, projection):
+                for key in lookup.get(tuple(doc.get(field) for field in fields), ()):
+                    current.setdefault(key, doc)
+        return current
+        
+    def _retry_unmatched(self, entries: Dict, transition: Tuple[Tuple, Tuple]):
+        """条件不匹配（其他进程先修改了文档）的更新放回缓冲区，按新的状态重试"""
+        new = transition[1]
+        current = self._read_current(entries)
+        retry = {key: entry for key, entry in entries.items()
+                 if key in current
+                 and tuple(current[key].get(field) for field in self.watch_fields) != new}
+        if retry:
+            self.stats['retries'] += len(retry)
+            logging.info(f"{len(retry)} updates changed concurrently, retrying")
+            self._requeue(retry)
+            
+    def _requeue(self, pending: Dict):
+        """把写入失败的更新放回缓冲区（缓冲区中较新的更新优先）"""
+        with self._lock:
+            newer, self._pending = self._pending, pending
+            for key, entry in newer.items():
+                if key in self._pending:
+                    self._merge(self._pending[key], entry['$set'], entry['$inc'])
+                else:
+                    self._pending[key] = entry
+                    
+    def _run(self):
+        """后台写入循环"""
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Background flush error: {str(e)}")
+                
+    def close(self):
+        """停止后台线程并写入剩余更新"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+
 
 class SimulationDB:
-    def __init__(self, db_url='mongodb://localhost:27017/'):
+    def __init__(self, db_url=DEFAULT_DB_URL, db_name=DEFAULT_DB_NAME):
         """初始化数据库连接"""
+        start = perf_counter()
         self.client = MongoClient(db_url)
-        self.db = self.client['brain_simulation']
+        self.db = self.client[db_name]
         self.alphas = self.db['alphas']
+        self.meta = self.db['meta']
+        self.workers = self.db['workers']
+        self.stats = self.db['stats']
+        self.account_alphas = self.db['account_alphas']
+        self.settings_profiles = self.db['settings_profiles']
+        self.writer = BulkWriter(self.alphas, watch_fields=('status', 'batch_id'),
+                                 on_change=self._count_transitions)
+        self._hash_filter = None
+        self._hash_filter_lock = Lock()
+        # 已写入 settings_profiles 的设置：profile_id -> SettingsProfile
+        self._profiles = {}
+        startup_timings['connect'] = perf_counter() - start
+        
+        start = perf_counter()
         self._init_db()
+        startup_timings['init_db'] = perf_counter() - start
+        logging.info(f"SimulationDB ready: {startup_timings}")
     
     def _init_db(self):
-        """初始化数据库索引"""
+        """初始化数据库索引（每个部署只在索引版本变化时执行一次）"""
+        schema = self.meta.find_one({'_id': 'schema'})
+        if schema and schema.get('version', 0) >= SCHEMA_VERSION:
+            return
+        self._create_indexes()
+        self.meta.update_one(
+            {'_id': 'schema'},
+            {'$set': {'version': SCHEMA_VERSION, 'updated_at': datetime.now()}},
+            upsert=True
+        )
+        logging.info(f"Created indexes for schema version {SCHEMA_VERSION}")
+        if self.stats.find_one({'_id': GLOBAL_STATS_ID}) is None:
+            # 升级前的部署还没有统计计数
+            self.reconcile_statistics()
+        if self.alphas.find_one({'settings': {'$exists': True}}, {'_id': 1}) is not None:
+            # 升级前的记录内嵌完整的 settings
+            self.migrate_settings_profiles()
+        # 升级前未通过本地检查的记录没有标记为永久失败
+        result = self.alphas.update_many({'invalid': True, 'permanent': {'$ne': True}},
+                                         {'$set': {'permanent': True}})
+        if result.modified_count:
+            logging.info(f"Marked {result.modified_count} invalid alphas as permanent failures")
+        
+    def _create_indexes(self):
+        """创建索引"""
+        # 同一表达式可以用不同设置模拟，唯一性改由 sim_hash 保证
+        regular_index = self.alphas.index_information().get('regular_1')
+        if regular_index and regular_index.get('unique'):
+            self.alphas.drop_index('regular_1')
+            
         # 创建索引
-        self.alphas.create_index([('regular', ASCENDING)], unique=True)
+        self.alphas.create_index([('regular', ASCENDING)])
+        self.alphas.create_index(
+            [('sim_hash', ASCENDING)],
+            unique=True,
+            partialFilterExpression={'sim_hash': {'$exists': True}}
+        )
         self.alphas.create_index([('status', ASCENDING)])
+        # 按状态分页读取任务队列
+        self.alphas.create_index([('status', ASCENDING), ('_id', ASCENDING)])
+        # 按优先级领取任务，以及按活动(campaign)分别取优先级最高的
+        self.alphas.create_index([('status', ASCENDING), ('priority', DESCENDING),
+                                  ('_id', ASCENDING)])
+        self.alphas.create_index([('status', ASCENDING), ('campaign', ASCENDING),
+                                  ('priority', DESCENDING), ('_id', ASCENDING)])
+        # 多进程领取任务：按领取批次读回、按领取者续约、回收过期租约
+        self.alphas.create_index([('claim_id', ASCENDING)], sparse=True)
+        self.alphas.create_index([('owner', ASCENDING), ('status', ASCENDING)])
+        self.alphas.create_index([('status', ASCENDING), ('lease_expires', ASCENDING)])
         self.alphas.create_index([('batch_id', ASCENDING)])
         self.alphas.create_index([('created_at', ASCENDING)])
+        # 按设置查询
+        self.alphas.create_index([('settings_id', ASCENDING), ('status', ASCENDING)])
+        # 按alpha_id记录提交结果、挑选提交候选
+        self.alphas.create_index([('alpha_id', ASCENDING)], sparse=True)
+        self.alphas.create_index([('status', ASCENDING), ('submission_status', ASCENDING)])
+        # 账户alpha：按指标排序、按修改时间增量同步
+        for metric in ('sharpe', 'fitness'):
+            self.account_alphas.create_index([(metric, DESCENDING)])
+        self.account_alphas.create_index([('turnover', ASCENDING)])
+        self.account_alphas.create_index([('status', ASCENDING), ('sharpe', DESCENDING)])
+        self.account_alphas.create_index([('date_modified', ASCENDING)])
+        
+    @DB_OPERATION_SECONDS.time(operation='add_batch')
+    def add_batch(self, alpha_list: List[Dict], batch_id: str,
+                  campaign: Optional[str] = None) -> int:
+        """
+        批量添加Alpha任务
         
-    def add_batch(self, alpha_list: List[Dict], batch_id: str) -> int:
-        """批量添加Alpha任务"""
+        settings 保存在 settings_profiles 集合中，记录只保存其 settings_id
+        
+        Args:
+            alpha_list: Alpha配置列表，可带 priority、campaign、datasets
+            batch_id: 批次ID
+            campaign: alpha没有指定 campaign 时所属的活动，默认为 batch_id
+            
+        Returns:
+            int: 新增的数量
+        """
         now = datetime.now()
         documents = []
         
         for alpha in alpha_list:
+            profile = intern_settings(alpha['settings'])
+            if profile.profile_id not in self._profiles:
+                self._save_profile(profile)
             doc = {
                 'type': alpha['type'],
-                'settings': alpha['settings'],
+                'settings_id': profile.profile_id,
                 'regular': alpha['regular'],
+                'sim_hash': get_simulation_hash(alpha),
                 'status': 'pending',
                 'attempt_count': 0,
                 'batch_id': batch_id,
+                'priority': float(alpha.get('priority') or 0),
+                'campaign': alpha.get('campaign') or campaign or batch_id,
                 'created_at': now,
                 'updated_at': now
             }
+            if 'datasets' in alpha:
+                doc['datasets'] = alpha['datasets']
             documents.append(doc)
             
+        if self._hash_filter is not None:
+            self._hash_filter.update(doc['sim_hash'] for doc in documents)
+            
         try:
             result = self.alphas.insert_many(documents, ordered=False)
-            return len(result.inserted_ids)
+            inserted = len(result.inserted_ids)
+        except BulkWriteError as e:
+            # 已存在的(表达式, 设置)组合被唯一索引跳过
+            duplicates = sum(1 for err in e.details['writeErrors'] if err['code'] == 11000)
+            logging.info(f"Batch insert skipped {duplicates} existing alphas")
+            inserted = e.details['nInserted']
         except Exception as e:
             logging.error(f"Batch insert error: {str(e)}")
             return 0
+        self._inc_statistics({(batch_id, 'pending'): inserted})
+        return inserted
+            
+    def _save_profile(self, profile: SettingsProfile):
+        """把设置写入 settings_profiles（已存在时不修改）"""
+        self.settings_profiles.update_one(
+            {'_id': profile.profile_id},
+            {'$setOnInsert': {'settings': dict(profile), 'created_at': datetime.now()}},
+            upsert=True
+        )
+        self._profiles[profile.profile_id] = profile
+        
+    def get_profile(self, profile_id: str) -> Optional[SettingsProfile]:
+        """按 settings_id 读取设置（进程内缓存，不存在时为None）"""
+        profile = self._profiles.get(profile_id)
+        if profile is None:
+            doc = self.settings_profiles.find_one({'_id': profile_id})
+            if doc is None:
+                return None
+            profile = self._profiles[profile_id] = intern_settings(doc['settings'])
+        return profile
+        
+    def _expand_settings(self, docs: List[Dict]) -> List[Dict]:
+        """把记录中的 settings_id 换成共享的 SettingsProfile（就地修改）"""
+        missing = {doc['settings_id'] for doc in docs
+                   if 'settings_id' in doc and doc['settings_id'] not in self._profiles}
+        if missing:
+            for row in self.settings_profiles.find({'_id': {'$in': list(missing)}}):
+                self._profiles[row['_id']] = intern_settings(row['settings'])
+        for doc in docs:
+            if 'settings_id' in doc:
+                profile_id = doc.pop('settings_id')
+                profile = self._profiles.get(profile_id)
+                if profile is None:
+                    logging.error(f"Settings profile {profile_id} not found")
+                else:
+                    doc['settings'] = profile
+            elif 'settings' in doc:
+                doc['settings'] = intern_settings(doc['settings'])
+        return docs
+        
+    def get_settings_profiles(self) -> List[Dict]:
+        """列出全部设置（_id 为 settings_id）"""
+        return list(self.settings_profiles.find({}, sort=[('created_at', ASCENDING)]))
+        
+    @DB_OPERATION_SECONDS.time(operation='profile_statistics')
+    def profile_statistics(self) -> Dict[str, Dict]:
+        """
+        按设置统计各状态的记录数
+        
+        Returns:
+            dict: settings_id 到 {'settings': 设置, 状态: 数量} 的映射
+        """
+        self.flush()
+        result = {}
+        for row in self.alphas.aggregate([
+            {'$group': {'_id': {'settings_id': '$settings_id', 'status': '$status'},
+                        'count': {'$sum': 1}}}
+        ]):
+            profile_id = row['_id'].get('settings_id')
+            if profile_id is None:
+                continue
+            entry = result.setdefault(profile_id, {'settings': self.get_profile(profile_id)})
+            entry[row['_id'].get('status')] = row['count']
+        return result
+        
+    def migrate_settings_profiles(self, batch_size: int = 1000) -> int:
+        """
+        把旧记录中内嵌的 settings 换成 settings_id
+        
+        Returns:
+            int: 迁移的记录数
+        """
+        start = perf_counter()
+        migrated = 0
+        docs = self._iter_pages({'settings': {'$exists': True}}, {'settings': 1}, batch_size,
+                                expand=False)
+        while True:
+            batch = list(islice(docs, batch_size))
+            if not batch:
+                break
+            ops = []
+            for doc in batch:
+                profile = intern_settings(doc['settings'])
+                if profile.profile_id not in self._profiles:
+                    self._save_profile(profile)
+                ops.append(UpdateOne({'_id': doc['_id']},
+                                     {'$set': {'settings_id': profile.profile_id},
+                                      '$unset': {'settings': ''}}))
+            migrated += self.alphas.bulk_write(ops, ordered=False).modified_count
+        logging.info(f"Moved settings of {migrated} alphas to {len(self._profiles)} profiles "
+                     f"in {perf_counter() - start:.1f}s")
+        return migrated
+        
+    def backfill_sim_hashes(self) -> int:
+        """
+        为旧记录补充 sim_hash
+        
+        Returns:
+            int: 补充的记录数
+        """
+        cursor = self._iter_pages({'sim_hash': {'$exists': False}}, ALPHA_FIELDS, 1000)
+        ops = []
+        updated = 0
+        for doc in cursor:
+            ops.append(UpdateOne({'_id': doc['_id']},
+                                 {'$set': {'sim_hash': get_simulation_hash(doc)}}))
+            if len(ops) >= 1000:
+                updated += self._bulk_backfill(ops)
+                ops = []
+        if ops:
+            updated += self._bulk_backfill(ops)
+        logging.info(f"Backfilled sim_hash for {updated} alphas")
+        return updated
+        
+    def _bulk_backfill(self, ops: List[UpdateOne]) -> int:
+        try:
+            return self.alphas.bulk_write(ops, ordered=False).modified_count
+        except BulkWriteError as e:
+            # 旧数据中重复的组合保留第一条
+            logging.error(f"Backfill found {len(e.details['writeErrors'])} duplicate alphas")
+            return e.details['nModified']
+            
+    def get_hash_filter(self) -> BloomFilter:
+        """
+        获取包含库中全部 sim_hash 的布隆过滤器（首次调用时从数据库流式加载）
+        """
+        with self._hash_filter_lock:
+            if self._hash_filter is None:
+                capacity = max(self.alphas.estimated_document_count() * 2, 1000000)
+                hash_filter = BloomFilter(capacity)
+                cursor = self.alphas.find(
+                    {'sim_hash': {'$exists': True}},
+                    {'sim_hash': 1, '_id': 0},
+                    batch_size=10000
+                )
+                hash_filter.update(doc['sim_hash'] for doc in cursor)
+                self._hash_filter = hash_filter
+            return self._hash_filter
+            
+    def is_known(self, sim_hash: str) -> bool:
+        """sim_hash 是否可能已在库中（False 表示一定不在）"""
+        return sim_hash in self.get_hash_filter()
+        
+    def iter_uncached(self, alphas: Iterable[Dict], chunk_size: int = 1000,
+                      on_cached: Optional[Callable[[Dict], None]] = None) -> Iterator[Dict]:
+        """
+        逐块过滤掉已经模拟过或正在模拟的(表达式, 设置)组合
+        
+        先用布隆过滤器排除一定没有模拟过的候选，剩下的按块批量查询确认，
+        内存中只保留当前块。重复组合只在块内去除，跨块的重复由 add_batch 的
+        sim_hash 唯一索引和 claim_alphas 只领取 pending 记录保证只模拟一次
+        
+        Args:
+            alphas: Alpha配置的列表或迭代器
+            chunk_size: 每次查询的alpha数量
+            on_cached: 每条已有结果的记录调用一次
+            
+        Yields:
+            dict: 需要模拟的Alpha配置
+        """
+        self.flush()
+        hash_filter = self.get_hash_filter()
+        alphas = iter(alphas)
+        while True:
+            chunk = list(islice(alphas, chunk_size))
+            if not chunk:
+                return
+            hashes = [get_simulation_hash(alpha) for alpha in chunk]
+            candidates = list({h for h in hashes if h in hash_filter})
+            
+            done = {}
+            if candidates:
+                cursor = self.alphas.find(
+                    {
+                        'sim_hash': {'$in': candidates},
+                        'status': {'$in': ['success', 'simulating']}
+                    },
+                    {'sim_hash': 1, 'regular': 1, 'status': 1, 'alpha_id': 1, 'is_metrics': 1}
+                )
+                for doc in cursor:
+                    done[doc['sim_hash']] = doc
+            if on_cached is not None:
+                for doc in done.values():
+                    on_cached(doc)
+                
+            seen = set()
+            for alpha, sim_hash in zip(chunk, hashes):
+                if sim_hash not in done and sim_hash not in seen:
+                    yield alpha
+                seen.add(sim_hash)
+                
+    def find_cached(self, alpha_list: List[Dict], chunk_size: int = 1000):
+        """
+        找出已经模拟过或正在模拟的(表达式, 设置)组合
+        
+        Args:
+            alpha_list: Alpha配置列表
+            chunk_size: 每次查询的哈希数量
+            
+        Returns:
+            tuple: (需要模拟的Alpha配置列表, 已有结果的记录列表)
+        """
+        cached = []
+        to_run = list(self.iter_uncached(alpha_list, chunk_size, cached.append))
+        return to_run, cached
             
     def update_status(self, regular: str, status: str, 
                      alpha_id: Optional[str] = None,
-                     error_message: Optional[str] = None):
-        """更新Alpha状态"""
+                     error_message: Optional[str] = None,
+                     fields: Optional[Dict] = None,
+                     sim_hash: Optional[str] = None):
+        """更新Alpha状态（有 sim_hash 时按 sim_hash 定位，否则按表达式）"""
         update = {
             '$set': {
                 'status': status,
@@ -73,14 +666,109 @@ class SimulationDB:
             update['$set']['alpha_id'] = alpha_id
         if error_message:
             update['$set']['error_message'] = error_message
+        if fields:
+            update['$set'].update(fields)
             
-        self.alphas.update_one(
-            {'regular': regular},
-            update
+        # 经缓冲写入器批量写入，不阻塞调用线程
+        self.writer.update(
+            {'sim_hash': sim_hash} if sim_hash else {'regular': regular},
+            update['$set'],
+            update['$inc']
         )
+        
+    def mark_invalid(self, sim_hash: str, errors: List[str]):
+        """把未通过本地检查的pending记录标记为永久失败（重新运行failed时也不会提交）"""
+        self.writer.update(
+            {'sim_hash': sim_hash, 'status': 'pending'},
+            {'status': 'failed', 'error_message': '; '.join(errors),
+             'invalid': True, 'permanent': True, 'updated_at': datetime.now()}
+        )
+        
+    def flush(self):
+        """写入缓冲区中的状态更新"""
+        self.writer.flush()
+        
+    def _count_transitions(self, changes: Dict[Tuple[Tuple, Tuple], int]):
+        """按写入器报告的实际状态变化更新统计计数"""
+        deltas = Counter()
+        for ((old_status, old_batch), (status, new_batch)), count in changes.items():
+            deltas[(old_batch, old_status or 'pending')] -= count
+            deltas[(new_batch, status or 'pending')] += count
+        self._inc_statistics(deltas)
+        
+    def _inc_statistics(self, deltas: Dict[Tuple[Optional[str], str], int]):
+        """
+        用 $inc 原子地更新批次和全局统计计数
+        
+        Args:
+            deltas: (批次ID, 状态) -> 数量变化
+        """
+        counters = defaultdict(Counter)
+        for (batch_id, status), count in deltas.items():
+            if not count:
+                continue
+            for key in (GLOBAL_STATS_ID, (batch_id,)):
+                counters[key][status] += count
+                counters[key]['total'] += count
+        ops = []
+        for key, counter in counters.items():
+            inc = {field: count for field, count in counter.items() if count}
+            if inc:
+                stats_id = key if key == GLOBAL_STATS_ID else {'batch_id': key[0]}
+                ops.append(UpdateOne({'_id': stats_id}, {'$inc': inc}, upsert=True))
+        if not ops:
+            return
+        try:
+            self.stats.bulk_write(ops, ordered=False)
+        except PyMongoError as e:
+            logging.error(f"Statistics update failed, run reconcile_statistics(): {str(e)}")
+            
+    @DB_OPERATION_SECONDS.time(operation='reconcile_statistics')
+    def reconcile_statistics(self) -> Dict:
+        """
+        用一次全表聚合重建统计计数
+        
+        计数在每次状态变化时按修改前的文档增量维护；统计写入失败等情况下
+        可能出现偏差，可以定期或在怀疑计数不准时调用。
+        重建期间其他进程的更新可能丢失，最好在没有任务运行时执行
+        
+        Returns:
+            dict: 重建后的全局统计
+        """
+        self.flush()
+        pipeline = [{
+            '$group': {
+                '_id': {'batch': '$batch_id', 'status': '$status'},
+                'count': {'$sum': 1}
+            }
+        }]
+        docs = {GLOBAL_STATS_ID: {'_id': GLOBAL_STATS_ID, **_empty_statistics()}}
+        for result in self.alphas.aggregate(pipeline):
+            batch_id = result['_id'].get('batch')
+            status = result['_id'].get('status') or 'pending'  # 处理 None 值
+            for key in (GLOBAL_STATS_ID, (batch_id,)):
+                doc = docs.get(key)
+                if doc is None:
+                    doc = docs[key] = {'_id': {'batch_id': batch_id}, **_empty_statistics()}
+                doc[status] = doc.get(status, 0) + result['count']
+                doc['total'] += result['count']
+                
+        self.stats.bulk_write(
+            [ReplaceOne({'_id': doc['_id']}, doc, upsert=True) for doc in docs.values()],
+            ordered=False
+        )
+        self.stats.delete_many({'_id': {'$nin': [doc['_id'] for doc in docs.values()]}})
+        logging.info(f"Reconciled statistics for {len(docs) - 1} batches")
+        return _as_statistics(docs[GLOBAL_STATS_ID])
 
+    @DB_OPERATION_SECONDS.time(operation='clean_pending_batches')
     def clean_pending_batches(self):
         """清理所有pending状态alpha的batch_id"""
+        self.flush()
+        moved = list(self.alphas.aggregate([
+            {'$match': {'status': 'pending', 'batch_id': {'$ne': None}}},
+            {'$group': {'_id': '$batch_id', 'count': {'$sum': 1}}}
+        ]))
         result = self.alphas.update_many(
             {'status': 'pending'},
             {
@@ -91,89 +779,568 @@ class SimulationDB:
                 }
             }
         )
+        deltas = Counter()
+        for batch in moved:
+            deltas[(batch['_id'], 'pending')] -= batch['count']
+            deltas[(None, 'pending')] += batch['count']
+        self._inc_statistics(deltas)
         logging.info(f"Cleaned batch_id for {result.modified_count} pending alphas")
         return result.modified_count
         
     def get_alphas_by_status(self, status: str = 'pending') -> List[Dict]:
-        """获取指定状态的Alpha"""
-        return list(self.alphas.find(
+        """获取指定状态的Alpha（按优先级从高到低，相同优先级按创建时间）"""
+        self.flush()
+        return self._expand_settings(list(self.alphas.find(
             {
                 'status': status,
                 'batch_id': None  # 只获取未分配批次的
             },
-            sort=[('created_at', 1)]
-        ))
+            sort=[('priority', DESCENDING), ('created_at', ASCENDING)]
+        )))
         
-    def get_statistics(self, batch_id: Optional[str] = None) -> Dict:
-        """获取统计信息"""
-        match = {'batch_id': batch_id} if batch_id else {}
+    def count_alphas_by_status(self, status: str = 'pending') -> int:
+        """统计指定状态的Alpha数量"""
+        self.flush()
+        return self.alphas.count_documents({'status': status})
+        
+    def iter_alphas_by_status(self, status: str = 'pending',
+                              page_size: int = 1000) -> Iterator[Dict]:
+        """
+        按创建顺序逐页读取指定状态的Alpha
+        
+        每页是一次按 _id 续读的短查询，不会长时间占用游标，
+        内存中最多只保留一页
+        
+        Args:
+            status: Alpha状态
+            page_size: 每页数量
+            
+        Yields:
+            dict: Alpha配置（type、settings、regular）
+        """
+        self.flush()
+        yield from self._iter_pages({'status': status}, ALPHA_FIELDS, page_size, keep_id=False)
+                
+    @DB_OPERATION_SECONDS.time(operation='claim_alphas')
+    def claim_alphas(self, owner: str, statuses: Iterable[str] = ('pending',),
+                     limit: int = 100, lease_seconds: float = 300,
+                     batch_id: Optional[str] = None,
+                     sim_hashes: Optional[List[str]] = None,
+                     fair_share: float = DEFAULT_FAIR_SHARE) -> List[Dict]:
+        """
+        原子地领取一批Alpha
+        
+        先读出一页候选，再用带状态条件的 update_many 打上本次领取的
+        claim_id，最后按 claim_id 读回真正抢到的记录。多个进程同时领取
+        同一页时，每条记录只会被其中一个修改
         
-        pipeline = [
-            {'$match': match},
+        候选按优先级从高到低选取；从整个队列领取时，limit * fair_share 个名额
+        按活动(campaign)轮流分配，大批量的活动不会完全挡住其他活动
+        
+        Args:
+            owner: 领取者ID
+            statuses: 可领取的状态
+            limit: 最多领取数量
+            lease_seconds: 租约时长(秒)，过期未续约的记录会被回收
+            batch_id: 领取的记录所属批次
+            sim_hashes: 只在这些模拟配置哈希中领取
+            fair_share: 按活动轮流分配的名额比例，0 表示只按优先级
+            
+        Returns:
+            list: 领取到的Alpha配置（type、settings、regular），按优先级从高到低
+        """
+        self.flush()
+        statuses = list(statuses)
+        # 永久失败的记录不再领取
+        query = {'status': {'$in': statuses}, 'permanent': {'$ne': True}}
+        if sim_hashes is not None:
+            query['sim_hash'] = {'$in': sim_hashes}
+        candidates = {doc['_id']: doc for doc in self._claim_candidates(
+            query, limit, fair_share if sim_hashes is None else 0
+        )}
+        if not candidates:
+            return []
+            
+        claim_id = uuid4().hex
+        now = datetime.now()
+        self.alphas.update_many(
+            {'_id': {'$in': list(candidates)}, 'status': {'$in': statuses},
+             'permanent': {'$ne': True}},
             {
-                '$group': {
-                    '_id': {
-                        'batch': '$batch_id',
-                        'status': '$status'
-                    },
-                    'count': {'$sum': 1}
+                '$set': {
+                    'status': 'claimed',
+                    'owner': owner,
+                    'claim_id': claim_id,
+                    'lease_expires': now + timedelta(seconds=lease_seconds),
+                    'batch_id': batch_id,
+                    'updated_at': now
                 }
-            },
+            }
+        )
+        claimed = self._expand_settings(list(self.alphas.find(
+            {'claim_id': claim_id},
+            ALPHA_FIELDS,
+            sort=[('priority', DESCENDING), ('_id', ASCENDING)]
+        )))
+        deltas = Counter()
+        for doc in claimed:
+            old = candidates[doc.pop('_id')]
+            deltas[(old.get('batch_id'), old.get('status') or 'pending')] -= 1
+            deltas[(batch_id, 'claimed')] += 1
+        self._inc_statistics(deltas)
+        return claimed
+        
+    def _claim_candidates(self, query: Dict, limit: int, fair_share: float) -> List[Dict]:
+        """
+        按优先级和公平份额选出领取候选
+        
+        候选池为全局优先级最高的 limit 个，加上每个活动优先级最高的若干个
+        （活动很多时每次随机抽取 limit 个活动），再用 fair_select 选出。
+        query 必须包含 status 条件
+        """
+        projection = {'status': 1, 'batch_id': 1, 'priority': 1, 'campaign': 1}
+        order = [('priority', DESCENDING), ('_id', ASCENDING)]
+        pool = list(self.alphas.find(query, projection, sort=order, limit=limit))
+        reserved = int(limit * fair_share)
+        if not pool or not reserved:
+            return pool
+        # 只按状态取活动列表，可以直接由 (status, campaign, ...) 索引回答而不读取文档；
+        # permanent 等其他条件在下面按活动的查询中过滤
+        campaigns = self.alphas.distinct('campaign', {'status': query['status']})
+        if len(campaigns) <= 1:
+            return pool
+        if len(campaigns) > limit:
+            campaigns = random.sample(campaigns, limit)
+        per_campaign = max(1, -(-reserved // len(campaigns)))
+        seen = {doc['_id'] for doc in pool}
+        for campaign in campaigns:
+            for doc in self.alphas.find({**query, 'campaign': campaign}, projection,
+                                        sort=order, limit=per_campaign):
+                if doc['_id'] not in seen:
+                    seen.add(doc['_id'])
+                    pool.append(doc)
+        return fair_select(pool, limit, fair_share)
+        
+    def set_priorities(self, priorities: Dict[str, float],
+                       datasets: Optional[Dict[str, List[str]]] = None) -> int:
+        """
+        修改队列中记录的优先级
+        
+        Args:
+            priorities: sim_hash 到优先级的映射
+            datasets: sim_hash 到数据集ID列表的映射（同时写入）
+            
+        Returns:
+            int: 修改的数量
+        """
+        if not priorities:
+            return 0
+        self.flush()
+        now = datetime.now()
+        ops = []
+        for sim_hash, priority in priorities.items():
+            fields = {'priority': float(priority), 'updated_at': now}
+            if datasets and sim_hash in datasets:
+                fields['datasets'] = datasets[sim_hash]
+            ops.append(UpdateOne({'sim_hash': sim_hash}, {'$set': fields}))
+        return self.alphas.bulk_write(ops, ordered=False).modified_count
+        
+    def iter_reprioritizable_alphas(self, page_size: int = 1000) -> Iterator[Dict]:
+        """
+        逐页读取优先级可以按命中率重新计算的pending记录
+        
+        即没有设置优先级、或优先级来自数据集命中率（带有 datasets 字段）的记录
+        
+        Yields:
+            dict: Alpha配置（type、settings、regular、sim_hash）
+        """
+        self.flush()
+        query = {'status': 'pending',
+                 '$or': [{'priority': {'$in': [0, None]}}, {'datasets': {'$exists': True}}]}
+        yield from self._iter_pages(query, {**ALPHA_FIELDS, 'sim_hash': 1}, page_size,
+                                    keep_id=False)
+        
+    def iter_untagged_alphas(self, page_size: int = 1000) -> Iterator[Dict]:
+        """
+        逐页读取已完成但没有 datasets 字段的记录
+        
+        Yields:
+            dict: 记录的 _id、settings、regular
+        """
+        self.flush()
+        query = {'status': {'$in': ['success', 'failed']}, 'datasets': {'$exists': False}}
+        yield from self._iter_pages(query, {'settings': 1, 'settings_id': 1, 'regular': 1},
+                                    page_size)
+        
+    def _iter_pages(self, query: Dict, projection: Dict, page_size: int,
+                    keep_id: bool = True, expand: bool = True) -> Iterator[Dict]:
+        """按 _id 续读的短查询逐页读取（expand 时把 settings_id 换成设置）"""
+        last_id = None
+        while True:
+            page_query = dict(query)
+            if last_id is not None:
+                page_query['_id'] = {'$gt': last_id}
+            page = list(self.alphas.find(page_query, projection,
+                                         sort=[('_id', ASCENDING)], limit=page_size))
+            if not page:
+                return
+            last_id = page[-1]['_id']
+            if expand:
+                self._expand_settings(page)
+            for doc in page:
+                if not keep_id:
+                    del doc['_id']
+                yield doc
+                
+    def set_alpha_datasets(self, datasets: Dict) -> int:
+        """
+        写入记录引用的数据集
+        
+        Args:
+            datasets: 记录 _id 到数据集ID列表的映射
+            
+        Returns:
+            int: 修改的数量
+        """
+        if not datasets:
+            return 0
+        ops = [UpdateOne({'_id': doc_id}, {'$set': {'datasets': value}})
+               for doc_id, value in datasets.items()]
+        return self.alphas.bulk_write(ops, ordered=False).modified_count
+        
+    @DB_OPERATION_SECONDS.time(operation='dataset_hit_counts')
+    def dataset_hit_counts(self, min_sharpe: float) -> Tuple[Dict[str, Tuple[int, int]],
+                                                             Tuple[int, int]]:
+        """
+        按数据集统计已完成的模拟数和命中数（IS sharpe 不低于 min_sharpe）
+        
+        未通过本地检查的记录不计入
+        
+        Args:
+            min_sharpe: 视为命中的sharpe下限
+            
+        Returns:
+            tuple: (数据集ID到(命中数, 模拟数)的映射, 全部记录的(命中数, 模拟数))
+        """
+        self.flush()
+        match = {'status': {'$in': ['success', 'failed']}, 'invalid': {'$ne': True}}
+        hit = {'$cond': [{'$gte': ['$is_metrics.sharpe', min_sharpe]}, 1, 0]}
+        counts = {}
+        for row in self.alphas.aggregate([
+            {'$match': {**match, 'datasets': {'$exists': True}}},
+            {'$project': {'datasets': 1, 'hit': hit}},
+            {'$unwind': '$datasets'},
+            {'$group': {'_id': '$datasets', 'hits': {'$sum': '$hit'}, 'total': {'$sum': 1}}}
+        ]):
+            counts[row['_id']] = (row['hits'], row['total'])
+        total = self.alphas.count_documents(match)
+        hits = self.alphas.count_documents({**match, 'is_metrics.sharpe': {'$gte': min_sharpe}})
+        return counts, (hits, total)
+        
+    @DB_OPERATION_SECONDS.time(operation='confirm_claims')
+    def confirm_claims(self, owner: str, sim_hashes: List[str],
+                       lease_seconds: float = 300) -> set:
+        """
+        提交前确认领取仍然有效并续约
+        
+        Args:
+            owner: 领取者ID
+            sim_hashes: 模拟配置哈希列表
+            lease_seconds: 租约时长(秒)
+            
+        Returns:
+            set: 仍由 owner 持有的 sim_hash
+        """
+        query = {'sim_hash': {'$in': sim_hashes}, 'owner': owner, 'status': 'claimed'}
+        result = self.alphas.update_many(
+            query,
+            {'$set': {'lease_expires': datetime.now() + timedelta(seconds=lease_seconds)}}
+        )
+        if result.matched_count == len(sim_hashes):
+            return set(sim_hashes)
+        return {doc['sim_hash'] for doc in self.alphas.find(query, {'sim_hash': 1})}
+        
+    def renew_leases(self, owner: str, lease_seconds: float = 300) -> int:
+        """为 owner 持有的全部记录续约，返回续约数量"""
+        result = self.alphas.update_many(
+            {'owner': owner, 'status': 'claimed'},
+            {'$set': {'lease_expires': datetime.now() + timedelta(seconds=lease_seconds)}}
+        )
+        return result.modified_count
+        
+    def release_claims(self, owner: str) -> int:
+        """把 owner 领取但尚未提交的记录放回队列，返回数量"""
+        self.flush()
+        return self._return_claims({'owner': owner, 'status': 'claimed'})
+        
+    def reap_expired_claims(self) -> int:
+        """把租约已过期（领取者已退出或失联）的记录放回队列，返回数量"""
+        count = self._return_claims({'status': 'claimed',
+                                     'lease_expires': {'$lt': datetime.now()}})
+        if count:
+            logging.info(f"Returned {count} alphas with expired leases to the queue")
+        return count
+        
+    @DB_OPERATION_SECONDS.time(operation='return_claims')
+    def _return_claims(self, query: Dict) -> int:
+        docs = {doc['_id']: doc.get('batch_id')
+                for doc in self.alphas.find(query, {'batch_id': 1})}
+        if not docs:
+            return 0
+        query = {**query, '_id': {'$in': list(docs)}}
+        result = self.alphas.update_many(
+            query,
             {
-                '$group': {
-                    '_id': '$_id.batch',
-                    'details': {
-                        '$push': {
-                            'status': '$_id.status',
-                            'count': '$count'
-                        }
-                    }
+                '$set': {
+                    'status': 'pending',
+                    'owner': None,
+                    'claim_id': None,
+                    'lease_expires': None,
+                    'batch_id': None,
+                    'updated_at': datetime.now()
                 }
             }
-        ]
+        )
+        if result.modified_count < len(docs):
+            # 读出后被续约或提交的记录没有放回
+            for doc in self.alphas.find({'_id': {'$in': list(docs)}, 'status': {'$ne': 'pending'}},
+                                        {'_id': 1}):
+                docs.pop(doc['_id'], None)
+        deltas = Counter()
+        for batch_id in docs.values():
+            deltas[(batch_id, 'claimed')] -= 1
+            deltas[(None, 'pending')] += 1
+        self._inc_statistics(deltas)
+        return result.modified_count
+        
+    def heartbeat(self, owner: str, info: Optional[Dict] = None):
+        """记录工作进程的心跳"""
+        now = datetime.now()
+        self.workers.update_one(
+            {'_id': owner},
+            {'$set': {**(info or {}), 'heartbeat_at': now},
+             '$setOnInsert': {'started_at': now}},
+            upsert=True
+        )
+        
+    def unregister_worker(self, owner: str):
+        """删除工作进程的心跳记录"""
+        self.workers.delete_one({'_id': owner})
+        
+    def iter_alpha_ids(self, status: str = 'success', page_size: int = 1000) -> Iterator[str]:
+        """
+        逐个产出指定状态的alpha_id
+        
+        按 _id 分页用短查询读取，调用方在两次读取之间可以花很长时间（如逐个下载PnL），
+        不会因为服务端游标闲置超时而中断
+        """
+        self.flush()
+        docs = self._iter_pages({'status': status, 'alpha_id': {'$ne': None}},
+                                {'alpha_id': 1}, page_size, expand=False)
+        for doc in docs:
+            yield doc['alpha_id']
+            
+    def iter_submission_candidates(self, batch_id: Optional[str] = None,
+                                   query: Optional[Dict] = None,
+                                   limit: Optional[int] = None,
+                                   page_size: int = 100) -> Iterator[str]:
+        """
+        按sharpe从高到低产出尚未提交的成功alpha的alpha_id
+        
+        按 (sharpe, _id) 续读的短查询逐页读取，每个提交可能要等待数分钟，
+        不保持长时间闲置的服务端游标
+        
+        Args:
+            batch_id: 只选该批次的alpha
+            query: 附加的查询条件，如 {'is_metrics.sharpe': {'$gte': 1.5}}
+            limit: 最多数量
+            page_size: 每次查询的数量
+        """
+        self.flush()
+        conditions = {'status': 'success', 'alpha_id': {'$ne': None},
+                      'submission_status': {'$nin': list(FINAL_SUBMISSION_STATUSES)}}
+        if batch_id is not None:
+            conditions['batch_id'] = batch_id
+        if query:
+            conditions = {'$and': [conditions, query]}
+        remaining = limit
+        last = None
+        while remaining is None or remaining > 0:
+            page_query = conditions
+            if last is not None:
+                # sharpe 降序时缺失值排在最后
+                sharpe, last_id = last
+                after = [{'is_metrics.sharpe': sharpe, '_id': {'$gt': last_id}}]
+                if sharpe is not None:
+                    after += [{'is_metrics.sharpe': {'$lt': sharpe}},
+                              {'is_metrics.sharpe': None}]
+                page_query = {'$and': [conditions, {'$or': after}]}
+            size = page_size if remaining is None else min(page_size, remaining)
+            page = list(self.alphas.find(
+                page_query,
+                {'alpha_id': 1, 'is_metrics.sharpe': 1},
+                sort=[('is_metrics.sharpe', DESCENDING), ('_id', ASCENDING)],
+                limit=size
+            ))
+            if not page:
+                return
+            last = ((page[-1].get('is_metrics') or {}).get('sharpe'), page[-1]['_id'])
+            if remaining is not None:
+                remaining -= len(page)
+            for doc in page:
+                yield doc['alpha_id']
+            
+    def update_submission(self, alpha_id: str, status: str, fields: Optional[Dict] = None):
+        """
+        记录提交结果
+        
+        Args:
+            alpha_id: Alpha ID
+            status: 'submitted'、'rejected'(检查未通过)、'correlated'(相关性过高未提交)或'failed'
+            fields: 附加字段（未通过的检查、错误信息等）
+        """
+        now = datetime.now()
+        update = {'submission_status': status, 'submission_updated_at': now}
+        if status == 'submitted':
+            update['submitted_at'] = now
+        update.update(fields or {})
+        self.writer.update({'alpha_id': alpha_id}, update, {'submission_attempts': 1})
+        
+    @DB_OPERATION_SECONDS.time(operation='upsert_account_alphas')
+    def upsert_account_alphas(self, docs: List[Dict]) -> int:
+        """按 _id(alpha_id) 批量写入账户alpha，返回写入数量"""
+        if not docs:
+            return 0
+        self.account_alphas.bulk_write(
+            [ReplaceOne({'_id': doc['_id']}, doc, upsert=True) for doc in docs],
+            ordered=False
+        )
+        return len(docs)
+        
+    def get_sync_state(self, name: str) -> Dict:
+        """读取同步任务的状态（水位线等），不存在时为空字典"""
+        return self.meta.find_one({'_id': name}) or {}
         
-        results = list(self.alphas.aggregate(pipeline))
+    def set_sync_state(self, name: str, state: Dict):
+        """保存同步任务的状态"""
+        self.meta.update_one({'_id': name}, {'$set': state}, upsert=True)
         
+    def rank_account_alphas(self, metric: str = 'sharpe', limit: int = 50,
+                            query: Optional[Dict] = None,
+                            ascending: bool = False) -> List[Dict]:
+        """
+        按指标排序读取账户alpha
+        
+        Args:
+            metric: 排序指标（sharpe、fitness、turnover等）
+            limit: 最多数量
+            query: 附加的查询条件，如 {'status': 'UNSUBMITTED'}
+            ascending: 是否从小到大排序（如turnover）
+        """
+        conditions = {metric: {'$ne': None}}
+        if query:
+            conditions = {'$and': [conditions, query]}
+        return list(self.account_alphas.find(
+            conditions,
+            sort=[(metric, ASCENDING if ascending else DESCENDING)],
+            limit=limit
+        ))
+        
+    def get_simulating_alphas(self) -> List[Dict]:
+        """获取已提交但尚未完成的模拟"""
+        self.flush()
+        return list(self.alphas.find(
+            {'status': 'simulating'},
+            {'regular': 1, 'sim_hash': 1, 'location': 1, 'multi_index': 1}
+        ))
+        
+    @DB_OPERATION_SECONDS.time(operation='get_statistics')
+    def get_statistics(self, batch_id: Optional[str] = None) -> Dict:
+        """
+        获取统计信息（读取增量维护的统计计数，不扫描记录）
+        
+        Args:
+            batch_id: 批次ID，为None时返回全部批次
+            
+        Returns:
+            dict: 单个批次的统计，或 批次ID -> 统计
+        """
+        self.flush()
         if batch_id:
             # 单个批次的统计
-            batch_stats = next((r for r in results if r['_id'] == batch_id), None)
-            if not batch_stats:
-                return {'total': 0, 'pending': 0, 'success': 0, 'failed': 0}
-                
-            stats = {'total': 0, 'pending': 0, 'success': 0, 'failed': 0}
-            for detail in batch_stats['details']:
-                status = detail['status'] or 'pending'  # 处理 None 值
-                count = detail['count']
-                stats[status] = count
-                stats['total'] += count
-            return stats
-        else:
-            # 所有批次的统计
-            all_stats = {}
-            for batch in results:
-                batch_id = batch['_id']
-                stats = {'total': 0, 'pending': 0, 'success': 0, 'failed': 0}
-                for detail in batch['details']:
-                    status = detail['status'] or 'pending'
-                    count = detail['count']
-                    stats[status] = count
-                    stats['total'] += count
-                all_stats[batch_id] = stats
-            return all_stats
-
-# 创建全局数据库实例
-db = SimulationDB()
+            return _as_statistics(self.stats.find_one({'_id': {'batch_id': batch_id}}))
+            
+        # 所有批次的统计
+        cursor = self.stats.find({'_id': {'$ne': GLOBAL_STATS_ID}, 'total': {'$gt': 0}})
+        return {doc['_id']['batch_id']: _as_statistics(doc) for doc in cursor}
+        
+    def get_total_statistics(self) -> Dict:
+        """获取全部记录的统计信息"""
+        self.flush()
+        return _as_statistics(self.stats.find_one({'_id': GLOBAL_STATS_ID}))
+
+def _empty_statistics() -> Dict:
+    return {'total': 0, **{status: 0 for status in STATUSES}}
+
+def _as_statistics(doc: Optional[Dict]) -> Dict:
+    """把统计文档转换为统计信息字典"""
+    stats = _empty_statistics()
+    for field in stats:
+        stats[field] = (doc or {}).get(field, 0)
+    return stats
+
+_db = None
+_db_lock = Lock()
+
+def get_db() -> SimulationDB:
+    """获取全局数据库实例（首次使用时才连接并检查索引）"""
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                configure_logging()
+                _db = SimulationDB()
+    return _db
+
+class _LazyDB:
+    """全局数据库实例的代理，访问属性时才创建 SimulationDB"""
+    def __getattr__(self, name):
+        return getattr(get_db(), name)
+
+# 全局数据库实例（惰性创建，导入模块时不连接MongoDB）
+db = _LazyDB()
 
 def save_simulation_record(alpha_id: Optional[str], datafield: str, 
-                         status: str, extra_info: Optional[Dict] = None):
-    """记录模拟结果"""
-    if status == 'success':
+                         status: str, extra_info: Optional[Dict] = None,
+                         sim_hash: Optional[str] = None):
+    """
+    记录模拟结果
+    
+    Args:
+        alpha_id: Alpha ID
+        datafield: Alpha表达式
+        status: 'simulating'(已提交，extra_info含location)、'success'(extra_info含IS指标)或'failed'
+                (extra_info含 permanent=True 时之后不再领取)
+        extra_info: 附加信息
+        sim_hash: 模拟配置哈希（用于定位记录）
+    """
+    if status == 'simulating':
+        logging.info(f"Simulation submitted - Expression: {datafield}")
+        db.update_status(datafield, 'simulating', fields=extra_info, sim_hash=sim_hash)
+    elif status == 'success':
         logging.info(f"Simulation success - Alpha ID: {alpha_id}, Expression: {datafield}")
-        db.update_status(datafield, 'success', alpha_id)
+        db.update_status(datafield, 'success', alpha_id, fields=extra_info, sim_hash=sim_hash)
     else:
         error_msg = str(extra_info) if extra_info else 'Unknown error'
         logging.error(f"Simulation failed - Expression: {datafield}, Error: {error_msg}")
-        db.update_status(datafield, 'failed', error_message=error_msg)
+        # 永久错误（如表达式不合法）重新提交也不会成功，之后不再领取
+        fields = {'permanent': True} if extra_info and extra_info.get('permanent') else None
+        db.update_status(datafield, 'failed', error_message=error_msg, fields=fields,
+                         sim_hash=sim_hash)
+
+def reconcile_statistics() -> Dict:
+    """从头重建统计计数，返回全局统计"""
+    return db.reconcile_statistics()
 
 def check_progress(batch_id: Optional[str] = None):
     """检查处理进度"""
@@ -185,6 +1352,8 @@ def check_progress(batch_id: Optional[str] = None):
         print(f"总任务数: {stats['total']}")
         print(f"已成功: {stats['success']}")
         print(f"已失败: {stats['failed']}")
+        print(f"已领取: {stats['claimed']}")
+        print(f"模拟中: {stats['simulating']}")
         print(f"待处理: {stats['pending']}")
         
         if stats['total'] > 0:
@@ -192,12 +1361,17 @@ def check_progress(batch_id: Optional[str] = None):
             print(f"成功率: {success_rate:.2f}%")
     else:
         # 所有批次的统计
+        total = db.get_total_statistics()
+        print(f"\n全部任务: {total['total']}, 已成功: {total['success']}, "
+              f"已失败: {total['failed']}, 待处理: {total['pending']}")
         print("\n所有批次的统计信息:")
         for batch_id, batch_stats in stats.items():
             print(f"\n批次 {batch_id}:")
             print(f"总任务数: {batch_stats['total']}")
             print(f"已成功: {batch_stats['success']}")
             print(f"已失败: {batch_stats['failed']}")
+            print(f"已领取: {batch_stats['claimed']}")
+            print(f"模拟中: {batch_stats['simulating']}")
             print(f"待处理: {batch_stats['pending']}")
             
             if batch_stats['total'] > 0:
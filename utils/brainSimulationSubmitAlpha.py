@@ -1,24 +1,234 @@
-def submit_alpha(alpha_id, session=None):
+"""
+WorldQuant Brain alpha 提交工具
+提交检查是异步的：POST 开始检查，之后 GET 按 Retry-After 轮询直到得到最终结果
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from time import monotonic, sleep
+from typing import Dict, Iterable, Optional
+
+from .brainLogin import API_URL
+from .brainMetrics import SUBMISSIONS, SUBMIT_SECONDS
+from .brainRateLimiter import parse_retry_after
+from .brainRetryPolicy import request_with_retry
+
+# 默认同时进行的提交数
+DEFAULT_SUBMIT_CONCURRENCY = 5
+
+# 等待单个提交检查完成的最长时间(秒)
+DEFAULT_SUBMIT_WAIT = 600
+
+# 服务器未给出Retry-After时的轮询间隔(秒)
+DEFAULT_POLL_INTERVAL = 5.0
+
+def _submission_result(alpha_id: str, response) -> Dict:
+    """把提交检查的最终响应转换为结果（200为已提交，403为检查未通过）"""
+    try:
+        body = response.json()
+    except ValueError:
+        body = {}
+    checks = (body.get('is') or {}).get('checks', []) if isinstance(body, dict) else []
+    failed = [check.get('name') for check in checks if check.get('result') == 'FAIL']
+    status = 'submitted' if response.status_code < 400 else 'rejected'
+    return {'alpha_id': alpha_id, 'status': status, 'failed_checks': failed, 'response': body}
+
+def submit_and_wait(session, alpha_id: str, max_wait: float = DEFAULT_SUBMIT_WAIT) -> Dict:
+    """
+    提交alpha并轮询到最终结果
+
+    限流、5xx等暂时错误按重试策略重试；已经提交过的alpha（POST返回403）直接读取结果
+
+    Args:
+        session: Brain会话对象
+        alpha_id: Alpha ID
+        max_wait: 等待检查完成的最长时间(秒)
+
+    Returns:
+        dict: alpha_id、status('submitted'、'rejected' 或超时/出错时的 'failed')、
+              failed_checks(未通过的检查)、response(最终响应内容)或 error
+    """
+    url = f"{API_URL}/alphas/{alpha_id}/submit"
+    action = f"Submit {alpha_id}"
+    start = monotonic()
+    try:
+        response = request_with_retry(session, 'POST', url, action, accept=(403,))
+        retry_after = (parse_retry_after(response, DEFAULT_POLL_INTERVAL)
+                       if response.status_code < 400 else 0)
+        while True:
+            if retry_after:
+                if monotonic() - start + retry_after > max_wait:
+                    result = {'alpha_id': alpha_id, 'status': 'failed',
+                              'error': f"Submission checks not finished after {max_wait}s"}
+                    break
+                sleep(retry_after)
+            response = request_with_retry(session, 'GET', url, action, accept=(403,))
+            retry_after = parse_retry_after(response, 0)
+            if response.status_code < 400 and retry_after:
+                continue
+            result = _submission_result(alpha_id, response)
+            break
+    except Exception as e:
+        result = {'alpha_id': alpha_id, 'status': 'failed', 'error': str(e)}
+    SUBMIT_SECONDS.observe(monotonic() - start)
+    SUBMISSIONS.inc(status=result['status'])
+    return result
+
+def _record_correlated(alpha_id: str, value: float, other: Optional[str],
+                       flush: bool = True) -> Dict:
+    """记录因相关性过高未提交的alpha"""
+    from .brainSimulationRecord import db
+
+    db.update_submission(alpha_id, 'correlated',
+                         {'max_correlation': value, 'correlated_with': other})
+    if flush:
+        db.flush()
+    return {'alpha_id': alpha_id, 'status': 'correlated',
+            'max_correlation': value, 'correlated_with': other}
+
+def submit_alpha(alpha_id, session=None, max_correlation=None, pnl_store=None,
+                 max_wait=DEFAULT_SUBMIT_WAIT):
     """
-    提交 Alpha 到 WorldQuant Brain
-    
+    提交 Alpha 到 WorldQuant Brain 并等待检查结果
+
     Args:
         alpha_id (str): Alpha 的 ID，例如 'o6mqEXn'
         session: 已登录的 session 对象
-        
+        max_correlation: 与已提交alpha的最大相关性上限，超过时不提交；None 表示不检查
+        pnl_store: 已提交alpha的PnL存储，默认使用全局存储；提交成功的alpha会加入其中
+        max_wait: 等待提交检查完成的最长时间(秒)
+
     Returns:
-        dict: API 响应的 JSON 数据
+        dict: 提交结果（见 submit_and_wait）；因相关性过高未提交时为
+              {'alpha_id': ..., 'status': 'correlated', 'max_correlation': ..., 'correlated_with': ...}，
+              并和 submit_alphas 一样写入 SimulationDB
     """
     # 如果没有提供 session，则自动获取
     if session is None:
-        from utils.brainLogin import get_session
+        from .brainLogin import get_session
         session = get_session()
-    
-    url = f"https://api.worldquantbrain.com/alphas/{alpha_id}/submit"
 
-    try:
-        response = session.get(url)
-        return response.json()
-    except Exception as e:
-        print(f"提交失败: {str(e)}")
-        return None
+    store = None
+    if max_correlation is not None:
+        from .brainPnLStore import get_pnl_store
+        store = pnl_store or get_pnl_store()
+        try:
+            value, other = store.max_correlation_for(session, [alpha_id])[alpha_id]
+        except Exception as e:
+            print(f"相关性检查失败: {str(e)}")
+            return None
+        if value > max_correlation:
+            print(f"未提交 {alpha_id}: 与 {other} 的相关性 {value:.3f} 超过 {max_correlation}")
+            return _record_correlated(alpha_id, value, other)
+
+    result = submit_and_wait(session, alpha_id, max_wait)
+    if result['status'] == 'failed':
+        print(f"提交失败: {result['error']}")
+    elif result['status'] == 'rejected':
+        print(f"未通过提交检查 {alpha_id}: {result['failed_checks']}")
+    elif store is not None:
+        store.fetch(session, alpha_id)
+    return result
+
+def _submit_candidate(session, alpha_id: str, max_correlation: Optional[float],
+                      store, max_wait: float) -> Dict:
+    """检查相关性、提交并记录结果"""
+    from .brainSimulationRecord import db
+
+    if store is not None:
+        try:
+            value, other = store.max_correlation_for(session, [alpha_id])[alpha_id]
+        except Exception as e:
+            result = {'alpha_id': alpha_id, 'status': 'failed',
+                      'error': f"Correlation check failed: {str(e)}"}
+            db.update_submission(alpha_id, 'failed', {'submission_error': result['error']})
+            return result
+        if value > max_correlation:
+            return _record_correlated(alpha_id, value, other, flush=False)
+
+    result = submit_and_wait(session, alpha_id, max_wait)
+    if result['status'] == 'failed':
+        db.update_submission(alpha_id, 'failed', {'submission_error': result['error']})
+        return result
+    db.update_submission(alpha_id, result['status'],
+                         {'submission_failed_checks': result['failed_checks']})
+    if result['status'] == 'submitted' and store is not None:
+        # 之后的候选也要和本次提交的alpha比较相关性
+        try:
+            store.fetch(session, alpha_id)
+        except Exception as e:
+            logging.error(f"PnL fetch failed for submitted alpha {alpha_id}: {str(e)}")
+    return result
+
+def submit_alphas(alpha_ids: Optional[Iterable[str]] = None, session=None,
+                  max_concurrency: int = DEFAULT_SUBMIT_CONCURRENCY,
+                  batch_id: Optional[str] = None, query: Optional[Dict] = None,
+                  limit: Optional[int] = None, max_correlation: Optional[float] = None,
+                  pnl_store=None, max_wait: float = DEFAULT_SUBMIT_WAIT) -> Dict:
+    """
+    批量提交alpha并把结果写回 SimulationDB
+
+    最多 max_concurrency 个提交同时进行（共享同一个会话），每个都轮询到最终结果。
+    同时在途的候选之间不比较相关性，只和开始提交前已存储的alpha比较
+
+    Args:
+        alpha_ids: Alpha ID列表，默认按sharpe从高到低选取库中尚未提交的成功alpha
+        session: 已登录的 session 对象，默认新建一个
+        max_concurrency: 同时进行的提交数
+        batch_id: 未给出 alpha_ids 时只选该批次
+        query: 未给出 alpha_ids 时附加的查询条件
+        limit: 最多提交数量
+        max_correlation: 与已提交alpha的最大相关性上限；None 表示不检查
+        pnl_store: 已提交alpha的PnL存储，默认使用全局存储
+        max_wait: 等待单个提交检查完成的最长时间(秒)
+
+    Returns:
+        dict: 各状态的数量，以及每个alpha的结果列表 results
+    """
+    from .brainSimulationRecord import db
+
+    if session is None:
+        from .brainLogin import get_session
+        session = get_session(pool_size=max_concurrency + 2)
+    store = None
+    if max_correlation is not None:
+        from .brainPnLStore import get_pnl_store
+        store = pnl_store or get_pnl_store()
+    if alpha_ids is None:
+        alpha_ids = db.iter_submission_candidates(batch_id, query, limit)
+    elif limit is not None:
+        alpha_ids = list(alpha_ids)[:limit]
+
+    summary = {'submitted': 0, 'rejected': 0, 'correlated': 0, 'failed': 0, 'results': []}
+    alpha_ids = iter(alpha_ids)
+    start = monotonic()
+    with ThreadPoolExecutor(max_workers=max_concurrency,
+                            thread_name_prefix='brain-submit') as executor:
+        in_flight = {}
+        while True:
+            for alpha_id in alpha_ids:
+                future = executor.submit(_submit_candidate, session, alpha_id,
+                                         max_correlation, store, max_wait)
+                in_flight[future] = alpha_id
+                if len(in_flight) >= max_concurrency:
+                    break
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                alpha_id = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # 单个alpha的意外错误不影响其他提交
+                    logging.error(f"Submission {alpha_id} failed: {str(e)}")
+                    result = {'alpha_id': alpha_id, 'status': 'failed', 'error': str(e)}
+                    db.update_submission(alpha_id, 'failed', {'submission_error': result['error']})
+                summary[result['status']] += 1
+                summary['results'].append(result)
+                logging.info(f"Submission {result['alpha_id']}: {result['status']}")
+    db.flush()
+
+    logging.info(f"Submitted {summary['submitted']}, rejected {summary['rejected']}, "
+                 f"correlated {summary['correlated']}, failed {summary['failed']} "
+                 f"in {monotonic() - start:.1f}s")
+    return summary
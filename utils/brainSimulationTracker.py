@@ -0,0 +1,279 @@
+"""
+WorldQuant Brain simulation 完成跟踪工具
+轮询模拟的Location直到完成，并把alpha的IS指标写入数据库
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+from time import monotonic
+from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from .brainLogin import API_URL
+from .brainMetrics import SIMULATION_RESULTS
+from .brainRateLimiter import parse_retry_after
+from .brainRetryPolicy import AUTH, THROTTLED, ApiError, RetryPolicy, api_breaker, classify_exception
+from .brainSimulationRecord import save_simulation_record
+
+SIMULATIONS_URL = f'{API_URL}/simulations'
+ALPHAS_URL = f'{API_URL}/alphas'
+
+# 需要写入数据库的IS指标
+IS_METRIC_KEYS = ['sharpe', 'fitness', 'turnover', 'returns', 'drawdown',
+                  'margin', 'longCount', 'shortCount', 'pnl']
+
+def extract_is_metrics(alpha: Dict) -> Dict:
+    """
+    从 /alphas/{id} 的响应中提取IS指标
+
+    Args:
+        alpha: alpha详情
+
+    Returns:
+        dict: sharpe、fitness、turnover等指标以及checks列表
+    """
+    is_data = alpha.get('is') or {}
+    metrics = {key: is_data[key] for key in IS_METRIC_KEYS if key in is_data}
+    metrics['checks'] = is_data.get('checks', [])
+    return metrics
+
+
+class _Entry:
+    """一个待轮询的模拟（multi-simulation时包含多个表达式）"""
+    __slots__ = ('location', 'regulars', 'sim_hashes', 'multi', 'future', 'errors')
+
+    def __init__(self, location: str, regulars: List[str], sim_hashes: List[Optional[str]],
+                 multi: bool, future: asyncio.Future):
+        self.location = location
+        self.regulars = regulars
+        self.sim_hashes = sim_hashes
+        self.multi = multi
+        self.future = future
+        self.errors = 0
+
+    @property
+    def regular(self) -> str:
+        return ', '.join(self.regulars)
+
+
+class SimulationTracker:
+    def __init__(self, session, poll_concurrency: int = 4,
+                 default_interval: float = 5.0, max_poll_errors: int = 5,
+                 retry_policy: Optional[RetryPolicy] = None):
+        """
+        模拟完成跟踪器
+
+        所有待完成的模拟按下次轮询时间放在一个堆里，由少量请求线程
+        轮流轮询，而不是每个模拟占用一个阻塞线程
+
+        Args:
+            session: Brain会话对象
+            poll_concurrency: 同时进行的轮询请求数
+            default_interval: 服务器未给出Retry-After时的轮询间隔(秒)
+            max_poll_errors: 单个模拟连续轮询出错(5xx、连接失败)的最大次数
+            retry_policy: 轮询出错时的重试策略，默认以 default_interval 为基础指数退避
+        """
+        self.session = session
+        self.poll_concurrency = poll_concurrency
+        self.default_interval = default_interval
+        self.max_poll_errors = max_poll_errors
+        self.retry_policy = retry_policy or RetryPolicy(max_attempts=max_poll_errors,
+                                                        base_delay=default_interval)
+        self._heap = []
+        self._seq = itertools.count()
+        self._tasks = set()
+        self._closed = False
+
+    @property
+    def pending(self) -> int:
+        """等待完成的模拟数量"""
+        return len(self._heap) + len(self._tasks)
+
+    def start(self) -> asyncio.Task:
+        """在当前事件循环中启动调度"""
+        self._wakeup = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=self.poll_concurrency,
+                                            thread_name_prefix='brain-poll')
+        self._task = asyncio.ensure_future(self._run())
+        return self._task
+
+    async def close(self):
+        """等待所有已跟踪的模拟完成后停止调度"""
+        self._closed = True
+        self._wakeup.set()
+        await self._task
+
+    def track(self, location: str, regular: str,
+              sim_hash: Optional[str] = None) -> asyncio.Future:
+        """
+        跟踪一个模拟
+
+        Args:
+            location: POST /simulations 返回的Location
+            regular: Alpha表达式
+            sim_hash: 模拟配置哈希（用于定位记录）
+
+        Returns:
+            asyncio.Future: 模拟结束时得到结果字典
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._schedule(_Entry(location, [regular], [sim_hash], False, future), 0)
+        return future
+
+    def track_multi(self, location: str, regulars: List[str],
+                    sim_hashes: Optional[List[Optional[str]]] = None) -> asyncio.Future:
+        """
+        跟踪一个multi-simulation
+
+        Args:
+            location: POST /simulations 返回的Location
+            regulars: 按提交顺序排列的Alpha表达式
+            sim_hashes: 与 regulars 对应的模拟配置哈希
+
+        Returns:
+            asyncio.Future: 结束时得到与 regulars 一一对应的结果列表
+        """
+        future = asyncio.get_running_loop().create_future()
+        sim_hashes = list(sim_hashes) if sim_hashes else [None] * len(regulars)
+        self._schedule(_Entry(location, list(regulars), sim_hashes, True, future), 0)
+        return future
+
+    def _schedule(self, entry: _Entry, delay: float):
+        heapq.heappush(self._heap, (monotonic() + delay, next(self._seq), entry))
+        self._wakeup.set()
+
+    async def _call(self, func, *args, **kwargs):
+        """在轮询线程池中执行阻塞调用"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    async def _run(self):
+        """调度循环：把到期的模拟交给轮询线程"""
+        semaphore = asyncio.Semaphore(self.poll_concurrency)
+        try:
+            while not (self._closed and not self._heap and not self._tasks):
+                while self._heap and self._heap[0][0] <= monotonic():
+                    await semaphore.acquire()
+                    _, _, entry = heapq.heappop(self._heap)
+                    task = asyncio.ensure_future(self._poll(entry))
+                    self._tasks.add(task)
+                    task.add_done_callback(partial(self._on_poll_done, semaphore, entry))
+
+                timeout = max(self._heap[0][0] - monotonic(), 0) if self._heap else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._executor.shutdown(wait=False)
+
+    def _on_poll_done(self, semaphore: asyncio.Semaphore, entry: _Entry, task: asyncio.Task):
+        semaphore.release()
+        self._tasks.discard(task)
+        self._wakeup.set()
+        # 记录结果时出错，把异常交给等待方
+        if not task.cancelled() and task.exception() and not entry.future.done():
+            entry.future.set_exception(task.exception())
+
+    async def _poll(self, entry: _Entry):
+        """轮询一次，未完成则按Retry-After重新排期"""
+        generation = getattr(self.session, 'generation', None)
+        try:
+            response = await self._call(self.session.get, entry.location)
+            if response.status_code >= 400:
+                raise ApiError.from_response(response, 'Progress poll')
+
+            retry_after = parse_retry_after(response, 0)
+            if retry_after > 0:
+                self._schedule(entry, retry_after)
+                return
+
+            entry.errors = 0
+            progress = response.json()
+            if entry.multi:
+                result = await self._complete_multi(entry, progress)
+            else:
+                result = await self._complete(entry.regulars[0], entry.sim_hashes[0],
+                                              entry.location, progress)
+
+        except Exception as e:
+            kind = classify_exception(e)
+            retry_after = getattr(e, 'retry_after', None)
+            if kind == THROTTLED:
+                # 限流不计入出错次数
+                self._schedule(entry, retry_after or self.default_interval)
+                return
+            entry.errors += 1
+            logging.error(f"Progress poll error ({kind}) - Expression: {entry.regular}, "
+                          f"Attempt {entry.errors}: {str(e)}")
+            if self.retry_policy.should_retry(kind, entry.errors):
+                if kind == AUTH:
+                    await self._call(self.session.reauthenticate, generation)
+                # 熔断期间推迟到恢复之后再轮询
+                delay = self.retry_policy.delay(kind, entry.errors, retry_after)
+                self._schedule(entry, max(delay, api_breaker.remaining()))
+                return
+            extra_info = {'error': str(e), 'error_kind': kind, 'location': entry.location}
+            result = [await self._fail(regular, sim_hash, extra_info)
+                      for regular, sim_hash in zip(entry.regulars, entry.sim_hashes)]
+            if not entry.multi:
+                result = result[0]
+
+        if not entry.future.done():
+            entry.future.set_result(result)
+
+    async def _complete_multi(self, entry: _Entry, progress: Dict) -> List[Dict]:
+        """multi-simulation结束：按提交顺序逐个处理子模拟"""
+        children = progress.get('children') or []
+        if len(children) != len(entry.regulars):
+            error = progress.get('message', progress.get('status'))
+            return [await self._fail(regular, sim_hash, {'error': error, 'location': entry.location})
+                    for regular, sim_hash in zip(entry.regulars, entry.sim_hashes)]
+
+        results = []
+        for regular, sim_hash, child in zip(entry.regulars, entry.sim_hashes, children):
+            location = f"{SIMULATIONS_URL}/{child}"
+            child_resp = await self._call(self.session.get, location)
+            if child_resp.status_code != 200:
+                raise ApiError.from_response(child_resp, 'Child simulation fetch')
+            results.append(await self._complete(regular, sim_hash, location, child_resp.json()))
+        return results
+
+    async def _complete(self, regular: str, sim_hash: Optional[str], location: str,
+                        progress: Dict) -> Dict:
+        """模拟结束：获取alpha详情并保存IS指标"""
+        alpha_id = progress.get('alpha')
+        if progress.get('status') not in (None, 'COMPLETE', 'WARNING') or not alpha_id:
+            return await self._fail(regular, sim_hash, {
+                'error': progress.get('message', progress.get('status')),
+                'location': location
+            })
+
+        alpha_resp = await self._call(self.session.get, f"{ALPHAS_URL}/{alpha_id}")
+        if alpha_resp.status_code != 200:
+            raise ApiError.from_response(alpha_resp, 'Alpha fetch')
+        metrics = extract_is_metrics(alpha_resp.json())
+
+        await self._call(save_simulation_record,
+                         alpha_id=alpha_id,
+                         datafield=regular,
+                         status='success',
+                         extra_info={'is_metrics': metrics},
+                         sim_hash=sim_hash)
+        SIMULATION_RESULTS.inc(status='success')
+        return {'regular': regular, 'status': 'success',
+                'alpha_id': alpha_id, 'is_metrics': metrics}
+
+    async def _fail(self, regular: str, sim_hash: Optional[str], extra_info: Dict) -> Dict:
+        """模拟出错：记录失败"""
+        await self._call(save_simulation_record,
+                         alpha_id=None,
+                         datafield=regular,
+                         status='failed',
+                         extra_info=extra_info,
+                         sim_hash=sim_hash)
+        SIMULATION_RESULTS.inc(status='failed')
+        return {'regular': regular, 'status': 'failed', 'error': extra_info.get('error')}
@@ -0,0 +1,151 @@
+"""
+WorldQuant Brain simulation 多进程工作者
+多个进程（可以在不同机器、使用不同账户）从同一个alphas集合中领取任务，
+通过租约和心跳保证每个alpha只被提交一次
+"""
+import logging
+import os
+import socket
+from threading import Event, Thread
+from typing import Dict, Iterable, Iterator, List, Optional
+from uuid import uuid4
+
+from .brainPriority import DEFAULT_FAIR_SHARE
+from .brainSimulationConfig import get_simulation_hash
+from .brainSimulationRecord import db
+
+# 默认租约时长(秒)，领取者失联超过该时间后任务被回收
+DEFAULT_LEASE_SECONDS = 300
+
+# 默认心跳间隔(秒)
+DEFAULT_HEARTBEAT_INTERVAL = 30
+
+def make_worker_id() -> str:
+    """生成工作者ID：主机名:进程号:随机后缀"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:6]}"
+
+
+class SimulationWorker:
+    def __init__(self, worker_id: Optional[str] = None,
+                 lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                 heartbeat_interval: float = DEFAULT_HEARTBEAT_INTERVAL,
+                 claim_size: int = 100, fair_share: float = DEFAULT_FAIR_SHARE):
+        """
+        模拟任务领取者
+
+        领取的记录状态为claimed，带有 owner 和 lease_expires。后台心跳线程
+        定期为持有的记录续约，并把其他已失联领取者的过期记录放回队列。
+        提交前再确认一次仍持有该记录，租约被回收的alpha不会重复提交
+
+        Args:
+            worker_id: 工作者ID，默认由主机名和进程号生成
+            lease_seconds: 租约时长(秒)
+            heartbeat_interval: 心跳间隔(秒)，应明显小于租约时长
+            claim_size: 每次领取的数量
+            fair_share: 每次领取中按活动(campaign)轮流分配的名额比例，其余按优先级
+        """
+        if heartbeat_interval >= lease_seconds:
+            raise ValueError("heartbeat_interval must be shorter than lease_seconds")
+        self.worker_id = worker_id or make_worker_id()
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = heartbeat_interval
+        self.claim_size = claim_size
+        self.fair_share = fair_share
+        self.claimed = 0
+        self.lost = 0
+        self._stop = Event()
+        self._thread = None
+
+    def start(self):
+        """登记工作者并启动心跳线程"""
+        db.reap_expired_claims()
+        self._beat()
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='brain-heartbeat', daemon=True)
+        self._thread.start()
+        logging.info(f"Worker {self.worker_id} started")
+
+    def stop(self):
+        """停止心跳，把尚未提交的记录放回队列"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        released = db.release_claims(self.worker_id)
+        db.unregister_worker(self.worker_id)
+        logging.info(f"Worker {self.worker_id} stopped, released {released} unsubmitted alphas")
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _beat(self):
+        db.heartbeat(self.worker_id, {'host': socket.gethostname(), 'pid': os.getpid(),
+                                      'claimed': self.claimed, 'lost': self.lost})
+
+    def _run(self):
+        """心跳循环：续约、登记心跳、回收过期租约"""
+        while not self._stop.wait(self.heartbeat_interval):
+            try:
+                db.renew_leases(self.worker_id, self.lease_seconds)
+                self._beat()
+                db.reap_expired_claims()
+            except Exception as e:
+                logging.error(f"Heartbeat error for worker {self.worker_id}: {str(e)}")
+
+    def claim(self, statuses: Iterable[str] = ('pending',), batch_id: Optional[str] = None,
+              sim_hashes: Optional[List[str]] = None, limit: Optional[int] = None) -> List[Dict]:
+        """
+        领取一批Alpha
+
+        Args:
+            statuses: 可领取的状态
+            batch_id: 领取的记录所属批次
+            sim_hashes: 只在这些模拟配置哈希中领取
+            limit: 最多领取数量，默认 claim_size
+
+        Returns:
+            list: 领取到的Alpha配置
+        """
+        alphas = db.claim_alphas(self.worker_id, statuses, limit or self.claim_size,
+                                 self.lease_seconds, batch_id, sim_hashes, self.fair_share)
+        self.claimed += len(alphas)
+        return alphas
+
+    def iter_claims(self, statuses: Iterable[str] = ('pending',),
+                    batch_id: Optional[str] = None) -> Iterator[Dict]:
+        """
+        持续领取直到队列中没有可领取的记录
+
+        按需逐批领取，领取量只比模拟引擎的预读多一批
+
+        Yields:
+            dict: 领取到的Alpha配置
+        """
+        statuses = list(statuses)
+        while not self._stop.is_set():
+            alphas = self.claim(statuses, batch_id)
+            if not alphas:
+                return
+            yield from alphas
+
+    def confirm(self, alphas: List[Dict]) -> List[Dict]:
+        """
+        提交前确认仍持有这些记录（同时续约）
+
+        Args:
+            alphas: 即将提交的Alpha配置
+
+        Returns:
+            list: 仍由本工作者持有、可以提交的Alpha配置
+        """
+        hashes = [get_simulation_hash(alpha) for alpha in alphas]
+        held = db.confirm_claims(self.worker_id, hashes, self.lease_seconds)
+        if len(held) < len(alphas):
+            self.lost += len(alphas) - len(held)
+            logging.warning(f"Worker {self.worker_id} lost {len(alphas) - len(held)} "
+                            f"expired claims, skipping them")
+        return [alpha for alpha, sim_hash in zip(alphas, hashes) if sim_hash in held]